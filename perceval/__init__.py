@@ -23,8 +23,10 @@
 import logging
 
 from ._version import __version__
-from .backend import find_backends
+from .backend import (find_backends,
+                      find_backend_modules,
+                      import_backend)
 
-__all__ = [__version__, find_backends]
+__all__ = [__version__, find_backends, find_backend_modules, import_backend]
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
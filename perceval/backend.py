@@ -22,19 +22,43 @@
 
 import argparse
 import functools
+import gzip
 import hashlib
 import importlib
 import json
+import os
 import pkgutil
 import sys
 
 from datetime import datetime as dt
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from grimoirelab.toolkit.introspect import find_signature_parameters
 from grimoirelab.toolkit.datetime import str_to_datetime
 
 from ._version import __version__
-from .cache import Cache, setup_cache
+from .cache import (CACHE_DEFAULT_CODEC,
+                    CODECS,
+                    Cache,
+                    setup_cache)
+from .client import HttpCache, HttpClient
+from .profiler import (Profiler,
+                       count_bytes_out,
+                       stage)
 from .utils import DEFAULT_DATETIME
 
 
@@ -123,7 +147,8 @@ class Backend:
     def _flush_cache_queue(self):
         if not self.cache:
             return
-        self.cache.store(*self.cache_queue)
+        with stage('cache'):
+            self.cache.store(*self.cache_queue)
         self._purge_cache_queue()
 
     def _push_cache_queue(self, item):
@@ -188,6 +213,8 @@ class BackendCommandArgumentParser:
             self._set_cache_arguments()
 
         self._set_output_arguments()
+        self._set_http_cache_arguments()
+        self._set_profile_arguments()
 
     def parse(self, *args):
         """Parse a list of arguments.
@@ -210,6 +237,8 @@ class BackendCommandArgumentParser:
         if self._cache and parsed_args.fetch_cache and parsed_args.no_cache:
             raise AttributeError("fetch-cache and no-cache arguments are not compatible")
 
+        self._parse_output_arguments(parsed_args)
+
         # Set aliases
         for alias, arg in self.aliases.items():
             if (alias not in parsed_args) and (arg in parsed_args):
@@ -244,14 +273,66 @@ class BackendCommandArgumentParser:
                            help="do not store data in the cache")
         group.add_argument('--fetch-cache', dest='fetch_cache', action='store_true',
                            help="fetch data from the cache")
+        group.add_argument('--cache-codec', dest='cache_codec',
+                           choices=sorted(CODECS), default=CACHE_DEFAULT_CODEC,
+                           help="codec used to compress the data of new caches")
 
     def _set_output_arguments(self):
         """Activate output arguments parsing"""
 
         group = self.parser.add_argument_group('output arguments')
-        group.add_argument('-o', '--output', type=argparse.FileType('w'),
-                           dest='outfile', default=sys.stdout,
+        group.add_argument('-o', '--output', dest='outfile', default=sys.stdout,
                            help="output file")
+        group.add_argument('--output-format', dest='output_format',
+                           choices=['json', 'ndjson'], default='json',
+                           help="format of the items; 'ndjson' writes one compact item per line")
+        group.add_argument('--output-compression', dest='output_compression',
+                           choices=sorted(OutputSink.available_compressions()),
+                           default=None,
+                           help="compress output files using this format")
+        group.add_argument('--output-rotate-items', dest='output_rotate_items',
+                           type=int, default=None,
+                           help="write a new output file after this number of items")
+        group.add_argument('--output-rotate-bytes', dest='output_rotate_bytes',
+                           type=int, default=None,
+                           help="write a new output file after this number of bytes")
+
+    def _set_http_cache_arguments(self):
+        """Activate HTTP cache arguments parsing"""
+
+        group = self.parser.add_argument_group('HTTP cache arguments')
+        group.add_argument('--http-cache', dest='http_cache', default=None,
+                           help="directory where HTTP responses are stored to revalidate them")
+
+    def _set_profile_arguments(self):
+        """Activate profiling arguments parsing"""
+
+        group = self.parser.add_argument_group('profiling arguments')
+        group.add_argument('--profile', dest='profile', action='store_true',
+                           help="print a report of the time spent on each stage of the run")
+        group.add_argument('--profile-output', dest='profile_output', default=None,
+                           help="write cProfile stats of the run to this file; implies --profile")
+        group.add_argument('--http-metrics', dest='http_metrics', default=None,
+                           help="write the metrics of the HTTP requests to this file")
+        group.add_argument('--http-metrics-format', dest='http_metrics_format',
+                           choices=['json', 'prometheus'], default='json',
+                           help="format of the HTTP metrics file")
+
+    def _parse_output_arguments(self, parsed_args):
+        """Open the output file or check the output sink arguments.
+
+        When compression or rotation are set, the output is written
+        by an `OutputSink` object, so only the path of the output is
+        kept. Otherwise, the output file is opened.
+        """
+        if needs_output_sink(parsed_args):
+            if not isinstance(parsed_args.outfile, str) or parsed_args.outfile == '-':
+                raise AttributeError("output compression and rotation require an output file")
+        elif isinstance(parsed_args.outfile, str):
+            try:
+                parsed_args.outfile = argparse.FileType('w')(parsed_args.outfile)
+            except argparse.ArgumentTypeError as e:
+                self.parser.error(str(e))
 
 
 class BackendCommand:
@@ -268,8 +349,22 @@ class BackendCommand:
 
     Moreover, the method `setup_cmd_parser` must be implemented to exectute
     the backend.
+
+    Items are written as indented JSON objects. When the output format
+    is set to 'ndjson', each item is written as a compact JSON object
+    in a single line. These lines are buffered and written in blocks
+    of `OUTPUT_BUFFER_SIZE` bytes. When compression or rotation of the
+    output are set, items are written using an `OutputSink` object.
+
+    When `profile` argument is set, the run is measured by a `Profiler`
+    object and a report with the time spent on each stage is written
+    to stderr once it finishes. The metrics of the HTTP client of the
+    backend, if any, are written to the file set by `http_metrics`.
+    When `http_cache` is set, that client revalidates the responses
+    stored in that directory instead of downloading them again.
     """
     BACKEND = None
+    OUTPUT_BUFFER_SIZE = 1024 * 1024
 
     def __init__(self, *args):
         parser = self.setup_cmd_parser()
@@ -281,10 +376,24 @@ class BackendCommand:
         kw = find_signature_parameters(self.BACKEND.__init__, parsed_args)
         self.backend = self.BACKEND(**kw)
         self.backend.cache = self._initialize_cache()
+        self._initialize_http_cache()
 
         self._post_init()
 
-        self.outfile = self.parsed_args.outfile
+        if needs_output_sink(self.parsed_args):
+            self.outfile = None
+            self.sink = OutputSink(self.parsed_args.outfile,
+                                   compression=self.parsed_args.output_compression,
+                                   max_items=self.parsed_args.output_rotate_items,
+                                   max_bytes=self.parsed_args.output_rotate_bytes)
+        else:
+            self.outfile = self.parsed_args.outfile
+            self.sink = None
+
+        if self.parsed_args.profile or self.parsed_args.profile_output:
+            self.profiler = Profiler(profile_path=self.parsed_args.profile_output)
+        else:
+            self.profiler = None
 
     def run(self):
         """Fetch and write items.
@@ -306,17 +415,111 @@ class BackendCommand:
         kw = find_signature_parameters(fetch, parsed_args)
         items = fetch(**kw)
 
+        if self.profiler:
+            self.profiler.start()
+            items = self.profiler.track_items(items, 'output')
+
         try:
-            for item in items:
-                obj = json.dumps(item, indent=4, sort_keys=True)
-                self.outfile.write(obj)
-                self.outfile.write('\n')
+            if self.sink:
+                self._write_sink(items)
+            elif self.parsed_args.output_format == 'ndjson':
+                self._write_ndjson(items)
+            else:
+                self._write_json(items)
         except IOError as e:
             raise RuntimeError(str(e))
         except Exception as e:
             if self.backend.cache:
                 self.backend.cache.recover()
             raise RuntimeError(str(e))
+        finally:
+            if self.profiler:
+                self.profiler.stop()
+                sys.stderr.write(self.profiler.report() + '\n')
+            if self.parsed_args.http_metrics:
+                self._write_http_metrics()
+
+    def _write_json(self, items):
+        """Write items as indented JSON objects"""
+
+        for item in items:
+            obj = json.dumps(item, indent=4, sort_keys=True)
+            self.outfile.write(obj)
+            self.outfile.write('\n')
+
+            # Encoding the output is only worth it when profiling
+            if self.profiler:
+                count_bytes_out(len(obj.encode('utf-8')) + 1)
+
+    def _write_ndjson(self, items):
+        """Write items as JSON lines using a buffer"""
+
+        # Write encoded data directly to the binary buffer, if any
+        stream = getattr(self.outfile, 'buffer', None)
+
+        if stream:
+            self.outfile.flush()
+        else:
+            stream = self.outfile
+
+        def write(data):
+            count_bytes_out(len(data))
+            if stream is self.outfile:
+                data = data.decode('utf-8')
+            stream.write(data)
+
+        lines = []
+        size = 0
+
+        try:
+            for item in items:
+                line = json_dumps_compact(item)
+                lines.append(line)
+                size += len(line) + 1
+
+                if size >= self.OUTPUT_BUFFER_SIZE:
+                    lines.append(b'')
+                    write(b'\n'.join(lines))
+                    lines = []
+                    size = 0
+        finally:
+            if lines:
+                lines.append(b'')
+                write(b'\n'.join(lines))
+            stream.flush()
+
+    def _write_sink(self, items):
+        """Write items to the output sink"""
+
+        ndjson = self.parsed_args.output_format == 'ndjson'
+
+        try:
+            for item in items:
+                if ndjson:
+                    data = json_dumps_compact(item)
+                else:
+                    data = json.dumps(item, indent=4, sort_keys=True).encode('utf-8')
+                self.sink.write(data + b'\n')
+                count_bytes_out(len(data) + 1)
+        finally:
+            self.sink.close()
+
+    def _write_http_metrics(self):
+        """Write the metrics of the HTTP client of the backend"""
+
+        client = getattr(self.backend, 'client', None)
+        metrics = getattr(client, 'metrics', None)
+
+        if not metrics:
+            return
+
+        if self.parsed_args.http_metrics_format == 'prometheus':
+            data = metrics.to_prometheus()
+        else:
+            data = metrics.to_json()
+
+        with open(self.parsed_args.http_metrics, 'w') as fd:
+            fd.write(data)
 
     def _pre_init(self):
         """Override to execute before backend is initialized."""
@@ -337,13 +540,189 @@ class BackendCommand:
 
         return setup_cache(self.backend.origin,
                            cache_path=self.parsed_args.cache_path,
-                           clean_cache=self.parsed_args.clean_cache)
+                           clean_cache=self.parsed_args.clean_cache,
+                           codec=self.parsed_args.cache_codec)
+
+    def _initialize_http_cache(self):
+        """Set the HTTP cache of the client of the backend, if any"""
+
+        if not getattr(self.parsed_args, 'http_cache', None):
+            return
+
+        client = getattr(self.backend, 'client', None)
+
+        if isinstance(client, HttpClient):
+            client.http_cache = HttpCache(self.parsed_args.http_cache)
 
     @staticmethod
     def setup_cmd_parser():
         raise NotImplementedError
 
 
+class OutputSink:
+    """Write items to a set of output files.
+
+    Items, already encoded, are written to the file set by `path`.
+    The files can be compressed on the fly using the formats 'gzip'
+    or 'zstd' (when `zstandard` package is installed).
+
+    When `max_items` or `max_bytes` are set, a new file is started
+    every time the current one reaches any of these limits. Files are
+    named after `path` adding a sequence number to their names (i.e,
+    'items.json.00000.gz', 'items.json.00001.gz'). Size limits are
+    computed on uncompressed data and an item is never split between
+    two files.
+
+    Every time a file is completed, it is added to a manifest file
+    ('<path>.manifest') together with its number of items and bytes.
+    Thus, completed files can be read while items are being written.
+
+    :param path: path to the output file
+    :param compression: compress files using this format
+    :param max_items: maximum number of items per file
+    :param max_bytes: maximum number of bytes per file
+
+    :raises ValueError: when the compression format is not available
+    """
+    EXTENSIONS = {
+        None: '',
+        'gzip': '.gz',
+        'zstd': '.zst'
+    }
+
+    def __init__(self, path, compression=None, max_items=None, max_bytes=None):
+        if compression not in self.available_compressions() + [None]:
+            raise ValueError("compression %s not available" % compression)
+
+        ext = self.EXTENSIONS[compression]
+
+        if ext and path.endswith(ext):
+            path = path[:-len(ext)]
+
+        self.path = path
+        self.compression = compression
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.manifest_path = self.manifest(path, compression)
+        self.files = []
+
+        self._ext = ext
+        self._fd = None
+        self._stream = None
+        self._filepath = None
+        self._nitems = 0
+        self._nbytes = 0
+
+    @classmethod
+    def manifest(cls, path, compression=None):
+        """Returns the path of the manifest of the output `path`"""
+
+        ext = cls.EXTENSIONS.get(compression, '')
+
+        if ext and path.endswith(ext):
+            path = path[:-len(ext)]
+
+        return path + '.manifest'
+
+    @staticmethod
+    def available_compressions():
+        """Returns the list of available compression formats"""
+
+        compressions = ['gzip']
+
+        if zstandard:
+            compressions.append('zstd')
+
+        return compressions
+
+    def write(self, data):
+        """Write an encoded item.
+
+        :param data: item encoded as bytes
+        """
+        if not self._stream:
+            self._open()
+
+        self._stream.write(data)
+        self._nitems += 1
+        self._nbytes += len(data)
+
+        rotate_items = self.max_items and self._nitems >= self.max_items
+        rotate_bytes = self.max_bytes and self._nbytes >= self.max_bytes
+
+        if rotate_items or rotate_bytes:
+            self._close_file()
+            self._write_manifest(completed=False)
+
+    def close(self):
+        """Close the current file and complete the manifest"""
+
+        self._close_file()
+        self._write_manifest(completed=True)
+
+    def _open(self):
+        if self.max_items or self.max_bytes:
+            filepath = '%s.%05d%s' % (self.path, len(self.files), self._ext)
+        else:
+            filepath = self.path + self._ext
+
+        self._fd = open(filepath, 'wb')
+        self._filepath = filepath
+
+        if self.compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._fd, mode='wb')
+        elif self.compression == 'zstd':
+            cctx = zstandard.ZstdCompressor()
+            self._stream = cctx.stream_writer(self._fd)
+        else:
+            self._stream = self._fd
+
+    def _close_file(self):
+        if not self._stream:
+            return
+
+        self._stream.close()
+
+        if not self._fd.closed:
+            self._fd.close()
+
+        self.files.append({
+            'path': os.path.basename(self._filepath),
+            'items': self._nitems,
+            'bytes': self._nbytes
+        })
+
+        self._fd = None
+        self._stream = None
+        self._filepath = None
+        self._nitems = 0
+        self._nbytes = 0
+
+    def _write_manifest(self, completed):
+        manifest = {
+            'completed': completed,
+            'compression': self.compression,
+            'files': self.files
+        }
+
+        # Replace the manifest at once, so readers never find
+        # a partial file
+        tmp_path = self.manifest_path + '.tmp'
+
+        with open(tmp_path, 'w') as fd:
+            json.dump(manifest, fd, indent=4, sort_keys=True)
+
+        os.replace(tmp_path, self.manifest_path)
+
+
+def needs_output_sink(parsed_args):
+    """Check whether the output must be written by an `OutputSink`"""
+
+    args = ['output_compression', 'output_rotate_items', 'output_rotate_bytes']
+
+    return any(getattr(parsed_args, arg, None) for arg in args)
+
+
 def metadata(func):
     """Add metadata to an item.
 
@@ -358,22 +737,47 @@ def metadata(func):
     @functools.wraps(func)
     def decorator(self, *args, **kwargs):
         for data in func(self, *args, **kwargs):
-            item = {
-                'backend_name': self.__class__.__name__,
-                'backend_version': self.version,
-                'perceval_version': __version__,
-                'timestamp': dt.utcnow().timestamp(),
-                'origin': self.origin,
-                'uuid': uuid(self.origin, self.metadata_id(data)),
-                'updated_on': self.metadata_updated_on(data),
-                'category': self.metadata_category(data),
-                'tag': self.tag,
-                'data': data,
-            }
+            with stage('metadata'):
+                item = {
+                    'backend_name': self.__class__.__name__,
+                    'backend_version': self.version,
+                    'perceval_version': __version__,
+                    'timestamp': dt.utcnow().timestamp(),
+                    'origin': self.origin,
+                    'uuid': uuid(self.origin, self.metadata_id(data)),
+                    'updated_on': self.metadata_updated_on(data),
+                    'category': self.metadata_category(data),
+                    'tag': self.tag,
+                    'data': data,
+                }
             yield item
     return decorator
 
 
+def json_dumps_compact(item):
+    """Encode an item as a compact JSON object.
+
+    The item is encoded without whitespaces and without sorting its
+    keys. When `orjson` or `ujson` packages are installed, they will
+    be used to encode the item. Otherwise, or when these encoders are
+    not able to encode the item (i.e, strings with surrogates), the
+    standard `json` module is used.
+
+    :param item: item to encode
+
+    :returns: a JSON object encoded in UTF-8
+    """
+    try:
+        if orjson:
+            return orjson.dumps(item)
+        elif ujson:
+            return ujson.dumps(item).encode('utf-8')
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    return json.dumps(item, separators=(',', ':')).encode('utf-8')
+
+
 def uuid(*args):
     """Generate a UUID based on the given parameters.
 
@@ -417,12 +821,52 @@ def find_backends(top_package):
     :returns: a tuple with two dicts: one with `Backend` classes and one
         with `BackendCommand` classes
     """
+    modules = find_backend_modules(top_package)
+
+    return _import_backends(list(modules.values()))
+
+
+def find_backend_modules(top_package):
+    """Find the modules of the available backends.
+
+    Look for the Perceval backend modules under `top_package` and
+    its sub-packages, like `find_backends` does, but without importing
+    them. Each backend is named after its module, so this registry
+    allows to import only the backends that are going to be used,
+    together with their dependencies, calling to `import_backend`.
+
+    :param top_package: package storing backends
+
+    :returns: a dict with the full name of the module of each backend
+        by backend name
+    """
     candidates = pkgutil.walk_packages(top_package.__path__,
                                        prefix=top_package.__name__ + '.')
 
-    modules = [name for _, name, is_pkg in candidates if not is_pkg]
+    modules = {}
+
+    for _, module, is_pkg in candidates:
+        if is_pkg:
+            continue
+        modules[module.split('.')[-1]] = module
+
+    return modules
+
+
+def import_backend(module):
+    """Import a backend module and return its classes.
+
+    :param module: full name of the module of the backend
+
+    :returns: a tuple with the `Backend` and `BackendCommand` classes
+        defined in the module; any of them will be `None` when the
+        module does not define it
+    """
+    backends, commands = _import_backends([module])
+
+    name = module.split('.')[-1]
 
-    return _import_backends(modules)
+    return backends.get(name, None), commands.get(name, None)
 
 
 def _import_backends(modules):
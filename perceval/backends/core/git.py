@@ -21,15 +21,25 @@
 #
 
 import collections
+import concurrent.futures
+import datetime
 import io
 import logging
+import mmap
 import os
 import re
+import stat
 import subprocess
 import threading
 
 import dulwich.client
+import dulwich.diff_tree
+import dulwich.lru_cache
+import dulwich.mailmap
+import dulwich.objects
+import dulwich.pack
 import dulwich.repo
+import dulwich.walk
 
 from grimoirelab.toolkit.datetime import datetime_to_utc, str_to_datetime
 
@@ -66,6 +76,11 @@ class Git(Backend):
     """
     version = '0.8.7'
 
+    MIN_LOG_CHUNK_SIZE = 4 * 1024 * 1024
+    MAX_LOG_CHUNK_SIZE = 16 * 1024 * 1024
+    LOG_CHUNKS_PER_WORKER = 4
+    PENDING_LOG_CHUNKS_PER_WORKER = 2
+
     def __init__(self, uri, gitpath, tag=None, cache=None):
         origin = uri
 
@@ -75,7 +90,8 @@ class Git(Backend):
 
     @metadata
     def fetch(self, from_date=DEFAULT_DATETIME, branches=None,
-              latest_items=False):
+              latest_items=False, fast_log=False, log_workers=None,
+              details='full', incremental=False, walk_commits=False):
         """Fetch commits.
 
         The method retrieves from a Git repository or a log file
@@ -97,6 +113,41 @@ class Git(Backend):
         when the commits are fetched from a Git log file or when
         `latest_items` flag is set.
 
+        When `fast_log` is set, the log is read from the repository
+        using a NUL-delimited format, which is faster to parse. The
+        commits have the same structure in both cases.
+
+        When `log_workers` is set, the log is split into ranges of
+        commits that are read and parsed by that number of processes.
+        Commits are returned in the same order. This parameter is also
+        used when the commits are fetched from a Git log file.
+
+        The parameter `details` sets the data about files included on
+        each commit: 'full' (default) includes actions and stats; 'raw'
+        includes only the actions; and 'metadata' does not include any
+        data about files. The repository is cloned using a partial clone
+        filter ('blob:none' for 'raw' and 'tree:0' for 'metadata'), so
+        the objects not needed are neither downloaded nor stored. The
+        filter set when the repository was cloned is used on updates.
+        As the contents of the files are not available with 'raw', only
+        renames and copies of unchanged files are detected.
+
+        When `incremental` is set, only the commits that were not
+        fetched in the previous incremental run are returned. The heads
+        of the repository fetched on each run are stored on the
+        repository itself, under the namespace `refs/perceval/`, and
+        those commits reachable from them are skipped on the next run.
+        The heads are stored once all the commits were fetched. The
+        first time this mode is used all the commits are fetched.
+
+        When `walk_commits` is set, commits are read in-process using
+        dulwich instead of running `git log` and parsing its output.
+        Commits are the same, but those from different branches may
+        be returned in a different order. This mode is slower than
+        reading the log, so it is disabled by default. It is only
+        available when `details` is 'raw' or 'metadata' and it is
+        ignored when `latest_items` is set.
+
         The class raises a `RepositoryError` exception when an error
         occurs accessing the repository.
 
@@ -105,6 +156,13 @@ class Git(Backend):
         :param branches: names of branches to fetch from (default: None)
         :param latest_items: sync with the repository to fetch only the
             newest commits
+        :param fast_log: read the log using a NUL-delimited format
+        :param log_workers: number of processes reading the log
+        :param details: level of detail of the commits; 'full',
+            'raw' or 'metadata'
+        :param incremental: fetch only the commits not fetched on
+            the previous incremental run
+        :param walk_commits: walk the commits in-process
 
         :returns: a generator of commits
         """
@@ -112,10 +170,12 @@ class Git(Backend):
 
         try:
             if os.path.isfile(self.gitpath):
-                commits = self.__fetch_from_log()
+                commits = self.__fetch_from_log(log_workers)
             else:
                 commits = self.__fetch_from_repo(from_date, branches,
-                                                 latest_items)
+                                                 latest_items, fast_log,
+                                                 log_workers, details,
+                                                 incremental, walk_commits)
 
             for commit in commits:
                 yield commit
@@ -126,26 +186,36 @@ class Git(Backend):
         logger.info("Fetch process completed: %s commits fetched",
                     ncommits)
 
-    def __fetch_from_log(self):
+    def __fetch_from_log(self, log_workers=None):
         logger.info("Fetching commits: '%s' git repository from log file %s",
                     self.uri, self.gitpath)
-        return self.parse_git_log_from_file(self.gitpath)
+        return self.parse_git_log_from_file(self.gitpath, workers=log_workers)
 
-    def __fetch_from_repo(self, from_date, branches, latest_items=False):
+    def __fetch_from_repo(self, from_date, branches, latest_items=False,
+                          fast_log=False, log_workers=None, details='full',
+                          incremental=False, walk_commits=False):
         # When no latest items are set or the repository has not
         # been cloned use the default mode
         default_mode = not latest_items or not os.path.exists(self.gitpath)
 
-        repo = self.__create_git_repository()
+        repo = self.__create_git_repository(details)
 
-        if default_mode:
-            commits = self.__fetch_commits_from_repo(repo, from_date, branches)
+        if default_mode and incremental:
+            commits = self.__fetch_incremental_commits_from_repo(repo, from_date, branches,
+                                                                 fast_log, log_workers, details,
+                                                                 walk_commits)
+        elif default_mode:
+            commits = self.__fetch_commits_from_repo(repo, from_date, branches,
+                                                     fast_log, log_workers, details,
+                                                     walk_commits=walk_commits)
         else:
-            commits = self.__fetch_newest_commits_from_repo(repo)
+            commits = self.__fetch_newest_commits_from_repo(repo, fast_log, details)
 
         return commits
 
-    def __fetch_commits_from_repo(self, repo, from_date, branches):
+    def __fetch_commits_from_repo(self, repo, from_date, branches, fast_log=False,
+                                  log_workers=None, details='full', exclude_watermark=False,
+                                  walk_commits=False):
         if branches is None:
             branches_text = "all"
         elif len(branches) == 0:
@@ -165,10 +235,38 @@ class Git(Backend):
 
         repo.update()
 
-        gitlog = repo.log(from_date, branches)
-        return self.parse_git_log_from_iter(gitlog)
+        if walk_commits:
+            return repo.walk(from_date, branches, details=details,
+                             exclude_watermark=exclude_watermark)
+
+        if log_workers:
+            return repo.parallel_log(from_date, branches, nul_format=fast_log,
+                                     workers=log_workers, details=details,
+                                     exclude_watermark=exclude_watermark)
+
+        gitlog = repo.log(from_date, branches, nul_format=fast_log,
+                          details=details, exclude_watermark=exclude_watermark)
+        return self.parse_git_log_from_iter(gitlog, nul_format=fast_log)
 
-    def __fetch_newest_commits_from_repo(self, repo):
+    def __fetch_incremental_commits_from_repo(self, repo, from_date, branches, fast_log=False,
+                                              log_workers=None, details='full', walk_commits=False):
+        logger.info("Fetching commits incrementally: '%s' git repository; %s known heads",
+                    self.uri, len(repo.watermark()))
+
+        commits = self.__fetch_commits_from_repo(repo, from_date, branches,
+                                                 fast_log, log_workers, details,
+                                                 exclude_watermark=True,
+                                                 walk_commits=walk_commits)
+
+        # The repository was updated; these are the heads to log
+        heads = repo.heads(branches)
+
+        for commit in commits:
+            yield commit
+
+        repo.update_watermark(heads)
+
+    def __fetch_newest_commits_from_repo(self, repo, fast_log=False, details='full'):
         logger.info("Fetching latest commits: '%s' git repository",
                     self.uri)
 
@@ -176,12 +274,14 @@ class Git(Backend):
         if not hashes:
             return []
 
-        gitshow = repo.show(hashes)
-        return self.parse_git_log_from_iter(gitshow)
+        gitshow = repo.show(hashes, nul_format=fast_log, details=details)
+        return self.parse_git_log_from_iter(gitshow, nul_format=fast_log)
 
-    def __create_git_repository(self):
+    def __create_git_repository(self, details='full'):
         if not os.path.exists(self.gitpath):
-            repo = GitRepository.clone(self.uri, self.gitpath)
+            clone_filter = GitRepository.DETAILS_CLONE_FILTERS.get(details, None)
+            repo = GitRepository.clone(self.uri, self.gitpath,
+                                       clone_filter=clone_filter)
         elif os.path.isdir(self.gitpath):
             repo = GitRepository(self.uri, self.gitpath)
         return repo
@@ -235,13 +335,23 @@ class Git(Backend):
         return 'commit'
 
     @staticmethod
-    def parse_git_log_from_file(filepath):
+    def parse_git_log_from_file(filepath, workers=None):
         """Parse a Git log file.
 
         The method parses the Git log file and returns an iterator of
         dictionaries. Each one of this, contains a commit.
 
+        When `workers` is set, the file is mapped into memory and split
+        into chunks at the boundaries of the commits. These chunks are
+        parsed in parallel by that number of processes. Commits are
+        returned in the same order they are in the file. To limit the
+        memory used, chunks take `MAX_LOG_CHUNK_SIZE` bytes at most,
+        plus the rest of the last commit, and only
+        `PENDING_LOG_CHUNKS_PER_WORKER` chunks per worker are parsed
+        at the same time.
+
         :param filepath: path to the log file
+        :param workers: number of processes parsing the file
 
         :returns: a generator of parsed commits
 
@@ -250,6 +360,11 @@ class Git(Backend):
         :raises OSError: raised when an error occurs reading the
             given file
         """
+        if workers:
+            for commit in Git._parse_git_log_from_file_chunks(filepath, workers):
+                yield commit
+            return
+
         with open(filepath, 'r', errors='surrogateescape',
                   newline=os.linesep) as f:
             parser = GitParser(f)
@@ -258,23 +373,68 @@ class Git(Backend):
                 yield commit
 
     @staticmethod
-    def parse_git_log_from_iter(iterator):
+    def parse_git_log_from_iter(iterator, nul_format=False):
         """Parse a Git log obtained from an iterator.
 
         The method parses the Git log fetched from an iterator, where
         each item is a line of the log. It returns and iterator of
         dictionaries. Each dictionary contains a commit.
 
+        When `nul_format` is set, each item of the iterator is a field
+        of a NUL-delimited log, which is parsed using `GitNulParser`.
+
         :param iterator: iterator of Git log lines
+        :param nul_format: the log is NUL-delimited
 
         :raises ParseError: raised when the format of the Git log
             is invalid
         """
-        parser = GitParser(iterator)
+        if nul_format:
+            parser = GitNulParser(iterator)
+        else:
+            parser = GitParser(iterator)
 
         for commit in parser.parse():
             yield commit
 
+    @staticmethod
+    def _parse_git_log_from_file_chunks(filepath, workers):
+        """Parse a Git log file by chunks using a pool of processes"""
+
+        size = os.path.getsize(filepath)
+
+        if not size:
+            return
+
+        chunk_size = -(-size // (workers * Git.LOG_CHUNKS_PER_WORKER))
+        chunk_size = min(max(chunk_size, Git.MIN_LOG_CHUNK_SIZE), Git.MAX_LOG_CHUNK_SIZE)
+
+        with open(filepath, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            start = 0
+
+            while start < size:
+                # Chunks end right before the first commit
+                # found after the chunk size
+                end = mm.find(b'\ncommit ', start + chunk_size - 1)
+                end = size if end < 0 else end + 1
+
+                future = executor.submit(_parse_log_chunk, filepath, start, end)
+                pending.append(future)
+                start = end
+
+                if len(pending) < workers * Git.PENDING_LOG_CHUNKS_PER_WORKER:
+                    continue
+
+                for commit in pending.popleft().result():
+                    yield commit
+
+            while pending:
+                for commit in pending.popleft().result():
+                    yield commit
+
 
 class GitCommand(BackendCommand):
     """Class to run Git backend from the command line."""
@@ -288,7 +448,16 @@ class GitCommand(BackendCommand):
             git_path = self.parsed_args.git_log
         elif not self.parsed_args.git_path:
             base_path = os.path.expanduser('~/.perceval/repositories/')
-            git_path = os.path.join(base_path, self.parsed_args.uri) + '-git'
+            processed_uri = self.parsed_args.uri.lstrip('/')
+            git_path = os.path.join(base_path, processed_uri) + '-git'
+
+            # Repositories of local absolute paths were stored next
+            # to them by older versions; keep using them to not clone
+            # these repositories again
+            legacy_path = os.path.join(base_path, self.parsed_args.uri) + '-git'
+
+            if legacy_path != git_path and os.path.isdir(legacy_path):
+                git_path = legacy_path
         else:
             git_path = self.parsed_args.git_path
 
@@ -308,6 +477,22 @@ class GitCommand(BackendCommand):
         group.add_argument('--latest-items', dest='latest_items',
                            action='store_true',
                            help="Fetch latest commits added to the repository")
+        group.add_argument('--fast-log', dest='fast_log',
+                           action='store_true',
+                           help="Read the log using a NUL-delimited format, faster to parse")
+        group.add_argument('--log-workers', dest='log_workers',
+                           type=int, default=None,
+                           help="Read and parse the log using this number of processes")
+        group.add_argument('--details', dest='details',
+                           choices=['full', 'raw', 'metadata'], default='full',
+                           help="Data about files to fetch; partial clones are made for 'raw' and 'metadata'")
+        group.add_argument('--incremental', dest='incremental',
+                           action='store_true',
+                           help="Fetch only the commits not fetched on the previous incremental run")
+        group.add_argument('--walk-commits', dest='walk_commits',
+                           action='store_true',
+                           help="Walk the commits in-process instead of running 'git log', "
+                                "which is slower; requires '--details raw' or '--details metadata'")
 
         # Mutual exclusive parameters
         exgroup = group.add_mutually_exclusive_group()
@@ -667,6 +852,586 @@ class GitParser:
             return f
 
 
+class GitNulParser:
+    """Git log parser for NUL-delimited logs.
+
+    This class parses a Git log stream generated using the `-z`
+    option and the custom format defined in `GIT_NUL_FORMAT`. Commits
+    are converted into dict items with the same structure that
+    `GitParser` produces, but without matching each line against a
+    set of regular expressions.
+
+    The stream is an iterator of fields, which are the strings placed
+    between NUL chars on the log. Each commit starts with the fields
+    of the format: hash, parents, refs, author, author date, committer,
+    commit date, abbreviated parents and message. The message is
+    followed by the actions and stats over files, if any. An action
+    field starts with one or more ':' chars and is followed by the
+    filepath and, in the case of copied or renamed files, by the new
+    filepath:
+
+        :100644 100644 e69de29 e69de29 R100\0aaa/otherthing\0aaa/otherthing.renamed\0
+
+    A stats field includes the number of lines added and removed, and
+    the filepath. For copied or renamed files the filepath is empty
+    and the old and new filepaths are given in the next two fields:
+
+        10\t0\t\0aaa/otherthing\0aaa/otherthing.renamed\0
+
+    Like `GitParser` does, the stats of files renamed or copied out
+    of any common directory are stored on their own entry, named
+    'old => new', as git writes them on the default log.
+
+    The log is generated using the next command:
+
+        git log -z --format=<GIT_NUL_FORMAT> --raw --numstat \
+                --decorate=full --parents -M -C -c --all
+
+    Authors and committers are given applying the '.mailmap' file of
+    the repository, as `--pretty=fuller` does since Git 2.29.
+
+    :param stream: an iterator of NUL-delimited fields of the log
+    """
+    GIT_NUL_FORMAT = '%x00'.join(['%H', '%P', '%D', '%aN <%aE>', '%ad',
+                                  '%cN <%cE>', '%cd', '%p', '%B'])
+
+    TAB_SIZE = 8
+
+    # Chars considered as whitespace by git
+    WHITESPACE = ' \t\r'
+
+    # Git trailers
+    TRAILERS = GitParser.TRAILERS
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.ncommit = 0
+
+    def parse(self):
+        """Parse the NUL-delimited Git log stream."""
+
+        fields = iter(self.stream)
+        field = next(fields, None)
+
+        while field is not None:
+            field = field.lstrip('\n')
+
+            # Ignore the trailing data of the log
+            if not field:
+                field = next(fields, None)
+                continue
+
+            self.ncommit += 1
+            commit = self._parse_commit(field, fields)
+            files = {}
+
+            field = next(fields, None)
+
+            while field is not None:
+                entry = field.lstrip('\n')
+
+                if not entry:
+                    # Merges may include empty fields before their stats
+                    pass
+                elif entry.startswith(':'):
+                    self._parse_action(entry, fields, files)
+                else:
+                    stats = entry.split('\t', 2)
+
+                    if len(stats) != 3:
+                        # It is the beginning of the next commit
+                        break
+
+                    self._parse_stats(stats, fields, files)
+
+                field = next(fields, None)
+
+            commit['files'] = [{k: v for k, v in item.items() if v is not None}
+                               for _, item in sorted(files.items())]
+
+            logger.debug("Commit %s parsed", commit['commit'])
+            yield commit
+
+    def _parse_commit(self, field, fields):
+        header = [field]
+
+        for _ in range(8):
+            value = next(fields, None)
+
+            if value is None:
+                msg = "unexpected end of log on commit %s" % self.ncommit
+                raise ParseError(cause=msg)
+            header.append(value)
+
+        (sha, parents, refs, author, author_date,
+         committer, commit_date, abbrev_parents, message) = header
+
+        if len(sha) != 40:
+            msg = "commit expected on commit %s" % self.ncommit
+            raise ParseError(cause=msg)
+
+        commit = {
+            'commit': sha,
+            'parents': parents.split(),
+            'refs': [ref.strip() for ref in refs.split(',')] if refs else []
+        }
+
+        abbrev_parents = abbrev_parents.split()
+        if len(abbrev_parents) > 1:
+            commit['Merge'] = ' '.join(abbrev_parents)
+
+        commit['Author'] = author
+        commit['AuthorDate'] = author_date
+        commit['Commit'] = committer
+        commit['CommitDate'] = commit_date
+
+        message = self._format_message(message)
+
+        if message:
+            commit['message'] = message
+
+            for trailer in self.TRAILERS:
+                if trailer in message:
+                    self._parse_trailer(trailer, message, commit)
+
+        return commit
+
+    @classmethod
+    def _format_message(cls, message):
+        """Format a message like the default pretty formats do.
+
+        Trailing whitespace is removed from each line, including the
+        CR char of CRLF line endings, as well as the empty lines at
+        the beginning and at the end of the message. Tabs are expanded.
+        """
+        lines = [line.rstrip(cls.WHITESPACE) for line in message.split('\n')]
+        message = '\n'.join(lines).strip('\n')
+
+        return message.expandtabs(cls.TAB_SIZE)
+
+    def _parse_trailer(self, trailer, message, commit):
+        prefix = trailer + ':'
+
+        for line in message.split('\n'):
+            if not line.startswith(prefix):
+                continue
+
+            m = GitParser.GIT_HEADER_TRAILER_REGEXP.match(line)
+            if m:
+                commit.setdefault(trailer, []).append(m.group('value'))
+
+    def _parse_action(self, entry, fields, files):
+        nparents = len(entry) - len(entry.lstrip(':'))
+        data = entry[nparents:].split()
+
+        modes = data[:nparents + 1]
+        indexes = data[nparents + 1:2 * nparents + 2]
+        action = data[-1]
+
+        filename = next(fields, None)
+        newfile = None
+
+        if nparents == 1 and action[0] in ('R', 'C'):
+            newfile = next(fields, None)
+
+        if filename not in files:
+            files[filename] = {}
+
+        files[filename]['modes'] = modes
+        files[filename]['indexes'] = indexes
+        files[filename]['action'] = action
+        files[filename]['file'] = filename
+        files[filename]['newfile'] = newfile
+
+    def _parse_stats(self, stats, fields, files):
+        added, removed, filename = stats
+
+        if not filename:
+            # Renamed or copied file; old and new paths follow
+            filename = next(fields, None)
+            newfile = next(fields, None)
+
+            if not self._has_common_dirs(filename, newfile):
+                # Same entry that `GitParser` gets for 'old => new'
+                filename = filename + ' => ' + newfile
+
+        if filename not in files:
+            files[filename] = {'file': filename}
+
+        files[filename]['added'] = added
+        files[filename]['removed'] = removed
+
+    @staticmethod
+    def _has_common_dirs(old, new):
+        """Check if git writes the stats of a renamed file using braces.
+
+        Like git does, the paths are written as '{old => new}' with
+        their common leading or trailing directories outside of the
+        braces. When there are not common directories, the paths are
+        written as 'old => new' and `GitParser` takes them as the name
+        of the file.
+        """
+        prefix = 0
+
+        for i, (a, b) in enumerate(zip(old, new)):
+            if a != b:
+                break
+            if a == '/':
+                prefix = i + 1
+
+        # Like git, the common suffix may include the slash of the prefix
+        start = prefix - 1 if prefix else 0
+        i, j = len(old) - 1, len(new) - 1
+
+        while i >= start and j >= start and old[i] == new[j]:
+            if old[i] == '/':
+                return True
+            i -= 1
+            j -= 1
+
+        return prefix > 0
+
+
+class GitWalker:
+    """Git commit walker.
+
+    This class walks the commits of a repository in-process, using
+    dulwich, and converts them into dict items with the same structure
+    that `GitParser` produces for the log generated by `GitRepository`,
+    without running `git log` or parsing any text.
+
+    Commits are returned in reverse topological order, so parents are
+    always returned before their children. Take into account the order
+    of commits from different branches may differ from the one `log`
+    gives. Each commit includes its parents, refs, headers, message and
+    trailers. Actions over files are included when `details` is 'raw'.
+    Like the log with that level of detail, only renames and copies of
+    unchanged files are detected, comparing the hashes of the files,
+    so the contents of the files are never read and the walker can be
+    used on partial clones without blobs. Stats about lines added and
+    removed are not available.
+
+    Like the pretty formats of git, authors and committers are given
+    applying the '.mailmap' file found on the HEAD of the repository
+    and messages are formatted like `GitNulParser` does. Hashes are
+    abbreviated to the length set by 'core.abbrev' or, by default, to
+    the length git finds from the number of objects.
+
+    Take into account walking the commits is slower than generating
+    and parsing the log, specially with 'raw' details, because trees
+    and packs are read by dulwich in Python.
+
+    :param dirpath: path to the repository
+    :param details: level of detail of the commits; 'raw' or 'metadata'
+
+    :raises RepositoryError: when the level of detail is not supported
+    """
+    HASH_SIZE = 40
+    MIN_ABBREV_SIZE = 4
+    DEFAULT_ABBREV_SIZE = 7
+
+    MAX_CACHED_TREES = 4096
+
+    # Names used by git to format dates, not affected by the locale
+    WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+    MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+              'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+    # Refs used to decorate commits, like git does by default
+    DECORATION_PREFIXES = (b'refs/heads/', b'refs/tags/', b'refs/remotes/')
+
+    ACTIONS = {
+        dulwich.diff_tree.CHANGE_ADD: 'A',
+        dulwich.diff_tree.CHANGE_DELETE: 'D',
+        dulwich.diff_tree.CHANGE_MODIFY: 'M',
+        dulwich.diff_tree.CHANGE_RENAME: 'R',
+        dulwich.diff_tree.CHANGE_COPY: 'C'
+    }
+
+    # Git trailers
+    TRAILERS = GitParser.TRAILERS
+
+    def __init__(self, dirpath, details='raw'):
+        if details not in ('raw', 'metadata'):
+            raise RepositoryError(cause="level of detail %s not supported by the walker" % details)
+
+        self.dirpath = dirpath
+        self.details = details
+
+    def walk(self, include, exclude=None, since=None):
+        """Walk the commits of the repository.
+
+        :param include: list of commits (or annotated tags) to walk from
+        :param exclude: list of commits (or annotated tags) which are
+            not walked, with their ancestors
+        :param since: timestamp of the oldest commit to walk
+
+        :returns: a generator of commits
+        """
+        repo = dulwich.repo.Repo(self.dirpath)
+
+        try:
+            store = repo.object_store
+
+            include = [self.__peel(store, sha) for sha in include]
+            exclude = [self.__peel(store, sha) for sha in exclude or []]
+
+            if not include:
+                return
+
+            decorations = self.__load_decorations(repo)
+            mailmap = self.__load_mailmap(repo)
+            self.abbrev_size = self.__abbrev_size(repo)
+            detector = _ExactRenameDetector(store, max_cache=self.MAX_CACHED_TREES)
+
+            # Trees of the last commits, which are the parents of the next ones
+            trees = dulwich.lru_cache.LRUCache(max_cache=self.MAX_CACHED_TREES)
+
+            walker = dulwich.walk.Walker(store, include, exclude=exclude,
+                                         order=dulwich.walk.ORDER_TOPO,
+                                         reverse=True, since=since)
+
+            for entry in walker:
+                commit = self._build_commit(entry.commit, decorations, mailmap)
+
+                if self.details == 'raw':
+                    commit['files'] = self._build_files(store, entry.commit, detector, trees)
+                    trees[entry.commit.id] = entry.commit.tree
+                else:
+                    commit['files'] = []
+
+                logger.debug("Commit %s walked", commit['commit'])
+                yield commit
+        finally:
+            repo.close()
+
+    def _build_commit(self, obj, decorations, mailmap):
+        encoding = obj.encoding.decode('ascii') if obj.encoding else 'utf-8'
+
+        def decode(data):
+            return data.decode(encoding, errors='surrogateescape')
+
+        parents = [parent.decode('ascii') for parent in obj.parents]
+
+        commit = {
+            'commit': obj.id.decode('ascii'),
+            'parents': parents,
+            'refs': list(decorations.get(obj.id, []))
+        }
+
+        if len(parents) > 1:
+            commit['Merge'] = ' '.join([parent[:self.abbrev_size] for parent in parents])
+
+        commit['Author'] = decode(mailmap.lookup(obj.author))
+        commit['AuthorDate'] = self.__format_date(obj.author_time, obj.author_timezone)
+        commit['Commit'] = decode(mailmap.lookup(obj.committer))
+        commit['CommitDate'] = self.__format_date(obj.commit_time, obj.commit_timezone)
+
+        message = GitNulParser._format_message(decode(obj.message))
+
+        if message:
+            commit['message'] = message
+
+            for line in message.split('\n'):
+                m = GitParser.GIT_HEADER_TRAILER_REGEXP.match(line)
+
+                if m and m.group('name') in self.TRAILERS:
+                    commit.setdefault(m.group('name'), []).append(m.group('value'))
+
+        return commit
+
+    def _build_files(self, store, obj, detector, trees):
+        files = {}
+
+        parent_trees = [trees.get(parent) or store[parent].tree for parent in obj.parents]
+
+        if len(parent_trees) > 1:
+            # Like '-c' option, only files modified from all
+            # the parents are included
+            changes = dulwich.diff_tree.tree_changes_for_merge(store, parent_trees, obj.tree,
+                                                               rename_detector=detector)
+            for change in changes:
+                item = self.__build_merge_file(change)
+                files[item['file']] = item
+        else:
+            old_tree = parent_trees[0] if parent_trees else None
+            changes = detector.changes_with_renames(old_tree, obj.tree)
+            for change in changes:
+                item = self.__build_file(change)
+                files[item['file']] = item
+
+        return [item for _, item in sorted(files.items())]
+
+    def __build_file(self, change):
+        action = self.ACTIONS[change.type]
+
+        if change.type in dulwich.diff_tree.RENAME_CHANGE_TYPES:
+            # Only unchanged files are renamed or copied
+            action += '100'
+        elif change.type == dulwich.diff_tree.CHANGE_MODIFY and \
+                stat.S_IFMT(change.old.mode) != stat.S_IFMT(change.new.mode):
+            action = 'T'
+
+        entries = [change.old, change.new]
+
+        item = {
+            'modes': [self.__format_mode(entry) for entry in entries],
+            'indexes': [self.__format_index(entry) for entry in entries],
+            'action': action
+        }
+
+        if change.type == dulwich.diff_tree.CHANGE_ADD:
+            item['file'] = change.new.path.decode('utf-8', errors='surrogateescape')
+        else:
+            item['file'] = change.old.path.decode('utf-8', errors='surrogateescape')
+
+        if change.type in dulwich.diff_tree.RENAME_CHANGE_TYPES:
+            item['newfile'] = change.new.path.decode('utf-8', errors='surrogateescape')
+
+        return item
+
+    def __build_merge_file(self, changes):
+        new = [change.new for change in changes if change is not None][0]
+
+        old_entries = []
+        actions = []
+
+        for change in changes:
+            if change is None:
+                old_entries.append(new)
+                actions.append('M')
+            else:
+                old_entries.append(change.old)
+                actions.append(self.ACTIONS[change.type])
+
+        entries = old_entries + [new]
+
+        if not new.path:
+            # The file was deleted from every parent
+            path = old_entries[0].path
+        else:
+            path = new.path
+
+        return {
+            'modes': [self.__format_mode(entry) for entry in entries],
+            'indexes': [self.__format_index(entry) for entry in entries],
+            'action': ''.join(actions),
+            'file': path.decode('utf-8', errors='surrogateescape')
+        }
+
+    def __format_mode(self, entry):
+        return '%06o' % (entry.mode or 0)
+
+    def __format_index(self, entry):
+        sha = entry.sha or b'0' * 40
+        return sha[:self.abbrev_size].decode('ascii')
+
+    def __format_date(self, timestamp, timezone):
+        """Format a date like git does by default"""
+
+        dt = datetime.datetime.utcfromtimestamp(timestamp + timezone)
+
+        sign = '-' if timezone < 0 else '+'
+        hours, minutes = divmod(abs(timezone) // 60, 60)
+
+        return "%s %s %d %s %d %s%02d%02d" % (self.WEEKDAYS[dt.weekday()],
+                                              self.MONTHS[dt.month - 1],
+                                              dt.day, dt.strftime('%H:%M:%S'),
+                                              dt.year, sign, hours, minutes)
+
+    def __peel(self, store, sha):
+        obj = store[sha]
+
+        while isinstance(obj, dulwich.objects.Tag):
+            obj = store[obj.object[1]]
+
+        return obj.id
+
+    def __load_decorations(self, repo):
+        """Find the refs which decorate each commit.
+
+        As git does, the branch HEAD points to is shown first and
+        the rest of refs are sorted by name in reverse order.
+        """
+        refs = repo.get_refs()
+        store = repo.object_store
+
+        head_target = None
+        head = repo.refs.read_ref(b'HEAD')
+
+        if head and head.startswith(b'ref: '):
+            head_target = head[len(b'ref: '):].strip()
+
+        decorations = {}
+
+        for refname in sorted(refs.keys(), reverse=True):
+            if not refname.startswith(self.DECORATION_PREFIXES) or refname == head_target:
+                continue
+
+            sha = self.__peel(store, refs[refname])
+            name = refname.decode('utf-8', errors='surrogateescape')
+
+            if refname.startswith(b'refs/tags/'):
+                name = 'tag: ' + name
+
+            decorations.setdefault(sha, []).append(name)
+
+        if b'HEAD' in refs:
+            sha = self.__peel(store, refs[b'HEAD'])
+
+            if head_target and head_target in refs:
+                name = 'HEAD -> ' + head_target.decode('utf-8', errors='surrogateescape')
+            else:
+                name = 'HEAD'
+
+            decorations.setdefault(sha, []).insert(0, name)
+
+        return decorations
+
+    def __load_mailmap(self, repo):
+        """Read the '.mailmap' file of the HEAD of the repository"""
+
+        mailmap = dulwich.mailmap.Mailmap()
+
+        try:
+            tree = repo[repo[b'HEAD'].tree]
+            _, sha = tree.lookup_path(repo.object_store.__getitem__, b'.mailmap')
+        except KeyError:
+            return mailmap
+
+        for entry in dulwich.mailmap.parse_mailmap(io.BytesIO(repo[sha].data)):
+            mailmap.add_entry(*entry)
+
+        return mailmap
+
+    def __abbrev_size(self, repo):
+        """Find the length of the abbreviated hashes like git does.
+
+        By default, git sets the length from the number of packed
+        objects, so the chances of a collision are low. Abbreviated
+        hashes are not made longer when they collide with other
+        objects, though.
+        """
+        try:
+            value = repo.get_config_stack().get(b'core', b'abbrev')
+            value = value.decode('ascii').lower()
+        except (KeyError, UnicodeDecodeError):
+            value = 'auto'
+
+        if value in ('false', 'no', 'off'):
+            return self.HASH_SIZE
+        elif value.isdigit():
+            return min(max(int(value), self.MIN_ABBREV_SIZE), self.HASH_SIZE)
+
+        stores = [repo.object_store] + list(repo.object_store.alternates)
+        count = sum(len(pack.index) for store in stores for pack in store.packs)
+
+        # Expect a collision on 2^(bits / 2) objects, with 4 bits per char
+        size = -(-count.bit_length() // 2)
+
+        return max(size, self.DEFAULT_ABBREV_SIZE)
+
+
 class EmptyRepositoryError(RepositoryError):
     """Exception raised when a repository is empty"""
 
@@ -691,6 +1456,190 @@ class _GraphWalker:
     __next__ = next
 
 
+class _ExactRenameDetector:
+    """Find the changes between trees detecting only exact renames.
+
+    Like `git log -M100% -C100%`, files are renamed or copied only
+    when their contents did not change, so the contents of the files
+    are never read. Deleted and modified files are the sources of
+    renames and copies, respectively. Trees are compared in-process
+    and kept in a cache, because consecutive commits share most of
+    them.
+
+    The detector can be given to `dulwich.diff_tree.tree_changes`
+    as a rename detector.
+
+    :param store: object store where the trees are read from
+    :param max_cache: number of trees kept in the cache
+    """
+    NULL_ENTRY = dulwich.objects.TreeEntry(None, None, None)
+
+    def __init__(self, store, max_cache=4096):
+        self.store = store
+        self.trees = dulwich.lru_cache.LRUCache(max_cache=max_cache)
+
+    def changes_with_renames(self, tree1_id, tree2_id, want_unchanged=False,
+                             include_trees=False):
+        """Get the changes between two trees, with exact renames.
+
+        Like git does, each added file is paired with a deleted or
+        modified file with the same contents, preferring those not
+        paired yet and with the same name. Modified files are always
+        copied; deleted files are renamed by the last file paired with
+        them and copied by the rest. Changes are returned in the order
+        git gives them. Unchanged files and trees are never included.
+        """
+        changes = sorted(self._tree_changes(tree1_id, tree2_id), key=self._change_path)
+
+        sources = collections.defaultdict(list)
+        used = {}
+
+        for change in changes:
+            if change.type == dulwich.diff_tree.CHANGE_DELETE:
+                used[change.old.path] = 0
+            elif change.type == dulwich.diff_tree.CHANGE_MODIFY:
+                # Modified files stay, so they can only be copied
+                used[change.old.path] = 1
+            else:
+                continue
+            sources[change.old.sha].append(change.old)
+
+        pairs = {}
+
+        for change in changes:
+            if change.type != dulwich.diff_tree.CHANGE_ADD:
+                continue
+
+            source = self._find_source(change.new, sources.get(change.new.sha, []), used)
+
+            if source:
+                pairs[change.new.path] = source
+                used[source.path] += 1
+
+        result = []
+
+        for change in changes:
+            if change.type == dulwich.diff_tree.CHANGE_DELETE and used[change.old.path]:
+                continue
+            elif change.type == dulwich.diff_tree.CHANGE_ADD and change.new.path in pairs:
+                source = pairs[change.new.path]
+                used[source.path] -= 1
+
+                if used[source.path]:
+                    change_type = dulwich.diff_tree.CHANGE_COPY
+                else:
+                    change_type = dulwich.diff_tree.CHANGE_RENAME
+
+                change = dulwich.diff_tree.TreeChange(change_type, source, change.new)
+
+            result.append(change)
+
+        return result
+
+    @staticmethod
+    def _find_source(entry, candidates, used):
+        """Find the best source of an added file among the candidates"""
+
+        best = None
+        best_score = -1
+
+        for candidate in candidates:
+            # Modes of non-regular files must match
+            if not (stat.S_ISREG(candidate.mode) and stat.S_ISREG(entry.mode)) and \
+                    candidate.mode != entry.mode:
+                continue
+
+            score = int(not used[candidate.path])
+            score += int(candidate.path.rsplit(b'/', 1)[-1] == entry.path.rsplit(b'/', 1)[-1])
+
+            if score > best_score:
+                best = candidate
+                best_score = score
+
+                if score == 2:
+                    break
+
+        return best
+
+    @staticmethod
+    def _change_path(change):
+        return change.new.path if change.new.path is not None else change.old.path
+
+    def _tree_changes(self, tree1_id, tree2_id):
+        """Compare two trees, walking only the subtrees that changed"""
+
+        pending = [(b'', tree1_id, tree2_id)]
+
+        while pending:
+            path, tree1_id, tree2_id = pending.pop()
+
+            entries1 = self._read_tree(tree1_id)
+            entries2 = self._read_tree(tree2_id)
+
+            changed = [(name, entry) for name, entry in entries1.items()
+                       if entries2.get(name) != entry]
+            added = [name for name in entries2 if name not in entries1]
+
+            for name, (mode1, sha1) in changed:
+                subpath = path + name
+                mode2, sha2 = entries2.get(name, (None, None))
+
+                if stat.S_ISDIR(mode1) and mode2 is not None and stat.S_ISDIR(mode2):
+                    pending.append((subpath + b'/', sha1, sha2))
+                    continue
+
+                if stat.S_ISDIR(mode1):
+                    pending.append((subpath + b'/', sha1, None))
+                    old = self.NULL_ENTRY
+                else:
+                    old = dulwich.objects.TreeEntry(subpath, mode1, sha1)
+
+                if mode2 is None:
+                    new = self.NULL_ENTRY
+                elif stat.S_ISDIR(mode2):
+                    pending.append((subpath + b'/', None, sha2))
+                    new = self.NULL_ENTRY
+                else:
+                    new = dulwich.objects.TreeEntry(subpath, mode2, sha2)
+
+                if old.path is not None or new.path is not None:
+                    yield self._change(old, new)
+
+            for name in added:
+                subpath = path + name
+                mode2, sha2 = entries2[name]
+
+                if stat.S_ISDIR(mode2):
+                    pending.append((subpath + b'/', None, sha2))
+                else:
+                    new = dulwich.objects.TreeEntry(subpath, mode2, sha2)
+                    yield self._change(self.NULL_ENTRY, new)
+
+    def _change(self, old, new):
+        if old.path is None:
+            change_type = dulwich.diff_tree.CHANGE_ADD
+        elif new.path is None:
+            change_type = dulwich.diff_tree.CHANGE_DELETE
+        else:
+            change_type = dulwich.diff_tree.CHANGE_MODIFY
+
+        return dulwich.diff_tree.TreeChange(change_type, old, new)
+
+    def _read_tree(self, sha):
+        if sha is None:
+            return {}
+
+        entries = self.trees.get(sha)
+
+        if entries is None:
+            _, data = self.store.get_raw(sha)
+            entries = {name: (mode, hexsha)
+                       for name, mode, hexsha in dulwich.objects.parse_tree(data)}
+            self.trees[sha] = entries
+
+        return entries
+
+
 GitRef = collections.namedtuple('GitRef', ['hash', 'refname'])
 
 
@@ -715,6 +1664,56 @@ class GitRepository:
         '-C',  # detect and report copies
         '-c',  # show merge info
     ]
+    GIT_NUL_OUTPUT_OPTS = [
+        '-z',  # separate fields with NUL chars
+        '--format=' + GitNulParser.GIT_NUL_FORMAT,  # custom format
+        '--raw',  # show data in raw format
+        '--numstat',  # show added/deleted lines per file
+        '--decorate=full',  # show full refs
+        '--parents',  # show parents information
+        '-M',  # detect and report renames
+        '-C',  # detect and report copies
+        '-c',  # show merge info
+    ]
+
+    # Levels of detail of the log
+    DETAILS_FULL = 'full'
+    DETAILS_RAW = 'raw'
+    DETAILS_METADATA = 'metadata'
+
+    # Options removed from and added to the log and objects
+    # filtered out from clones for each level of detail. Blobs
+    # are not available on 'raw' clones, so only exact renames
+    # and copies, which do not need their contents, are detected
+    DETAILS_EXCLUDED_OPTS = {
+        DETAILS_FULL: [],
+        DETAILS_RAW: ['--numstat', '-M', '-C'],
+        DETAILS_METADATA: ['--raw', '--numstat', '-M', '-C', '-c']
+    }
+    DETAILS_ADDED_OPTS = {
+        DETAILS_FULL: [],
+        DETAILS_RAW: ['-M100%', '-C100%'],
+        DETAILS_METADATA: []
+    }
+    DETAILS_CLONE_FILTERS = {
+        DETAILS_FULL: None,
+        DETAILS_RAW: 'blob:none',
+        DETAILS_METADATA: 'tree:0'
+    }
+
+    # Namespace of the refs pointing to the heads already fetched
+    WATERMARK_REFS_PREFIX = 'refs/perceval/watermark/'
+
+    READ_BUFFER_SIZE = 64 * 1024
+    STDERR_TAIL_SIZE = 4 * 1024
+
+    # Type, size and base of a delta fit in this number of bytes
+    PACK_HEADER_MAX_SIZE = 32
+
+    MIN_LOG_RANGE_SIZE = 500
+    MAX_LOG_RANGE_SIZE = 5000
+    LOG_RANGES_PER_WORKER = 4
+    PENDING_LOG_RANGES_PER_WORKER = 2
 
     def __init__(self, uri, dirpath):
         gitdir = os.path.join(dirpath, 'HEAD')
@@ -738,21 +1737,42 @@ class GitRepository:
         }
 
     @classmethod
-    def clone(cls, uri, dirpath):
+    def clone(cls, uri, dirpath, clone_filter=None, reference=None):
         """Clone a Git repository.
 
         Make a bare copy of the repository stored in `uri` into `dirpath`.
         The repository would be either local or remote.
 
+        When `clone_filter` is given, a partial clone is made using that
+        filter spec (i.e, 'blob:none' or 'tree:0'). The filter is kept
+        on the configuration of the clone, so the objects will be also
+        filtered out when the repository is updated. Objects filtered
+        out are fetched from the remote on demand. Take into account
+        the remote must allow filters; otherwise a full clone is made.
+
+        When `reference` is given, the objects available on the local
+        repository stored in that path are not copied; they are read
+        from there using git alternates. Objects must not be removed
+        from the reference repository while this clone exists.
+
         :param uri: URI of the repository
         :param dirtpath: directory where the repository will be cloned
+        :param clone_filter: filter spec for partial clones
+        :param reference: path to a local repository to borrow objects from
 
         :returns: a `GitRepository` class having cloned the repository
 
         :raises RepositoryError: when an error occurs cloning the given
             repository
         """
-        cmd = ['git', 'clone', '--bare', uri, dirpath]
+        cmd = ['git', 'clone', '--bare']
+
+        if clone_filter:
+            cmd.append('--filter=' + clone_filter)
+        if reference:
+            cmd.extend(['--reference', reference])
+
+        cmd.extend([uri, dirpath])
         env = {
             'LANG': 'C',
             'HOME': os.getenv('HOME', '')
@@ -822,12 +1842,18 @@ class GitRepository:
 
         Returns `True` when the repository is empty. Under the hood,
         it checks the number of objects on the repository. When
-        this number is 0, the repositoy is empty.
+        this number is 0, the repositoy is empty unless it has refs;
+        repositories cloned using a reference borrow their objects
+        from other repositories (git alternates), so they may not
+        store any object.
 
         :raises RepositoryError: when an error occurs accessing the
             repository
         """
-        return self.count_objects() == 0
+        if self.count_objects() > 0:
+            return False
+
+        return not self._for_each_ref([])
 
     def update(self):
         """Update repository from its remote.
@@ -878,7 +1904,8 @@ class GitRepository:
 
         return commits
 
-    def log(self, from_date=None, branches=None, encoding='utf-8'):
+    def log(self, from_date=None, branches=None, encoding='utf-8', nul_format=False,
+            details=DETAILS_FULL, exclude_watermark=False):
         """Read the commit log from the repository.
 
         The method returns the Git log of the repository using the
@@ -896,10 +1923,29 @@ class GitRepository:
         is fetched. If the list of branches is None, all commits
         for all branches will be fetched.
 
+        When `nul_format` is set, the log is generated with the `-z`
+        option and the custom format that `GitNulParser` expects,
+        instead of `--pretty=fuller`. In this case, each item of
+        the generator is a NUL-delimited field of the log.
+
+        The parameter `details` sets the data about the files included
+        on the log: 'full' shows actions (`--raw`) and stats (`--numstat`);
+        'raw' shows only actions, so the contents of the files are not
+        needed; and 'metadata' does not show any data about files.
+        With 'raw', only renames and copies of unchanged files are
+        detected, because the others would need those contents.
+
+        When `exclude_watermark` is set, commits reachable from the
+        heads stored with `update_watermark` are not included in the log.
+        The refs of the watermark never decorate the commits.
+
         :param from_date: fetch commits newer than a specific
             date (inclusive)
         :param branches: names of branches to fetch from (default: None)
         :param encoding: encode the log using this format
+        :param nul_format: generate a NUL-delimited log
+        :param details: level of detail of the log
+        :param exclude_watermark: exclude commits reachable from the watermark
 
         :returns: a generator where each item is a line from the log
 
@@ -913,27 +1959,173 @@ class GitRepository:
             raise EmptyRepositoryError(repository=self.uri)
 
         cmd_log = ['git', 'log', '--reverse', '--topo-order']
-        cmd_log.extend(self.GIT_PRETTY_OUTPUT_OPTS)
+        cmd_log.extend(self._log_opts(nul_format, details))
+        delimiter = b'\0' if nul_format else None
 
-        if from_date:
-            dt = from_date.strftime("%Y-%m-%d %H:%M:%S %z")
-            cmd_log.append('--since=' + dt)
-
-        if branches is None:
-            cmd_log.extend(['--branches', '--tags', '--remotes=origin'])
-        elif len(branches) == 0:
-            cmd_log.append('--max-count=0')
-        else:
-            branches = ['refs/heads/' + branch for branch in branches]
-            cmd_log.extend(branches)
+        cmd_log.extend(self._revisions_args(from_date, branches, exclude_watermark))
 
-        for line in self._exec_nb(cmd_log, cwd=self.dirpath, env=self.gitenv):
+        for line in self._exec_nb(cmd_log, cwd=self.dirpath, env=self.gitenv,
+                                  encoding=encoding, delimiter=delimiter):
             yield line
 
         logger.debug("Git log fetched from %s repository (%s)",
                      self.uri, self.dirpath)
 
-    def show(self, commits=None, encoding='utf-8'):
+    def rev_list(self, from_date=None, branches=None, exclude_watermark=False):
+        """Read the list of commits of the repository.
+
+        The method returns the hashes of the commits in the same order
+        that `log` would return them, this is, in reverse topological
+        order. The parameters `from_date`, `branches` and
+        `exclude_watermark` select the commits like in `log`.
+
+        :param from_date: fetch commits newer than a specific
+            date (inclusive)
+        :param branches: names of branches to fetch from (default: None)
+        :param exclude_watermark: exclude commits reachable from the watermark
+
+        :returns: a list of commit hashes
+
+        :raises EmptyRepositoryError: when the repository is empty and
+            the action cannot be performed
+        :raises RepositoryError: when an error occurs running the command
+        """
+        if self.is_empty():
+            logger.warning("Git %s repository is empty; unable to get the rev-list",
+                           self.uri)
+            raise EmptyRepositoryError(repository=self.uri)
+
+        if branches is not None and len(branches) == 0:
+            return []
+
+        cmd_rev_list = ['git', 'rev-list', '--reverse', '--topo-order']
+        cmd_rev_list.extend(self._revisions_args(from_date, branches, exclude_watermark))
+
+        outs = self._exec(cmd_rev_list, cwd=self.dirpath, env=self.gitenv)
+        outs = outs.decode('utf-8', errors='surrogateescape')
+
+        return outs.split()
+
+    def parallel_log(self, from_date=None, branches=None, encoding='utf-8',
+                     nul_format=False, workers=None, details=DETAILS_FULL,
+                     exclude_watermark=False):
+        """Read and parse the commit log using a pool of processes.
+
+        The list of commits is partitioned into disjoint ranges of
+        consecutive commits. The log of each range is generated and
+        parsed by a pool of `workers` processes; by default, as many
+        as processors are available. Commits are returned in the same
+        order and with the same data that parsing the output of `log`
+        would produce.
+
+        To limit the memory used, ranges have `MAX_LOG_RANGE_SIZE`
+        commits at most and only `PENDING_LOG_RANGES_PER_WORKER`
+        ranges per worker are processed at the same time, so the
+        parsed commits kept in memory depend on the number of workers
+        and not on the size of the history. Only the list of commits
+        to read, which is generated first, grows with the history.
+
+        :param from_date: fetch commits newer than a specific
+            date (inclusive)
+        :param branches: names of branches to fetch from (default: None)
+        :param encoding: encode the log using this format
+        :param nul_format: generate and parse a NUL-delimited log
+        :param workers: number of processes generating and parsing
+            the log
+        :param details: level of detail of the log
+        :param exclude_watermark: exclude commits reachable from the watermark
+
+        :returns: a generator of parsed commits
+
+        :raises EmptyRepositoryError: when the repository is empty and
+            the action cannot be performed
+        :raises RepositoryError: when an error occurs fetching the log
+        :raises ParseError: when the format of the log is invalid
+        """
+        commits = self.rev_list(from_date=from_date, branches=branches,
+                                exclude_watermark=exclude_watermark)
+
+        if not commits:
+            return
+
+        opts = self._log_opts(nul_format, details)
+
+        workers = workers or os.cpu_count() or 1
+        size = -(-len(commits) // (workers * self.LOG_RANGES_PER_WORKER))
+        size = min(max(size, self.MIN_LOG_RANGE_SIZE), self.MAX_LOG_RANGE_SIZE)
+        ranges = (commits[i:i + size] for i in range(0, len(commits), size))
+
+        logger.debug("Reading %s commits from %s repository using %s workers",
+                     len(commits), self.uri, workers)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+
+            for commits_range in ranges:
+                future = executor.submit(_parse_log_range, self.dirpath, self.gitenv,
+                                         commits_range, opts, encoding, nul_format)
+                pending.append(future)
+
+                if len(pending) < workers * self.PENDING_LOG_RANGES_PER_WORKER:
+                    continue
+
+                for commit in pending.popleft().result():
+                    yield commit
+
+            while pending:
+                for commit in pending.popleft().result():
+                    yield commit
+
+        logger.debug("Git log fetched from %s repository (%s)",
+                     self.uri, self.dirpath)
+
+    def walk(self, from_date=None, branches=None, details=DETAILS_RAW,
+             exclude_watermark=False):
+        """Walk the commits of the repository in-process.
+
+        The method returns the commits that `log` would return for
+        the same parameters, already parsed, walking them with
+        `GitWalker` instead of running `git log`. Parents are returned
+        before their children, but the order of the commits may differ
+        from the one of `log`. The parameter `details` only accepts
+        'raw' and 'metadata' levels.
+
+        :param from_date: fetch commits newer than a specific
+            date (inclusive)
+        :param branches: names of branches to fetch from (default: None)
+        :param details: level of detail of the commits
+        :param exclude_watermark: exclude commits reachable from the watermark
+
+        :returns: a generator of parsed commits
+
+        :raises EmptyRepositoryError: when the repository is empty and
+            the action cannot be performed
+        :raises RepositoryError: when the level of detail is not supported
+        """
+        if self.is_empty():
+            logger.warning("Git %s repository is empty; unable to walk the commits",
+                           self.uri)
+            raise EmptyRepositoryError(repository=self.uri)
+
+        walker = GitWalker(self.dirpath, details=details)
+
+        include = [ref.hash.encode('ascii') for ref in self.heads(branches)]
+
+        if exclude_watermark:
+            exclude = [ref.hash.encode('ascii') for ref in self.watermark()]
+        else:
+            exclude = []
+
+        since = from_date.timestamp() if from_date else None
+
+        for commit in walker.walk(include, exclude=exclude, since=since):
+            yield commit
+
+        logger.debug("Git commits walked from %s repository (%s)",
+                     self.uri, self.dirpath)
+
+    def show(self, commits=None, encoding='utf-8', nul_format=False,
+             details=DETAILS_FULL):
         """Show the data of a set of commits.
 
         The method returns the output of Git show command for a
@@ -946,8 +2138,14 @@ class GitRepository:
         data about the last commit, like the default behaviour of
         `git show`.
 
+        When `nul_format` is set, the output is generated in the same
+        NUL-delimited format that `log` uses with this flag. The
+        parameter `details` works like in `log`.
+
         :param commits: list of commits to show data
         :param encoding: encode the output using this format
+        :param nul_format: generate a NUL-delimited output
+        :param details: level of detail of the output
 
         :returns: a generator where each item is a line from the show output
 
@@ -964,15 +2162,114 @@ class GitRepository:
             commits = []
 
         cmd_show = ['git', 'show']
-        cmd_show.extend(self.GIT_PRETTY_OUTPUT_OPTS)
+        cmd_show.extend(self._log_opts(nul_format, details))
         cmd_show.extend(commits)
+        delimiter = b'\0' if nul_format else None
 
-        for line in self._exec_nb(cmd_show, cwd=self.dirpath, env=self.gitenv):
+        for line in self._exec_nb(cmd_show, cwd=self.dirpath, env=self.gitenv,
+                                  encoding=encoding, delimiter=delimiter):
             yield line
 
         logger.debug("Git show fetched from %s repository (%s)",
                      self.uri, self.dirpath)
 
+    def heads(self, branches=None):
+        """Get the refs that select the commits to log.
+
+        The method returns the refs that `log` reads when it is called
+        with the same `branches`. Annotated tags are not peeled.
+
+        :param branches: names of branches (default: None)
+
+        :returns: a list of `GitRef`
+        """
+        if branches is None:
+            patterns = ['refs/heads/', 'refs/tags/', 'refs/remotes/origin/']
+        elif len(branches) == 0:
+            return []
+        else:
+            patterns = ['refs/heads/' + branch for branch in branches]
+
+        return self._for_each_ref(patterns)
+
+    def watermark(self):
+        """Get the heads stored as watermark of the repository.
+
+        :returns: a list of `GitRef`; their names are the names the
+            refs had when they were stored
+        """
+        prefix = self.WATERMARK_REFS_PREFIX
+        refs = self._for_each_ref([prefix])
+
+        return [GitRef(ref.hash, ref.refname[len(prefix):]) for ref in refs]
+
+    def update_watermark(self, heads):
+        """Store a list of heads as watermark of the repository.
+
+        The watermark is replaced by the given list of heads; commits
+        reachable from them can be excluded from the log later. These
+        heads are stored as refs under `WATERMARK_REFS_PREFIX`, so the
+        objects they point to will not be removed from the repository.
+        These refs are excluded from the decorations of the log.
+
+        :param heads: list of `GitRef` to store
+
+        :raises RepositoryError: when the watermark cannot be updated
+        """
+        prefix = self.WATERMARK_REFS_PREFIX
+        refnames = [prefix + head.refname for head in heads]
+
+        changes = [(ref, True) for ref in self._for_each_ref([prefix])
+                   if ref.refname not in refnames]
+        changes.extend([(GitRef(head.hash, refname), False)
+                        for head, refname in zip(heads, refnames)])
+
+        self._update_refs_batch(changes)
+
+        logger.debug("Git %s repository watermark updated with %s heads (%s)",
+                     self.uri, len(heads), self.dirpath)
+
+    @classmethod
+    def _revisions_args(cls, from_date=None, branches=None, exclude_watermark=False):
+        """Get the arguments that select the commits to log"""
+
+        args = []
+
+        if from_date:
+            dt = from_date.strftime("%Y-%m-%d %H:%M:%S %z")
+            args.append('--since=' + dt)
+
+        if branches is None:
+            args.extend(['--branches', '--tags', '--remotes=origin'])
+        elif len(branches) == 0:
+            args.append('--max-count=0')
+        else:
+            branches = ['refs/heads/' + branch for branch in branches]
+            args.extend(branches)
+
+        if exclude_watermark:
+            args.extend(['--not', '--glob=' + cls.WATERMARK_REFS_PREFIX + '*'])
+
+        return args
+
+    @classmethod
+    def _log_opts(cls, nul_format=False, details=DETAILS_FULL):
+        """Get the output options of log and show commands"""
+
+        if details not in cls.DETAILS_EXCLUDED_OPTS:
+            raise RepositoryError(cause="unknown level of detail %s" % details)
+
+        opts = cls.GIT_NUL_OUTPUT_OPTS if nul_format else cls.GIT_PRETTY_OUTPUT_OPTS
+        excluded = cls.DETAILS_EXCLUDED_OPTS[details]
+
+        opts = [opt for opt in opts if opt not in excluded]
+        opts.extend(cls.DETAILS_ADDED_OPTS[details])
+
+        # Git < 2.38 decorates commits with any ref, watermark included
+        opts.append('--decorate-refs-exclude=' + cls.WATERMARK_REFS_PREFIX + '*')
+
+        return opts
+
     def _fetch_pack(self):
         """Fetch changes and store them in a pack."""
 
@@ -1007,27 +2304,110 @@ class GitRepository:
         return (pack_name, refs)
 
     def _read_commits_from_pack(self, packet_name):
-        """Read the commits of a pack."""
+        """Read the commits of a pack.
+
+        The entries of the pack are read from its index and only the
+        header of each object is read from the pack to know its type,
+        so objects are not inflated. The type of a deltified object is
+        the type of the object at the base of its chain of deltas, which
+        is found following the headers of the deltas. Types are cached
+        by offset, so each header is read once.
+        """
+        filepath = os.path.join(self.dirpath, 'objects', 'pack', 'pack-' + packet_name)
 
-        filepath = 'objects/pack/pack-' + packet_name
+        try:
+            pack = dulwich.pack.Pack(filepath)
+        except OSError as e:
+            raise RepositoryError(cause=str(e))
 
-        cmd_verify_pack = ['git', 'verify-pack', '-v', filepath]
+        commits = []
 
-        outs = self._exec(cmd_verify_pack, cwd=self.dirpath, env=self.gitenv)
-        outs = outs.decode('utf-8', errors='surrogateescape').rstrip()
+        with pack, open(filepath + '.pack', 'rb') as fd:
+            # Objects are sorted by their offset in the pack
+            entries = sorted(pack.index.iterentries(), key=lambda entry: entry[1])
+            offsets = {sha: offset for sha, offset, _ in entries}
+            types = {}
 
-        lines = [line.split(' ') for line in outs.split('\n')]
+            for sha, offset, _ in entries:
+                type_num = self._read_pack_object_type(fd, offset, offsets, types)
+
+                if type_num == dulwich.objects.Commit.type_num:
+                    commits.append(dulwich.objects.sha_to_hex(sha).decode('utf-8'))
 
         # Commits usually come in the pack ordered from newest to oldest
-        commits = [parts[0] for parts in lines if parts[1] == 'commit']
         commits.reverse()
 
         return commits
 
+    def _read_pack_object_type(self, fd, offset, offsets, types):
+        """Find the type of the object stored at `offset` of a pack"""
+
+        chain = []
+
+        while offset not in types:
+            type_num, base_offset = self._read_pack_object_header(fd, offset, offsets)
+
+            if base_offset is None:
+                types[offset] = type_num
+            else:
+                chain.append(offset)
+                offset = base_offset
+
+        type_num = types[offset]
+
+        for delta_offset in chain:
+            types[delta_offset] = type_num
+
+        return type_num
+
+    def _read_pack_object_header(self, fd, offset, offsets):
+        """Read the type of an object and the offset of its base, if any"""
+
+        fd.seek(offset)
+        data = fd.read(self.PACK_HEADER_MAX_SIZE)
+
+        c = data[0]
+        type_num = (c >> 4) & 0x07
+        pos = 1
+
+        # Skip the size of the object
+        while c & 0x80:
+            c = data[pos]
+            pos += 1
+
+        if type_num == dulwich.pack.OFS_DELTA:
+            c = data[pos]
+            pos += 1
+            delta = c & 0x7f
+
+            while c & 0x80:
+                c = data[pos]
+                pos += 1
+                delta = ((delta + 1) << 7) | (c & 0x7f)
+
+            return type_num, offset - delta
+        elif type_num == dulwich.pack.REF_DELTA:
+            base_sha = data[pos:pos + 20]
+
+            try:
+                return type_num, offsets[base_sha]
+            except KeyError:
+                cause = "base object %s of delta not found in pack" % \
+                    dulwich.objects.sha_to_hex(base_sha).decode('utf-8')
+                raise RepositoryError(cause=cause)
+        else:
+            return type_num, None
+
     def _update_references(self, refs):
-        """Update references removing old ones."""
+        """Update references removing old ones.
 
+        All the creations, updates and deletions are sent to a single
+        `git update-ref --stdin` process, which applies them in one
+        transaction. When the transaction fails, the references are
+        updated one by one so the failures are reported per reference.
+        """
         new_refs = [ref.refname for ref in refs]
+        changes = []
 
         # Delete old references
         for old_ref in self._discover_refs():
@@ -1035,7 +2415,7 @@ class GitRepository:
                 continue
             if old_ref.refname in new_refs:
                 continue
-            self._update_ref(old_ref, delete=True)
+            changes.append((old_ref, True))
 
         # Update new references
         for new_ref in refs:
@@ -1050,7 +2430,15 @@ class GitRepository:
                              refname)
                 continue
             else:
-                self._update_ref(new_ref)
+                changes.append((new_ref, False))
+
+        try:
+            self._update_refs_batch(changes)
+        except RepositoryError as e:
+            logger.debug("Git refs could not be updated in a batch during sync process in %s (%s): %s; "
+                         "updating them one by one", self.uri, self.dirpath, str(e))
+            for ref, delete in changes:
+                self._update_ref(ref, delete=delete)
 
         # Prune repository to remove old branches
         cmd = ['git', 'remote', 'prune', 'origin']
@@ -1084,6 +2472,51 @@ class GitRepository:
 
         return refs
 
+    def _for_each_ref(self, patterns):
+        """Get the local refs that match any of the patterns."""
+
+        cmd = ['git', 'for-each-ref', '--format=%(objectname) %(refname)']
+        cmd.extend(patterns)
+
+        outs = self._exec(cmd, cwd=self.dirpath, env=self.gitenv)
+        outs = outs.decode('utf-8', errors='surrogateescape')
+
+        refs = []
+
+        for line in outs.splitlines():
+            data = line.split(' ', 1)
+            refs.append(GitRef(data[0], data[1]))
+
+        return refs
+
+    def _update_refs_batch(self, changes):
+        """Update a list of references in a single transaction.
+
+        :param changes: list of (ref, delete) tuples
+
+        :raises RepositoryError: when any of the references cannot
+            be updated; none of them are updated in that case
+        """
+        if not changes:
+            return
+
+        cmds = []
+
+        for ref, delete in changes:
+            if delete:
+                cmds.append('delete %s\n' % ref.refname)
+            else:
+                cmds.append('update %s %s\n' % (ref.refname, ref.hash))
+
+        cmd = ['git', 'update-ref', '--stdin']
+        self._exec(cmd, cwd=self.dirpath, env=self.gitenv,
+                   input=''.join(cmds).encode('utf-8', errors='surrogateescape'))
+
+        for ref, delete in changes:
+            action = 'deleted' if delete else 'updated to %s' % ref.hash
+            logger.debug("Git %s ref %s in %s (%s)",
+                         ref.refname, action, self.uri, self.dirpath)
+
     def _update_ref(self, ref, delete=False):
         """Update a reference."""
 
@@ -1105,20 +2538,27 @@ class GitRepository:
             logger.debug("Git %s ref %s in %s (%s)",
                          ref.refname, action, self.uri, self.dirpath)
 
-    def _exec_nb(self, cmd, cwd=None, env=None, encoding='utf-8'):
+    def _exec_nb(self, cmd, cwd=None, env=None, encoding='utf-8', delimiter=None):
         """Run a command with a non blocking call.
 
         Execute `cmd` command with a non blocking call. The command will
         be run in the directory set by `cwd`. Enviroment variables can be
         set using the `env` dictionary. The output data is returned
-        as encoded bytes in an iterator. Each item will be a line of the
-        output.
+        as decoded strings in an iterator. Each item will be a line of
+        the output or, when `delimiter` is given, each of the records of
+        the output separated by that delimiter, without it.
+
+        The output is read while the iterator is consumed, so the
+        command is blocked by the pipe when the consumer is slower
+        than the command, instead of buffering its output.
 
-        :returns: an iterator with the output of the command as encoded bytes
+        :returns: an iterator with the output of the command as decoded strings
 
         :raises RepositoryError: when an error occurs running the command
         """
         self.failed_message = None
+        self.stderr_tail = b''
+        err_thread = None
 
         logger.debug("Running command %s (cwd: %s, env: %s)",
                      ' '.join(cmd), cwd, str(env))
@@ -1128,27 +2568,74 @@ class GitRepository:
                                          stdout=subprocess.PIPE,
                                          stderr=subprocess.PIPE,
                                          cwd=cwd,
-                                         env=env)
+                                         env=env,
+                                         bufsize=0)
             err_thread = threading.Thread(target=self._read_stderr,
                                           kwargs={'encoding': encoding},
                                           daemon=True)
             err_thread.start()
-            for line in self.proc.stdout:
-                yield line.decode(encoding, errors='surrogateescape')
+
+            for record in self._read_records(self.proc.stdout, encoding, delimiter):
+                yield record
             err_thread.join()
 
             self.proc.communicate()
             self.proc.stdout.close()
             self.proc.stderr.close()
         except OSError as e:
-            err_thread.join()
+            if err_thread:
+                err_thread.join()
             raise RepositoryError(cause=str(e))
 
         if self.proc.returncode != 0:
+            self.failed_message = self._last_line(self.stderr_tail, encoding)
             cause = "git command - %s (return code: %d)" % \
                 (self.failed_message, self.proc.returncode)
             raise RepositoryError(cause=cause)
 
+    @classmethod
+    def _read_records(cls, stream, encoding='utf-8', delimiter=None):
+        """Read and decode the records of a binary stream.
+
+        Data is read in blocks of `READ_BUFFER_SIZE` bytes. The complete
+        records of each block are decoded at once and split afterwards,
+        so decoding is done once per block instead of once per record.
+        Only the incomplete record at the end of a block is kept between
+        reads. Records are lines, with their line terminator, unless a
+        single byte `delimiter` is given.
+        """
+        sep = delimiter if delimiter else b'\n'
+        text_sep = sep.decode(encoding)
+        pending = []
+
+        while True:
+            data = stream.read(cls.READ_BUFFER_SIZE)
+
+            if not data:
+                break
+
+            end = data.rfind(sep) + 1
+
+            if not end:
+                pending.append(data)
+                continue
+
+            pending.append(data[:end])
+            text = b''.join(pending).decode(encoding, errors='surrogateescape')
+            pending = [data[end:]] if end < len(data) else []
+
+            records = text.split(text_sep)
+            records.pop()
+
+            if delimiter:
+                yield from records
+            else:
+                for record in records:
+                    yield record + text_sep
+
+        if pending:
+            yield b''.join(pending).decode(encoding, errors='surrogateescape')
+
     def _read_stderr(self, encoding='utf-8'):
         """Reads self.proc.stderr.
 
@@ -1158,30 +2645,43 @@ class GitRepository:
         stderr reading loop.
 
         Reads self.proc.stderr (self.proc is the subprocess running
-        the git command), and reads / writes self.failed_message
-        (the message sent to stderr when git fails, usually one line).
+        the git command) in blocks, keeping only the last bytes of
+        the stream in self.stderr_tail; when git fails, its message
+        is usually the last line. Data is decoded only to log it in
+        debug mode.
         """
-        for line in self.proc.stderr:
-            err_line = line.decode(encoding, errors='surrogateescape')
-
-            if self.proc.returncode != 0:
-                # If the subprocess didn't finish successfully, we expect
-                # the last line in stderr to provide the cause
-                if self.failed_message is not None:
-                    # We had a message, there is a newer line, print it
-                    logger.debug("Git log stderr: " + self.failed_message)
-                self.failed_message = err_line
-            else:
-                # The subprocess is successfully up to now, print the line
-                logger.debug("Git log stderr: " + err_line)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        tail = b''
+
+        while True:
+            data = self.proc.stderr.read(self.READ_BUFFER_SIZE)
+
+            if not data:
+                break
+
+            if debug:
+                err = data.decode(encoding, errors='surrogateescape')
+                logger.debug("Git log stderr: " + err)
+
+            tail = (tail + data)[-self.STDERR_TAIL_SIZE:]
+
+        self.stderr_tail = tail
 
     @staticmethod
-    def _exec(cmd, cwd=None, env=None, encoding='utf-8'):
+    def _last_line(data, encoding='utf-8'):
+        """Decode the last non empty line of some bytes"""
+
+        lines = data.rstrip().rsplit(b'\n', 1)
+        return lines[-1].decode(encoding, errors='surrogateescape')
+
+    @staticmethod
+    def _exec(cmd, cwd=None, env=None, encoding='utf-8', input=None):
         """Run a command.
 
         Execute `cmd` command in the directory set by `cwd`. Enviroment
         variables can be set using the `env` dictionary. The output
-        data is returned as encoded bytes.
+        data is returned as encoded bytes. When `input` is given, these
+        bytes are sent to the standard input of the command.
 
         :returns: the output of the command as encoded bytes
 
@@ -1193,8 +2693,9 @@ class GitRepository:
         try:
             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                                     stderr=subprocess.PIPE,
+                                    stdin=subprocess.PIPE if input is not None else None,
                                     cwd=cwd, env=env)
-            (outs, errs) = proc.communicate()
+            (outs, errs) = proc.communicate(input=input)
         except OSError as e:
             raise RepositoryError(cause=str(e))
 
@@ -1206,3 +2707,55 @@ class GitRepository:
             logger.debug(errs.decode(encoding, errors='surrogateescape'))
 
         return outs
+
+
+def _parse_log_range(dirpath, gitenv, commits, opts, encoding='utf-8', nul_format=False):
+    """Generate and parse the log of a list of commits.
+
+    Function run by the workers of `GitRepository.parallel_log`.
+    The commits are given to `git log` through its standard input
+    and shown in that same order, using the output options `opts`.
+
+    :returns: a list of parsed commits
+    """
+    cmd_log = ['git', 'log', '--no-walk=unsorted', '--stdin']
+    cmd_log.extend(opts)
+    sep = '\0' if nul_format else '\n'
+
+    data = '\n'.join(commits) + '\n'
+
+    outs = GitRepository._exec(cmd_log, cwd=dirpath, env=gitenv,
+                               input=data.encode('utf-8'))
+    outs = outs.decode(encoding, errors='surrogateescape')
+
+    records = outs.split(sep)
+
+    if records and not records[-1]:
+        records.pop()
+
+    if nul_format:
+        parser = GitNulParser(records)
+    else:
+        parser = GitParser(records)
+
+    return [commit for commit in parser.parse()]
+
+
+def _parse_log_chunk(filepath, start, end):
+    """Parse a chunk of a Git log file.
+
+    Function run by the workers of `Git.parse_git_log_from_file`.
+    The chunk is read from the bytes between `start` and `end`
+    offsets of the file, which must be commit boundaries.
+
+    :returns: a list of parsed commits
+    """
+    with open(filepath, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+
+    data = data.decode('utf-8', errors='surrogateescape')
+
+    with io.StringIO(data, newline=os.linesep) as stream:
+        parser = GitParser(stream)
+        return [commit for commit in parser.parse()]
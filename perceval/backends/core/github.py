@@ -22,8 +22,11 @@
 #     Alberto Martín <alberto.martin@bitergia.com>
 #
 
+import collections
+import concurrent.futures
 import json
 import logging
+import os
 
 import requests
 
@@ -34,8 +37,13 @@ from ...backend import (Backend,
                         BackendCommand,
                         BackendCommandArgumentParser,
                         metadata)
-from ...client import HttpClient, RateLimitHandler
+from ...cache import EntityCache
+from ...client import (HttpClient,
+                       RateLimitCoordinator,
+                       RateLimitHandler,
+                       RATE_LIMIT_DB_DEFAULT_PATH)
 from ...errors import CacheError
+from ...profiler import stage
 from ...utils import DEFAULT_DATETIME
 
 
@@ -50,6 +58,9 @@ MAX_RATE_LIMIT = 500
 DEFAULT_SLEEP_TIME = 1
 MAX_RETRIES = 5
 
+# Seconds users and their organizations are cached
+USERS_CACHE_TTL = 7 * 24 * 60 * 60
+
 TARGET_ISSUE_FIELDS = ['user', 'assignee', 'assignees', 'comments', 'reactions']
 
 logger = logging.getLogger(__name__)
@@ -63,7 +74,9 @@ class GitHub(Backend):
 
     :param owner: GitHub owner
     :param repository: GitHub repository from the owner
-    :param api_token: GitHub auth token to access the API
+    :param api_token: GitHub auth token to access the API or
+        a list of them; the client switches to the token with
+        the most quota left when the rate limit is exhausted
     :param base_url: GitHub URL in enterprise edition case;
         when no value is set the backend will be fetch the data
         from the GitHub public site.
@@ -72,14 +85,26 @@ class GitHub(Backend):
     :param sleep_for_rate: sleep until rate limit is reset
     :param min_rate_to_sleep: minimun rate needed to sleep until
          it will be reset
+    :param users_cache_path: path to the file where users and their
+        organizations are cached; by default, they are only cached
+        in memory
+    :param users_cache_ttl: seconds users are cached
+    :param shared_rate_limit: path to the database where the rate
+        limits of the tokens are shared with other processes; by
+        default, they are not shared
     """
     version = '0.12.0'
 
+    # Issues submitted in advance per enrichment worker
+    ISSUES_PER_WORKER = 2
+
     def __init__(self, owner=None, repository=None,
                  api_token=None, base_url=None,
                  tag=None, cache=None,
                  sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT,
-                 max_retries=MAX_RETRIES, default_sleep_time=DEFAULT_SLEEP_TIME):
+                 max_retries=MAX_RETRIES, default_sleep_time=DEFAULT_SLEEP_TIME,
+                 users_cache_path=None, users_cache_ttl=USERS_CACHE_TTL,
+                 shared_rate_limit=None):
         origin = base_url if base_url else GITHUB_URL
         origin = urijoin(origin, owner, repository)
 
@@ -87,9 +112,22 @@ class GitHub(Backend):
         self.owner = owner
         self.repository = repository
         self.api_token = api_token
+
+        if users_cache_path:
+            users_cache = EntityCache(users_cache_path, ttl=users_cache_ttl)
+        else:
+            users_cache = None
+
+        if shared_rate_limit:
+            coordinator = RateLimitCoordinator(os.path.expanduser(shared_rate_limit))
+        else:
+            coordinator = None
+
         self.client = GitHubClient(owner, repository, api_token, base_url,
                                    sleep_for_rate, min_rate_to_sleep,
-                                   max_retries, default_sleep_time)
+                                   max_retries, default_sleep_time,
+                                   users_cache=users_cache,
+                                   rate_limit_coordinator=coordinator)
         self._users = {}  # internal users cache
 
     @classmethod
@@ -141,13 +179,19 @@ class GitHub(Backend):
         return 'issue'
 
     @metadata
-    def fetch(self, from_date=DEFAULT_DATETIME):
+    def fetch(self, from_date=DEFAULT_DATETIME, workers=1):
         """Fetch the issues from the repository.
 
         The method retrieves, from a GitHub repository, the issues
         updated since the given date.
 
+        Users, assignees, comments and reactions of the issues are
+        fetched on a pool of `workers` threads, one issue per thread,
+        when `workers` is greater than one. Issues are returned in the
+        same order they were fetched, anyway.
+
         :param from_date: obtain issues updated since this date
+        :param workers: number of threads enriching issues
 
         :returns: a generator of issues
         """
@@ -158,36 +202,98 @@ class GitHub(Backend):
 
         issues_groups = self.client.issues(from_date=from_date)
 
-        for raw_issues in issues_groups:
-            self._push_cache_queue('{ISSUES}')
-            self._push_cache_queue(raw_issues)
-            self._flush_cache_queue()
-            issues = json.loads(raw_issues)
-            for issue in issues:
-                self.__init_extra_issue_fields(issue)
-                for field in TARGET_ISSUE_FIELDS:
-
-                    if not issue[field]:
-                        continue
-
-                    if field == 'user':
-                        issue[field + '_data'] = self.__get_user(issue[field]['login'])
-                    elif field == 'assignee':
-                        issue[field + '_data'] = self.__get_issue_assignee(issue[field])
-                    elif field == 'assignees':
-                        issue[field + '_data'] = self.__get_issue_assignees(issue[field])
-                    elif field == 'comments':
-                        issue[field + '_data'] = self.__get_issue_comments(issue['number'])
-                    elif field == 'reactions':
-                        issue[field + '_data'] = \
-                            self.__get_issue_reactions(issue['number'], issue['reactions']['total_count'])
-
-                self._push_cache_queue('{ISSUE-END}')
+        if workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        else:
+            executor = None
+
+        try:
+            for raw_issues in issues_groups:
+                self._push_cache_queue('{ISSUES}')
+                self._push_cache_queue(raw_issues)
                 self._flush_cache_queue()
-                yield issue
+                issues = json.loads(raw_issues)
+
+                for issue, events in self.__enrich_issues(issues, executor, workers):
+                    for event in events:
+                        self._push_cache_queue(event)
+                    self._push_cache_queue('{ISSUE-END}')
+                    self._flush_cache_queue()
+                    yield issue
+        finally:
+            if executor:
+                executor.shutdown(wait=True)
+
         self._push_cache_queue('{}{}')
         self._flush_cache_queue()
 
+    def __enrich_issues(self, issues, executor, workers):
+        """Enrich a list of issues, keeping their order.
+
+        When no `executor` is given, issues are enriched one after
+        the other. Otherwise, up to `ISSUES_PER_WORKER` issues per
+        worker are submitted in advance.
+
+        :returns: a generator of tuples with the issue and the list
+            of cache events generated during its enrichment
+        """
+        if not executor:
+            for issue in issues:
+                yield self.__enrich_issue(issue)
+            return
+
+        pending = collections.deque()
+        issues = iter(issues)
+        window = workers * self.ISSUES_PER_WORKER
+
+        try:
+            for issue in issues:
+                pending.append(executor.submit(self.__enrich_issue, issue))
+
+                if len(pending) >= window:
+                    with stage('http'):
+                        enriched = pending.popleft().result()
+                    yield enriched
+
+            while pending:
+                with stage('http'):
+                    enriched = pending.popleft().result()
+                yield enriched
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def __enrich_issue(self, issue):
+        """Add users, comments and reactions data to an issue.
+
+        Cache events are not pushed to the cache queue but stored
+        in a list, so issues can be enriched in parallel and their
+        events stored in order later.
+
+        :returns: a tuple with the issue and its list of cache events
+        """
+        events = []
+
+        self.__init_extra_issue_fields(issue)
+        for field in TARGET_ISSUE_FIELDS:
+
+            if not issue[field]:
+                continue
+
+            if field == 'user':
+                issue[field + '_data'] = self.__get_user(issue[field]['login'], events)
+            elif field == 'assignee':
+                issue[field + '_data'] = self.__get_issue_assignee(issue[field], events)
+            elif field == 'assignees':
+                issue[field + '_data'] = self.__get_issue_assignees(issue[field], events)
+            elif field == 'comments':
+                issue[field + '_data'] = self.__get_issue_comments(issue['number'], events)
+            elif field == 'reactions':
+                issue[field + '_data'] = \
+                    self.__get_issue_reactions(issue['number'], issue['reactions']['total_count'], events)
+
+        return issue, events
+
     @metadata
     def fetch_from_cache(self):
         """Fetch the issues from the cache.
@@ -242,98 +348,88 @@ class GitHub(Backend):
                 raw_item = next(cache_items)
                 yield issue
 
-    def __get_issue_reactions(self, issue_number, total_count):
+    def __get_issue_reactions(self, issue_number, total_count, events):
         """Get issue reactions"""
 
         reactions = []
-        self._push_cache_queue('{ISSUE-REACTIONS}')
-        self._flush_cache_queue()
+        events.append('{ISSUE-REACTIONS}')
 
         if total_count == 0:
-            self._push_cache_queue('[]')
-            self._flush_cache_queue()
+            events.append('[]')
             return reactions
 
         group_reactions = self.client.issue_reactions(issue_number)
 
         for raw_reactions in group_reactions:
-            self._push_cache_queue(raw_reactions)
-            self._flush_cache_queue()
+            events.append(raw_reactions)
 
             for reaction in json.loads(raw_reactions):
-                reaction['user_data'] = self.__get_user(reaction['user']['login'])
+                reaction['user_data'] = self.__get_user(reaction['user']['login'], events)
                 reactions.append(reaction)
 
         return reactions
 
-    def __get_issue_comments(self, issue_number):
+    def __get_issue_comments(self, issue_number, events):
         """Get issue comments"""
 
         comments = []
         group_comments = self.client.issue_comments(issue_number)
-        self._push_cache_queue('{COMMENTS}')
-        self._flush_cache_queue()
+        events.append('{COMMENTS}')
 
         for raw_comments in group_comments:
-            self._push_cache_queue(raw_comments)
-            self._flush_cache_queue()
+            events.append(raw_comments)
 
             for comment in json.loads(raw_comments):
                 comment_id = comment.get('id')
-                comment['user_data'] = self.__get_user(comment['user']['login'])
+                comment['user_data'] = self.__get_user(comment['user']['login'], events)
                 comment['reactions_data'] = \
-                    self.__get_issue_comment_reactions(comment_id, comment['reactions']['total_count'])
+                    self.__get_issue_comment_reactions(comment_id, comment['reactions']['total_count'], events)
                 comments.append(comment)
 
         return comments
 
-    def __get_issue_comment_reactions(self, comment_id, total_count):
+    def __get_issue_comment_reactions(self, comment_id, total_count, events):
         """Get reactions on issue comments"""
 
         reactions = []
-        self._push_cache_queue('{COMMENT-REACTIONS}')
-        self._flush_cache_queue()
+        events.append('{COMMENT-REACTIONS}')
 
         if total_count == 0:
-            self._push_cache_queue('[]')
-            self._flush_cache_queue()
+            events.append('[]')
             return reactions
 
         group_reactions = self.client.issue_comment_reactions(comment_id)
 
         for raw_reactions in group_reactions:
-            self._push_cache_queue(raw_reactions)
-            self._flush_cache_queue()
+            events.append(raw_reactions)
 
             for reaction in json.loads(raw_reactions):
-                reaction['user_data'] = self.__get_user(reaction['user']['login'])
+                reaction['user_data'] = self.__get_user(reaction['user']['login'], events)
                 reactions.append(reaction)
 
         return reactions
 
-    def __get_issue_assignee(self, raw_assignee):
+    def __get_issue_assignee(self, raw_assignee, events):
         """Get issue assignee"""
 
-        self._push_cache_queue('{ASSIGNEE}')
-        self._push_cache_queue(raw_assignee)
-        self._flush_cache_queue()
-        assignee = self.__get_user(raw_assignee['login'])
+        events.append('{ASSIGNEE}')
+        events.append(raw_assignee)
+        assignee = self.__get_user(raw_assignee['login'], events)
 
         return assignee
 
-    def __get_issue_assignees(self, raw_assignees):
+    def __get_issue_assignees(self, raw_assignees, events):
         """Get issue assignees"""
 
-        self._push_cache_queue('{ASSIGNEES}')
-        self._push_cache_queue(raw_assignees)
-        self._flush_cache_queue()
+        events.append('{ASSIGNEES}')
+        events.append(raw_assignees)
         assignees = []
         for ra in raw_assignees:
-            assignees.append(self.__get_user(ra['login']))
+            assignees.append(self.__get_user(ra['login'], events))
 
         return assignees
 
-    def __get_user(self, login):
+    def __get_user(self, login, events):
         """Get user and org data for the login"""
 
         user = {}
@@ -343,13 +439,12 @@ class GitHub(Backend):
 
         user_raw = self.client.user(login)
         user = json.loads(user_raw)
-        self._push_cache_queue('{USER}')
-        self._push_cache_queue(user_raw)
+        events.append('{USER}')
+        events.append(user_raw)
         user_orgs_raw = \
             self.client.user_orgs(login)
         user['organizations'] = json.loads(user_orgs_raw)
-        self._push_cache_queue(user_orgs_raw)
-        self._flush_cache_queue()
+        events.append(user_orgs_raw)
 
         return user
 
@@ -457,17 +552,39 @@ class GitHub(Backend):
 
 
 class GitHubClient(HttpClient, RateLimitHandler):
-    """Client for retieving information from GitHub API"""
+    """Client for retieving information from GitHub API.
+
+    Users and their organizations are cached in a `EntityCache`
+    by the URL they are fetched from. Unless `users_cache` is
+    given, the cache is only kept in memory and it is shared by
+    every client.
+
+    `token` can be a single token or a list of them. With a pool of
+    tokens, the client starts with the token with the most quota left
+    and switches tokens when its rate limit is exhausted.
 
-    _users = {}       # users cache
-    _users_orgs = {}  # users orgs cache
+    When `rate_limit_coordinator` is given, the rate limits of the
+    tokens are shared with other processes.
+    """
+
+    _users_cache = EntityCache(ttl=USERS_CACHE_TTL)
 
     def __init__(self, owner, repository, token, base_url=None,
                  sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT,
-                 default_sleep_time=DEFAULT_SLEEP_TIME, max_retries=MAX_RETRIES):
+                 default_sleep_time=DEFAULT_SLEEP_TIME, max_retries=MAX_RETRIES,
+                 users_cache=None, rate_limit_coordinator=None):
         self.owner = owner
         self.repository = repository
-        self.token = token
+
+        if isinstance(token, str):
+            tokens = [token]
+        else:
+            tokens = [t for t in token] if token else []
+
+        self.token = tokens[0] if tokens else None
+
+        if users_cache:
+            self._users_cache = users_cache
 
         if base_url:
             base_url = urijoin(base_url, 'api', 'v3')
@@ -480,14 +597,16 @@ class GitHubClient(HttpClient, RateLimitHandler):
                          default_sleep_time=default_sleep_time,
                          max_retries=max_retries, headers=headers)
         super().setup_rate_limit_handler(sleep_for_rate=sleep_for_rate,
-                                         min_rate_to_sleep=min_rate_to_sleep)
+                                         min_rate_to_sleep=min_rate_to_sleep,
+                                         tokens=tokens,
+                                         coordinator=rate_limit_coordinator)
 
         self._init_rate_limit()
 
     def _build_headers(self):
         """Set headers for session"""
 
-        headers = super().DEFAULT_HEADERS
+        headers = dict(super().DEFAULT_HEADERS)
         headers.update({'Accept': 'application/vnd.github.squirrel-girl-preview'})
 
         if self.token:
@@ -496,17 +615,40 @@ class GitHubClient(HttpClient, RateLimitHandler):
         return headers
 
     def _init_rate_limit(self):
-        """Initialize rate limit information"""
+        """Initialize rate limit information.
 
+        With a pool of tokens, the rate limit of each token is read
+        and the one with the most quota left is chosen.
+        """
         url = urijoin(self.base_url, "rate_limit")
-        try:
-            response = super().fetch(url)
-            self.update_rate_limit(response)
-        except requests.exceptions.HTTPError as error:
-            if error.response.status_code == 404:
-                logger.warning("Rate limit not initialized: %s", error)
-            else:
-                raise error
+
+        if len(self.tokens) > 1:
+            tokens = self.tokens[1:] + self.tokens[:1]
+        else:
+            tokens = [self.current_token]
+
+        for token in tokens:
+            if token != self.current_token:
+                self.switch_token(token)
+
+            try:
+                response = super().fetch(url)
+                self.update_rate_limit(response)
+            except requests.exceptions.HTTPError as error:
+                if error.response.status_code == 404:
+                    logger.warning("Rate limit not initialized: %s", error)
+                    return
+                else:
+                    raise error
+
+        if len(self.tokens) > 1:
+            self.choose_token()
+
+    def _set_token(self, token):
+        """Set the token used on the next requests"""
+
+        self.token = token
+        self.session.headers['Authorization'] = 'token ' + token
 
     def issue_reactions(self, issue_number):
         """Get reactions of an issue"""
@@ -562,28 +704,31 @@ class GitHubClient(HttpClient, RateLimitHandler):
     def user(self, login):
         """Get the user information and update the user cache"""
 
-        user = None
+        url_user = urijoin(self.base_url, 'users', login)
 
-        if login in self._users:
-            return self._users[login]
+        user = self._users_cache.get(url_user)
 
-        url_user = urijoin(self.base_url, 'users', login)
+        if user is not None:
+            return user
 
         logging.info("Getting info for %s" % (url_user))
 
         r = self.fetch(url_user)
         user = r.text
-        self._users[login] = user
+        self._users_cache.set(url_user, user)
 
         return user
 
     def user_orgs(self, login):
         """Get the user public organizations"""
 
-        if login in self._users_orgs:
-            return self._users_orgs[login]
-
         url = urijoin(self.base_url, 'users', login, 'orgs')
+
+        orgs = self._users_cache.get(url)
+
+        if orgs is not None:
+            return orgs
+
         try:
             r = self.fetch(url)
             orgs = r.text
@@ -595,14 +740,24 @@ class GitHubClient(HttpClient, RateLimitHandler):
             else:
                 raise error
 
-        self._users_orgs[login] = orgs
+        self._users_cache.set(url, orgs)
 
         return orgs
 
     def fetch(self, url, payload=None, headers=None, method=HttpClient.GET, stream=False):
         self.sleep_for_rate_limit()
+
+        # Other threads may switch the token of the session meanwhile,
+        # so the request is made and accounted with the current one
+        with self._rate_limit_lock:
+            token = self.current_token
+
+        if token:
+            headers = dict(headers) if headers else {}
+            headers['Authorization'] = 'token ' + token
+
         response = super().fetch(url, payload, headers, method, stream)
-        self.update_rate_limit(response)
+        self.update_rate_limit(response, token)
 
         return response
 
@@ -650,9 +805,15 @@ class GitHubCommand(BackendCommand):
         """Returns the GitHub argument parser."""
 
         parser = BackendCommandArgumentParser(from_date=True,
-                                              token_auth=True,
                                               cache=True)
 
+        # Authentication options; a token can be given several times
+        group = parser.parser.add_argument_group('authentication arguments')
+        group.add_argument('-t', '--api-token', dest='api_token',
+                           action='append',
+                           help="backend authentication token / API key; "
+                                "set it several times to use a pool of tokens")
+
         # GitHub options
         group = parser.parser.add_argument_group('GitHub arguments')
         group.add_argument('--enterprise-url', dest='base_url',
@@ -663,6 +824,18 @@ class GitHubCommand(BackendCommand):
         group.add_argument('--min-rate-to-sleep', dest='min_rate_to_sleep',
                            default=MIN_RATE_LIMIT, type=int,
                            help="sleep until reset when the rate limit reaches this value")
+        group.add_argument('--workers', dest='workers',
+                           default=1, type=int,
+                           help="number of threads fetching the data of the issues")
+        group.add_argument('--users-cache', dest='users_cache_path',
+                           help="file where users and their organizations are cached")
+        group.add_argument('--users-cache-ttl', dest='users_cache_ttl',
+                           default=USERS_CACHE_TTL, type=int,
+                           help="seconds users and their organizations are cached")
+        group.add_argument('--shared-rate-limit', dest='shared_rate_limit',
+                           nargs='?', const=RATE_LIMIT_DB_DEFAULT_PATH,
+                           help="share the rate limit with other processes using "
+                                "this database (default: %s)" % RATE_LIMIT_DB_DEFAULT_PATH)
 
         # Generic client options
         group.add_argument('--max-retries', dest='max_retries',
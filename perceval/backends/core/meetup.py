@@ -22,6 +22,8 @@
 
 import json
 import logging
+import os
+import time
 
 from grimoirelab.toolkit.datetime import datetime_to_utc
 from grimoirelab.toolkit.uris import urijoin
@@ -30,7 +32,10 @@ from ...backend import (Backend,
                         BackendCommand,
                         BackendCommandArgumentParser,
                         metadata)
-from ...client import HttpClient, RateLimitHandler
+from ...client import (HttpClient,
+                       RateLimitCoordinator,
+                       RateLimitHandler,
+                       RATE_LIMIT_DB_DEFAULT_PATH)
 from ...errors import CacheError
 from ...utils import DEFAULT_DATETIME
 
@@ -67,22 +72,32 @@ class Meetup(Backend):
          it will be reset
     :param sleep_time: minimun waiting time to avoid too many request
          exception
+    :param shared_rate_limit: path to the database where the rate
+        limit of the key is shared with other processes; by default,
+        it is not shared
     """
     version = '0.6.0'
 
     def __init__(self, group, api_token, max_items=MAX_ITEMS,
                  tag=None, cache=None,
                  sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT,
-                 sleep_time=SLEEP_TIME):
+                 sleep_time=SLEEP_TIME, shared_rate_limit=None):
         origin = MEETUP_URL
 
         super().__init__(origin, tag=tag, cache=cache)
         self.group = group
         self.max_items = max_items
+
+        if shared_rate_limit:
+            coordinator = RateLimitCoordinator(os.path.expanduser(shared_rate_limit))
+        else:
+            coordinator = None
+
         self.client = MeetupClient(api_token, max_items=max_items,
                                    sleep_for_rate=sleep_for_rate,
                                    min_rate_to_sleep=min_rate_to_sleep,
-                                   sleep_time=sleep_time)
+                                   sleep_time=sleep_time,
+                                   rate_limit_coordinator=coordinator)
 
     @metadata
     def fetch(self, from_date=DEFAULT_DATETIME, to_date=None):
@@ -325,6 +340,10 @@ class MeetupCommand(BackendCommand):
         group.add_argument('--sleep-time', dest='sleep_time',
                            default=SLEEP_TIME, type=int,
                            help="minimun sleeping time to avoid too many request exception")
+        group.add_argument('--shared-rate-limit', dest='shared_rate_limit',
+                           nargs='?', const=RATE_LIMIT_DB_DEFAULT_PATH,
+                           help="share the rate limit with other processes using "
+                                "this database (default: %s)" % RATE_LIMIT_DB_DEFAULT_PATH)
 
         # Required arguments
         parser.parser.add_argument('group',
@@ -341,6 +360,8 @@ class MeetupClient(HttpClient, RateLimitHandler):
 
     :param api_key: key needed to use the API
     :param max_items: maximum number of items per request
+    :param rate_limit_coordinator: `RateLimitCoordinator` to share
+        the rate limit of the key with other processes
     """
     RCOMMENTS = 'comments'
     REVENTS = 'events'
@@ -364,7 +385,8 @@ class MeetupClient(HttpClient, RateLimitHandler):
     VUPDATED = 'updated'
 
     def __init__(self, api_key, max_items=MAX_ITEMS,
-                 sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT, sleep_time=SLEEP_TIME):
+                 sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT, sleep_time=SLEEP_TIME,
+                 rate_limit_coordinator=None):
         self.api_key = api_key
         self.max_items = max_items
 
@@ -372,8 +394,11 @@ class MeetupClient(HttpClient, RateLimitHandler):
         status_list.append(429)
         super().__init__(MEETUP_API_URL,
                          default_sleep_time=sleep_time, status_forcelist=status_list)
+        # The key identifies the rate limit shared with other processes
         super().setup_rate_limit_handler(sleep_for_rate=sleep_for_rate,
-                                         min_rate_to_sleep=min_rate_to_sleep)
+                                         min_rate_to_sleep=min_rate_to_sleep,
+                                         tokens=[api_key] if api_key else None,
+                                         coordinator=rate_limit_coordinator)
 
     def events(self, group, from_date=DEFAULT_DATETIME):
         """Fetch the events pages of a given group."""
@@ -431,6 +456,18 @@ class MeetupClient(HttpClient, RateLimitHandler):
         for page in self._fetch(resource, params):
             yield page
 
+    def calculate_rate_limit_reset_ts(self, reset):
+        """Calculate the time of the next rate limit reset.
+
+        Meetup sends the seconds left until the reset instead of
+        its timestamp.
+
+        :param reset: value of the rate limit reset header
+
+        :returns: the epoch timestamp of the reset
+        """
+        return int(time.time()) + int(reset)
+
     def _fetch(self, resource, params):
         """Fetch a resource.
 
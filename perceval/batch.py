@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import shlex
+import sys
+import time
+
+from .backend import OutputSink
+from .errors import ParseError
+
+
+logger = logging.getLogger(__name__)
+
+
+BatchTask = collections.namedtuple('BatchTask', ['task_id', 'backend', 'args'])
+BatchResult = collections.namedtuple('BatchResult',
+                                     ['task_id', 'backend', 'output',
+                                      'exit_code', 'error', 'elapsed'])
+
+OUTPUT_ARGS = ['-o', '--output']
+SINK_ARGS = ['--output-compression', '--output-rotate-items', '--output-rotate-bytes']
+SUMMARY_FILE = 'summary.json'
+
+
+def read_tasks(filepath):
+    """Read a list of tasks from a file.
+
+    Each line of the file defines a task: the name of the backend
+    followed by its arguments, as they would be given in the command
+    line. Arguments are split following shell quoting rules. Empty
+    lines and lines starting with '#' are ignored.
+
+        git https://github.com/grimoirelab/perceval.git --from-date 2017-01-01
+        github grimoirelab perceval -t 'my token' --sleep-for-rate
+
+    Tasks are identified by their line number in the file.
+
+    :param filepath: path to the file with the list of tasks
+
+    :returns: a list of `BatchTask` objects
+
+    :raises ParseError: raised when a line cannot be split
+    """
+    tasks = []
+
+    with open(filepath, 'r') as fd:
+        for nline, line in enumerate(fd, start=1):
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            try:
+                tokens = shlex.split(line)
+            except ValueError as e:
+                cause = "invalid task on line %s; %s" % (nline, str(e))
+                raise ParseError(cause=cause)
+
+            task = BatchTask(nline, tokens[0], tokens[1:])
+            tasks.append(task)
+
+    return tasks
+
+
+def run_batch(tasks, commands, output_dir, max_workers=None):
+    """Run a list of tasks in parallel.
+
+    Tasks are run on a pool of `max_workers` processes. By default,
+    the size of the pool is the number of processors of the machine.
+    The items fetched by each task are written to its own file on
+    `output_dir`, named after the task identifier and the backend,
+    unless the task sets its output with '-o' or '--output'.
+
+    Command classes are found once, by the caller, and sent to the
+    workers; each worker only imports the modules of the backends
+    it runs.
+
+    Once every task has finished, a summary of the execution is
+    written to 'summary.json' in `output_dir`.
+
+    :param tasks: list of `BatchTask` objects to run
+    :param commands: dict of `BackendCommand` classes by backend name
+    :param output_dir: directory where the items will be written
+    :param max_workers: maximum number of processes running tasks
+
+    :returns: a list of `BatchResult` objects in the same order of
+        the tasks
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    results = {}
+    futures = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for task in tasks:
+            args, output = _task_output(task, output_dir)
+
+            if task.backend not in commands:
+                error = "Unknown backend %s" % task.backend
+                results[task.task_id] = BatchResult(task.task_id, task.backend,
+                                                    output, 1, error, 0.0)
+                logger.error("Task %s failed; %s", task.task_id, error)
+                continue
+
+            future = executor.submit(_run_task, commands[task.backend], args)
+            futures[future] = (task, output)
+
+        for future in concurrent.futures.as_completed(futures):
+            task, output = futures[future]
+
+            try:
+                exit_code, error, elapsed = future.result()
+            except Exception as e:
+                # The worker died or the result could not be sent back
+                exit_code, error, elapsed = 1, str(e), 0.0
+
+            result = BatchResult(task.task_id, task.backend, output,
+                                 exit_code, error, elapsed)
+            results[task.task_id] = result
+
+            if exit_code == 0:
+                logger.info("Task %s (%s) completed in %.2f secs",
+                            task.task_id, task.backend, elapsed)
+            else:
+                logger.error("Task %s (%s) failed; %s",
+                             task.task_id, task.backend, error)
+
+    results = [results[task.task_id] for task in tasks]
+
+    write_summary(results, os.path.join(output_dir, SUMMARY_FILE))
+
+    return results
+
+
+def write_summary(results, filepath):
+    """Write the summary of a batch execution to a JSON file.
+
+    :param results: list of `BatchResult` objects
+    :param filepath: path of the summary file
+    """
+    summary = {
+        'tasks': len(results),
+        'completed': len([r for r in results if r.exit_code == 0]),
+        'failed': len([r for r in results if r.exit_code != 0]),
+        'results': [r._asdict() for r in results]
+    }
+
+    with open(filepath, 'w') as fd:
+        json.dump(summary, fd, indent=4, sort_keys=True)
+
+
+def format_summary(results):
+    """Format the results of a batch execution as a table.
+
+    :param results: list of `BatchResult` objects
+
+    :returns: a string with a line for each task and the totals
+    """
+    header = ('task', 'backend', 'exit', 'time (s)', 'output / error')
+    lines = ["%-6s %-16s %-5s %10s  %s" % header]
+
+    for r in results:
+        info = r.output if r.exit_code == 0 else r.error
+        row = (r.task_id, r.backend, r.exit_code, r.elapsed, info)
+        lines.append("%-6s %-16s %-5s %10.2f  %s" % row)
+
+    nfailed = len([r for r in results if r.exit_code != 0])
+    totals = (len(results), len(results) - nfailed, nfailed)
+    lines.append("%s tasks; %s completed; %s failed" % totals)
+    return '\n'.join(lines)
+
+
+def _task_output(task, output_dir):
+    """Set the output file of a task, when it is not given.
+
+    When the items of the task are written by an `OutputSink`, the
+    path of its manifest is returned instead, because it lists the
+    files actually written.
+    """
+    args = list(task.args)
+    output = _find_arg_value(args, OUTPUT_ARGS)
+
+    if output is None:
+        output = os.path.join(output_dir, '%05d-%s.json' % (task.task_id, task.backend))
+        args.extend(['--output', output])
+
+    if any(_find_arg_value(args, [arg]) for arg in SINK_ARGS):
+        compression = _find_arg_value(args, ['--output-compression'])
+        output = OutputSink.manifest(output, compression)
+
+    return args, output
+
+
+def _find_arg_value(args, names):
+    """Find the value of an argument given with any of `names`"""
+
+    for i, arg in enumerate(args):
+        if arg in names and i + 1 < len(args):
+            return args[i + 1]
+
+        name, sep, value = arg.partition('=')
+
+        if sep and name in names:
+            return value
+
+    return None
+
+
+def _run_task(klass, args):
+    """Run a backend command on a worker"""
+
+    start = time.time()
+    exit_code = 0
+    error = None
+
+    try:
+        cmd = klass(*args)
+        cmd.run()
+
+        if cmd.outfile and cmd.outfile is not sys.stdout:
+            cmd.outfile.close()
+    except SystemExit as e:
+        # Raised by the argument parser on invalid arguments
+        exit_code = e.code if isinstance(e.code, int) and e.code else 2
+        error = "invalid arguments"
+    except Exception as e:
+        exit_code = 1
+        error = str(e)
+
+    return exit_code, error, time.time() - start
@@ -21,12 +21,60 @@
 #     Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import collections
+import dbm
+import hashlib
+import json
+import logging
 import os
-import shutil
+import pickle
+import re
 import shelve
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .errors import CacheError
+
+
+logger = logging.getLogger(__name__)
 
 
 CACHE_DEFAULT_PATH = '~/.perceval/cache/'
+CACHE_DEFAULT_CODEC = 'zlib'
+CACHE_FORMAT_VERSION = 2
+MIGRATION_BATCH_SIZE = 1000
+
+ENTITY_CACHE_DEFAULT_TTL = 7 * 24 * 60 * 60
+ENTITY_CACHE_MAX_SIZE = 10000
+
+
+Codec = collections.namedtuple('Codec', ['compress', 'decompress'])
+
+CODECS = {
+    'none': Codec(bytes, bytes),
+    'zlib': Codec(zlib.compress, zlib.decompress)
+}
+
+if lz4:
+    CODECS['lz4'] = Codec(lz4.frame.compress, lz4.frame.decompress)
+
+if zstandard:
+    CODECS['zstd'] = Codec(zstandard.ZstdCompressor().compress,
+                           zstandard.ZstdDecompressor().decompress)
 
 
 class Cache:
@@ -36,17 +84,64 @@ class Cache:
     further recovery. Items are stored in order in `dirname` directory
     path. Items are also retrieved following the same storage order.
 
+    Items are appended to a log split in segment files. Each segment
+    is filled until it reaches `SEGMENT_MAX_SIZE` bytes; after that,
+    a new segment is opened and the previous one is never modified
+    again. The position of every item in the log is stored in an
+    index file, so storing an item costs the same whatever the
+    number of items already in the cache and items are read back
+    sequentially. Items are addressed by their content: the data of
+    repeated items is only stored once and the index keeps references
+    to it.
+
+    Each item is compressed using one of the codecs available on
+    `CODECS`: 'zlib' is always available while 'lz4' and 'zstd' can
+    be used when their packages are installed. The codec is chosen
+    when the first item is stored and it is written to the header
+    of the cache, so the items of a cache are always decoded with
+    the codec used to encode them.
+
     The cache also provides the methods `backup` and `recover` that
     prevents from possible failures.
+
+    :param dirname: path where the cache will be stored
+    :param codec: name of the codec used to compress new caches
+
+    :raises CacheError: raised when the codec is not available
     """
 
     CACHE_PREFIX = 'perceval_cache'
+    SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+
+    # Index entries: segment number, offset, length and SHA1 of the item
+    INDEX_ENTRY = struct.Struct('<IQI20s')
+    INDEX_READ_ENTRIES = 1024
 
-    def __init__(self, dirname):
+    REPLAY_BUFFER_SIZE = 16 * 1024 * 1024
+
+    SEGMENT_SUFFIX = '.seg'
+    INDEX_SUFFIX = '.idx'
+    HEADER_SUFFIX = '.hdr'
+    SNAPSHOT_SUFFIX = '.snapshot'
+
+    def __init__(self, dirname, codec=CACHE_DEFAULT_CODEC):
+        if codec not in CODECS:
+            cause = "codec %s not available; valid codecs are: %s" \
+                % (codec, ', '.join(sorted(CODECS)))
+            raise CacheError(cause=cause)
+
+        self.codec = codec
         self.cache_path = dirname
         self.items_path = os.path.join(self.cache_path, 'items')
         self.recovery_path = os.path.join(self.cache_path, 'recovery')
         self.cache_files = os.path.join(self.items_path, self.CACHE_PREFIX)
+        self.index_file = self.cache_files + self.INDEX_SUFFIX
+        self.header_file = self.cache_files + self.HEADER_SUFFIX
+        self.snapshot_file = os.path.join(self.recovery_path,
+                                          self.CACHE_PREFIX + self.SNAPSHOT_SUFFIX)
+
+        self._digests = {}
+        self._index_state = None
 
         if not os.path.exists(self.cache_path):
             os.makedirs(self.cache_path)
@@ -55,20 +150,81 @@ class Cache:
         if not os.path.exists(self.recovery_path):
             os.makedirs(self.recovery_path)
 
+        if is_shelve_cache(self.cache_files):
+            migrate_shelve_cache(self)
+        if is_shelve_cache(os.path.join(self.recovery_path, self.CACHE_PREFIX)):
+            _migrate_shelve_recovery(self)
+
     def store(self, *items):
         """Store a set of items in the cache.
 
         The items will be stored in the cache in the given order. Thus,
         they can be recover in the same way.
 
+        Items are identified by the SHA1 of their data. When an item
+        was already stored, only a new reference to its data is added
+        to the index.
+
         :params items: list of items to store
         """
-        with shelve.open(self.cache_files) as cache:
-            key = len(cache.keys())
+        if not items:
+            return
+
+        compress = self._read_codec(create=True).compress
+        digests = self._load_digests()
+
+        # Invalidate digests until the index is written
+        self._index_state = None
+
+        segment = self._last_segment()
+        segment_path = self._segment_path(segment)
+
+        entries = []
+
+        fd = open(segment_path, 'ab')
+
+        try:
+            offset = fd.tell()
 
             for item in items:
-                cache[str(key)] = item
-                key += 1
+                data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                digest = hashlib.sha1(data).digest()
+
+                location = digests.get(digest, None)
+
+                if not location:
+                    if offset >= self.SEGMENT_MAX_SIZE:
+                        fd.close()
+                        segment += 1
+                        segment_path = self._segment_path(segment)
+                        fd = open(segment_path, 'ab')
+                        offset = 0
+
+                    data = compress(data)
+                    fd.write(data)
+
+                    location = (segment, offset, len(data))
+                    digests[digest] = location
+                    offset += len(data)
+
+                entries.append(self.INDEX_ENTRY.pack(*(location + (digest,))))
+        finally:
+            fd.close()
+
+        # Items are only available once they are indexed; any data
+        # written to a segment but not indexed will be ignored
+        with open(self.index_file, 'ab') as fd:
+            size = fd.tell()
+            partial = size % self.INDEX_ENTRY.size
+
+            # Remove entries partially written by a previous failure
+            if partial:
+                fd.truncate(size - partial)
+
+            fd.write(b''.join(entries))
+
+            st = os.fstat(fd.fileno())
+            self._index_state = ((st.st_dev, st.st_ino), fd.tell(), entries[-1])
 
     def retrieve(self):
         """Retrieve the items stored in the cache.
@@ -76,23 +232,90 @@ class Cache:
         This method is a generator that returns all the cache items
         in the same order they were stored.
 
+        The data of the items is read sequentially. The latest data
+        read, up to `REPLAY_BUFFER_SIZE` bytes, is kept in memory so
+        references to repeated items do not need to read it again.
+
         :returns: the items stored in the cache
+
+        :raises CacheError: raised when the data of an item cannot
+            be read from the cache
         """
-        with shelve.open(self.cache_files) as cache:
-            keys = [int(key) for key in list(cache.keys())]
-            keys.sort()
+        if not os.path.exists(self.index_file):
+            return
+
+        decompress = self._read_codec().decompress
+
+        segments = {}
+        recent = collections.OrderedDict()
+        recent_size = 0
+
+        try:
+            for segment, offset, length, _ in self._read_index():
+                location = (segment, offset)
+                data = recent.get(location, None)
+
+                if data is not None:
+                    recent.move_to_end(location)
+                    yield pickle.loads(decompress(data))
+                    continue
 
-            for key in keys:
-                yield cache[str(key)]
+                if segment not in segments:
+                    segments[segment] = open(self._segment_path(segment), 'rb')
+
+                fd = segments[segment]
+
+                if fd.tell() != offset:
+                    fd.seek(offset)
+
+                data = fd.read(length)
+
+                if len(data) != length:
+                    cause = "item data truncated in segment %s at offset %s" \
+                        % (segment, offset)
+                    raise CacheError(cause=cause)
+
+                if length <= self.REPLAY_BUFFER_SIZE:
+                    recent[location] = data
+                    recent_size += length
+
+                    while recent_size > self.REPLAY_BUFFER_SIZE:
+                        _, old = recent.popitem(last=False)
+                        recent_size -= len(old)
+
+                yield pickle.loads(decompress(data))
+        finally:
+            for fd in segments.values():
+                fd.close()
 
     def backup(self):
         """Make a backup of the cache.
 
         The method saves the items stored in the cache to the recovery
         backup. Any previous backup will be deleted.
+
+        Data files are never rewritten, only appended, so the backup
+        is a snapshot of the cache: the files are hard-linked into the
+        recovery directory and their current sizes are written to
+        a snapshot file. Thus, the time needed to make a backup does
+        not depend on the size of the cache. When the filesystem does
+        not support hard links, files are copied.
         """
         shutil.rmtree(self.recovery_path)
-        shutil.copytree(self.items_path, self.recovery_path)
+        os.makedirs(self.recovery_path)
+
+        snapshot = {}
+
+        for filename in os.listdir(self.items_path):
+            src = os.path.join(self.items_path, filename)
+
+            # Size must be read before linking; any data appended
+            # later will be discarded on recovery
+            snapshot[filename] = os.path.getsize(src)
+            _link_or_copy(src, os.path.join(self.recovery_path, filename))
+
+        with open(self.snapshot_file, 'w') as fd:
+            json.dump(snapshot, fd)
 
     def clean(self, erase=False):
         """Clear the cache.
@@ -116,13 +339,413 @@ class Cache:
         """Restore cache contents from the recovery backup.
 
         Cache items will be recovery from the cache backup,
-        if it is available.
+        if it is available. Files of the backup are hard-linked
+        (or copied) into the cache, discarding any data appended
+        to them after the snapshot was taken.
         """
+        snapshot = self._read_snapshot()
+
         shutil.rmtree(self.items_path)
-        shutil.copytree(self.recovery_path, self.items_path)
+        os.makedirs(self.items_path)
+
+        for filename in os.listdir(self.recovery_path):
+            src = os.path.join(self.recovery_path, filename)
+
+            if src == self.snapshot_file:
+                continue
+
+            if snapshot is not None:
+                if filename not in snapshot:
+                    continue
+                if os.path.getsize(src) > snapshot[filename]:
+                    os.truncate(src, snapshot[filename])
+
+            _link_or_copy(src, os.path.join(self.items_path, filename))
+
+    def _read_index(self, start=0):
+        """Read the entries of the index starting on `start` byte"""
+
+        entry_size = self.INDEX_ENTRY.size
+
+        with open(self.index_file, 'rb') as index:
+            index.seek(start)
+
+            while True:
+                chunk = index.read(entry_size * self.INDEX_READ_ENTRIES)
+                nentries = len(chunk) // entry_size
+
+                for i in range(nentries):
+                    yield self.INDEX_ENTRY.unpack_from(chunk, i * entry_size)
+
+                if nentries < self.INDEX_READ_ENTRIES:
+                    break
+
+    def _load_digests(self):
+        """Load the digests of the items stored in the cache.
+
+        Digests are kept between calls together with the state of the
+        index when they were loaded. Only the entries added since then
+        are read, unless the index was replaced or truncated (i.e, the
+        cache was cleaned or recovered); in that case, digests are
+        loaded again.
+        """
+        try:
+            st = os.stat(self.index_file)
+        except FileNotFoundError:
+            self._digests = {}
+            self._index_state = None
+            return self._digests
+
+        entry_size = self.INDEX_ENTRY.size
+        size = st.st_size - st.st_size % entry_size
+        start = 0
+
+        if self._index_state:
+            inode, last_size, last_entry = self._index_state
+
+            if inode == (st.st_dev, st.st_ino) and last_size <= size:
+                with open(self.index_file, 'rb') as fd:
+                    fd.seek(last_size - entry_size)
+                    if fd.read(entry_size) == last_entry:
+                        start = last_size
+
+        if not start:
+            self._digests = {}
+
+        for segment, offset, length, digest in self._read_index(start):
+            self._digests.setdefault(digest, (segment, offset, length))
+
+        return self._digests
+
+    def _read_codec(self, create=False):
+        """Read the codec from the header of the cache.
+
+        When the header does not exist and `create` is set, a new
+        header is written using the codec of this object.
+        """
+        if not os.path.exists(self.header_file):
+            if not create:
+                return CODECS['none']
+            self._write_header()
+
+        try:
+            with open(self.header_file, 'r') as fd:
+                header = json.load(fd)
+        except ValueError as e:
+            cause = "invalid header file %s; %s" % (self.header_file, str(e))
+            raise CacheError(cause=cause)
+
+        if header.get('version', None) != CACHE_FORMAT_VERSION:
+            cause = "format version %s of cache %s not supported" \
+                % (header.get('version', None), self.cache_path)
+            raise CacheError(cause=cause)
+
+        codec = header.get('codec', None)
+
+        if codec not in CODECS:
+            cause = "codec %s of cache %s not available" % (codec, self.cache_path)
+            raise CacheError(cause=cause)
+
+        return CODECS[codec]
+
+    def _write_header(self):
+        header = {
+            'version': CACHE_FORMAT_VERSION,
+            'codec': self.codec
+        }
+
+        # The header is replaced and never modified, so it can be
+        # safely shared with the backups
+        tmp_file = self.header_file + '.tmp'
+
+        with open(tmp_file, 'w') as fd:
+            json.dump(header, fd)
+
+        os.replace(tmp_file, self.header_file)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            return None
+
+        try:
+            with open(self.snapshot_file, 'r') as fd:
+                return json.load(fd)
+        except ValueError as e:
+            cause = "invalid snapshot file %s; %s" % (self.snapshot_file, str(e))
+            raise CacheError(cause=cause)
+
+    def _segment_path(self, segment):
+        return '%s.%08d%s' % (self.cache_files, segment, self.SEGMENT_SUFFIX)
+
+    def _last_segment(self):
+        segments = self._list_segments(self.items_path)
+        return segments[-1] if segments else 0
+
+    def _list_segments(self, dirpath):
+        prefix = re.escape(self.CACHE_PREFIX)
+        suffix = re.escape(self.SEGMENT_SUFFIX)
+        regex = re.compile(r'^%s\.(\d{8})%s$' % (prefix, suffix))
+
+        segments = []
+
+        for filename in os.listdir(dirpath):
+            m = regex.match(filename)
+            if m:
+                segments.append(int(m.group(1)))
+
+        segments.sort()
+
+        return segments
+
+
+class EntityCache:
+    """Cache of entities with a time to live.
+
+    This class stores entities, such as the users of a data source,
+    by their key. Entities are strings (i.e, the raw JSON data of a
+    user) which expire `ttl` seconds after they were stored; expired
+    entities are never returned.
+
+    When `path` is given, entities are stored in a SQLite database on
+    that file, so they can be shared by several backends, runs and
+    processes. The last `max_size` entities used are also kept in
+    memory; when no `path` is given, these are the only entities
+    stored. The cache can be used from several threads.
+
+    :param path: path to the database file
+    :param ttl: seconds an entity is valid
+    :param max_size: maximum number of entities kept in memory
+
+    :raises CacheError: raised when the database cannot be opened
+    """
+    DB_TIMEOUT = 30
+
+    def __init__(self, path=None, ttl=ENTITY_CACHE_DEFAULT_TTL,
+                 max_size=ENTITY_CACHE_MAX_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._entities = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if not path:
+            return
+
+        dirname = os.path.dirname(path)
+
+        try:
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+
+            self._db = sqlite3.connect(path, timeout=self.DB_TIMEOUT,
+                                       isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entities ("
+                             "key TEXT PRIMARY KEY, "
+                             "value TEXT NOT NULL, "
+                             "updated_on REAL NOT NULL)")
+        except (OSError, sqlite3.Error) as e:
+            cause = "entity cache %s cannot be opened; %s" % (path, str(e))
+            raise CacheError(cause=cause)
+
+    def get(self, key):
+        """Get an entity.
+
+        :param key: key of the entity
+
+        :returns: the entity or `None` when it is not found or it
+            has expired
+
+        :raises CacheError: raised when an error occurs reading
+            the database
+        """
+        now = time.time()
+
+        with self._lock:
+            entity = self._entities.get(key, None)
+
+            if entity:
+                value, updated_on = entity
+
+                if now - updated_on < self.ttl:
+                    self._entities.move_to_end(key)
+                    return value
+
+                del self._entities[key]
+
+            if not self._db:
+                return None
+
+            try:
+                row = self._db.execute("SELECT value, updated_on FROM entities WHERE key = ?",
+                                       (key,)).fetchone()
+            except sqlite3.Error as e:
+                raise CacheError(cause=str(e))
+
+            if not row or now - row[1] >= self.ttl:
+                return None
+
+            self._keep(key, row[0], row[1])
+
+        return row[0]
+
+    def set(self, key, value):
+        """Store an entity, replacing any other with the same key.
+
+        :param key: key of the entity
+        :param value: entity to store
+
+        :raises CacheError: raised when an error occurs writing
+            the database
+        """
+        now = time.time()
+
+        with self._lock:
+            self._keep(key, value, now)
+
+            if not self._db:
+                return
+
+            try:
+                self._db.execute("INSERT OR REPLACE INTO entities VALUES (?, ?, ?)",
+                                 (key, value, now))
+            except sqlite3.Error as e:
+                raise CacheError(cause=str(e))
+
+    def purge(self):
+        """Remove the expired entities.
+
+        :returns: the number of entities removed from the database
+
+        :raises CacheError: raised when an error occurs writing
+            the database
+        """
+        expired_on = time.time() - self.ttl
+
+        with self._lock:
+            for key in [k for k, e in self._entities.items() if e[1] <= expired_on]:
+                del self._entities[key]
+
+            if not self._db:
+                return 0
+
+            try:
+                cursor = self._db.execute("DELETE FROM entities WHERE updated_on <= ?",
+                                          (expired_on,))
+            except sqlite3.Error as e:
+                raise CacheError(cause=str(e))
+
+        return cursor.rowcount
+
+    def close(self):
+        """Close the database"""
+
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _keep(self, key, value, updated_on):
+        """Keep an entity in memory, forgetting the least recently used"""
+
+        self._entities[key] = (value, updated_on)
+        self._entities.move_to_end(key)
+
+        while len(self._entities) > self.max_size:
+            self._entities.popitem(last=False)
+
+
+def _link_or_copy(src, dst):
+    """Hard-link `src` to `dst`; copy it when links are not supported"""
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def is_shelve_cache(cache_files):
+    """Check whether there is a shelve cache stored in `cache_files`.
+
+    Caches created by previous versions of Perceval were stored
+    using the `shelve` module. This function checks if any of the
+    files written by `shelve` exists for the given path.
+
+    :param cache_files: path prefix of the shelve files
+
+    :returns: whether a shelve cache was found
+    """
+    return bool(dbm.whichdb(cache_files))
+
+
+def migrate_shelve_cache(cache):
+    """Migrate a shelve cache to the log format.
+
+    Items stored in a shelve cache, created by previous versions of
+    Perceval, are appended to `cache` keeping their original order.
+    Once the items are migrated, the files of the shelve cache are
+    removed.
+
+    :param cache: `Cache` object where the items will be migrated
+
+    :returns: the number of migrated items
+
+    :raises CacheError: raised when the shelve cache cannot be read
+    """
+    logger.info("Migrating shelve cache %s", cache.cache_path)
+
+    items_dir, prefix = os.path.split(cache.cache_files)
+
+    # Remove any data left by a previous migration that did not finish
+    for filename in os.listdir(items_dir):
+        name, ext = os.path.splitext(filename)
+        if filename.startswith(prefix + '.') and ext in (cache.SEGMENT_SUFFIX, cache.INDEX_SUFFIX):
+            os.remove(os.path.join(items_dir, filename))
+
+    try:
+        with shelve.open(cache.cache_files, flag='r') as legacy:
+            keys = sorted(int(key) for key in legacy.keys())
+
+            for i in range(0, len(keys), MIGRATION_BATCH_SIZE):
+                batch = keys[i:i + MIGRATION_BATCH_SIZE]
+                cache.store(*[legacy[str(key)] for key in batch])
+    except dbm.error as e:
+        cause = "unable to migrate shelve cache %s; %s" % (cache.cache_path, str(e))
+        raise CacheError(cause=cause)
+
+    for filename in os.listdir(items_dir):
+        name, ext = os.path.splitext(filename)
+        if name == prefix and ext in ('', '.db', '.dat', '.dir', '.bak', '.pag'):
+            os.remove(os.path.join(items_dir, filename))
+
+    logger.info("Shelve cache %s migrated; %s items", cache.cache_path, len(keys))
+
+    return len(keys)
+
+
+def _migrate_shelve_recovery(cache):
+    """Migrate the shelve recovery backup of `cache`"""
+
+    tmp_path = os.path.join(cache.cache_path, 'migration')
+    tmp_items_path = os.path.join(tmp_path, 'items')
+
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    # Migrate a copy of the backup as if it was a cache on its own
+    shutil.copytree(cache.recovery_path, tmp_items_path)
+    Cache(tmp_path, codec=cache.codec)
+
+    shutil.rmtree(cache.recovery_path)
+    os.rename(tmp_items_path, cache.recovery_path)
+    shutil.rmtree(tmp_path)
 
 
-def setup_cache(repository, cache_path=None, clean_cache=False):
+def setup_cache(repository, cache_path=None, clean_cache=False,
+                codec=CACHE_DEFAULT_CODEC):
     """Create and configure a cache object.
 
     Create a new cache object for `repository` and store it under
@@ -136,6 +759,7 @@ def setup_cache(repository, cache_path=None, clean_cache=False):
     :param cache_path: path to the directory to store cache data
     :param clean_cache: clean the contents of the cache, do not
         a backup
+    :param codec: codec used to compress the items of new caches
 
     :returns: a `Cache` instance
     """
@@ -145,7 +769,7 @@ def setup_cache(repository, cache_path=None, clean_cache=False):
         base_path = cache_path
 
     cache_path = os.path.join(base_path, repository)
-    cache = Cache(cache_path)
+    cache = Cache(cache_path, codec=codec)
 
     if clean_cache:
         cache.clean()
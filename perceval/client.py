@@ -20,18 +20,32 @@
 #     Valerio Cosentino <valcos@bitergia.com>
 #
 
+import collections
+import contextlib
+import hashlib
+import json
 import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
 import time
+import urllib.parse
 
 import requests
 import urllib3.util
 
 from .errors import RateLimitError
+from .profiler import count_bytes_in, stage
 from ._version import __version__
 
 logger = logging.getLogger(__name__)
 
 
+RATE_LIMIT_DB_DEFAULT_PATH = '~/.perceval/rate_limit.db'
+
+
 class HttpClient:
     """Abstract class for HTTP clients.
 
@@ -55,6 +69,15 @@ class HttpClient:
     :param default_sleep_time: default time to sleep in case
         of connection problems
     :param headers: list of session headers
+
+    Every request is accounted in the `metrics` attribute, a
+    `HttpMetrics` object, which can be exported as a JSON summary
+    or in Prometheus text format.
+
+    When the attribute `http_cache` is set to a `HttpCache` object,
+    GET requests are made conditional on the validators of the
+    responses stored in that cache. Responses not modified since
+    then (304) are served from the cache.
     """
     version = '0.1'
 
@@ -96,6 +119,8 @@ class HttpClient:
         self.raise_on_status = self.DEFAULT_RAISE_ON_STATUS
         self.respect_retry_after_header = self.DEFAULT_RESPECT_RETRY_AFTER_HEADER
         self.default_sleep_time = default_sleep_time
+        self.metrics = HttpMetrics()
+        self.http_cache = None
 
         self._create_http_session()
 
@@ -114,12 +139,43 @@ class HttpClient:
 
         :returns a response object
         """
-        if method == self.GET:
-            response = self.session.get(url, params=payload, headers=headers, stream=stream, verify=verify)
-        else:
-            response = self.session.post(url, data=payload, headers=headers, stream=stream, verify=verify)
+        start = time.perf_counter()
 
-        response.raise_for_status()
+        if self.http_cache and method == self.GET and not stream:
+            cache_key = HttpCache.key(url, payload)
+            cached = self.http_cache.get(cache_key)
+
+            if cached:
+                headers = dict(headers) if headers else {}
+                headers.update(HttpCache.conditional_headers(cached))
+        else:
+            cache_key = None
+            cached = None
+
+        try:
+            with stage('http'):
+                if method == self.GET:
+                    response = self.session.get(url, params=payload, headers=headers, stream=stream, verify=verify)
+                else:
+                    response = self.session.post(url, data=payload, headers=headers, stream=stream, verify=verify)
+
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.metrics.observe_request(method, url, time.perf_counter() - start,
+                                         response=e.response, error=True)
+            raise
+
+        self.metrics.observe_request(method, url, time.perf_counter() - start,
+                                     response=response, stream=stream)
+
+        if not stream:
+            count_bytes_in(len(response.content))
+
+        if cached and response.status_code == 304:
+            logger.debug("%s not modified; read from the HTTP cache", url)
+            response = HttpCache.build_response(cached, response)
+        elif cache_key and response.status_code == 200:
+            self.http_cache.store(cache_key, response)
 
         return response
 
@@ -152,13 +208,179 @@ class HttpClient:
         self.session.close()
 
 
+HttpCacheEntry = collections.namedtuple('HttpCacheEntry',
+                                        ['url', 'headers', 'encoding', 'content'])
+
+
+class HttpCache:
+    """Cache of HTTP responses to revalidate them.
+
+    Responses with `ETag` or `Last-Modified` validators are stored in
+    `dirpath` directory, a file per request. Each file has the headers
+    of the response, encoded as a JSON line, followed by its body.
+    Files are replaced atomically, so the cache can be shared by
+    several clients, threads or processes.
+
+    Requests to resources already stored are made conditional with
+    the headers returned by `conditional_headers`. When the server
+    answers that the resource was not modified (304), the stored
+    response is rebuilt by `build_response`.
+
+    :param dirpath: directory where responses are stored
+    """
+    # Headers not valid for the decoded body of a response
+    EXCLUDED_HEADERS = ['connection', 'content-encoding', 'content-length',
+                        'keep-alive', 'transfer-encoding']
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+        if not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+
+    @staticmethod
+    def key(url, payload=None):
+        """Return the key of a GET request"""
+
+        request = requests.Request(HttpClient.GET, url, params=payload)
+        return request.prepare().url
+
+    def get(self, key):
+        """Get the response stored for a request.
+
+        :param key: key of the request
+
+        :returns: a `HttpCacheEntry` or `None` when the response
+            is not found or it cannot be read
+        """
+        try:
+            with open(self._entry_path(key), 'rb') as fd:
+                meta = json.loads(fd.readline().decode('utf-8'))
+                content = fd.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("HTTP cache entry of %s cannot be read; %s", key, str(e))
+            return None
+
+        if meta['key'] != key:
+            return None
+
+        return HttpCacheEntry(meta['url'], meta['headers'], meta['encoding'], content)
+
+    def store(self, key, response):
+        """Store a response if it has validators.
+
+        :param key: key of the request
+        :param response: response to store
+
+        :returns: whether the response was stored
+        """
+        if 'ETag' not in response.headers and 'Last-Modified' not in response.headers:
+            return False
+
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in self.EXCLUDED_HEADERS}
+        meta = {
+            'key': key,
+            'url': response.url,
+            'headers': headers,
+            'encoding': response.encoding
+        }
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.dirpath)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8'))
+                f.write(b'\n')
+                f.write(response.content)
+            os.replace(tmp_path, self._entry_path(key))
+        except OSError as e:
+            logger.warning("HTTP cache entry of %s cannot be written; %s", key, str(e))
+            os.remove(tmp_path)
+            return False
+
+        return True
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Return the headers to revalidate a stored response"""
+
+        headers = {}
+        stored = requests.structures.CaseInsensitiveDict(entry.headers)
+
+        if 'ETag' in stored:
+            headers['If-None-Match'] = stored['ETag']
+        if 'Last-Modified' in stored:
+            headers['If-Modified-Since'] = stored['Last-Modified']
+
+        return headers
+
+    @staticmethod
+    def build_response(entry, not_modified):
+        """Rebuild a stored response after its revalidation.
+
+        The headers of the 'not modified' response, such as the
+        rate limit ones, update the stored headers.
+
+        :param entry: stored response
+        :param not_modified: 304 response given by the server
+
+        :returns: a response object
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry.url
+        response.encoding = entry.encoding
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        response.headers = requests.structures.CaseInsensitiveDict(entry.headers)
+        response.headers.update(not_modified.headers)
+
+        for name in HttpCache.EXCLUDED_HEADERS:
+            response.headers.pop(name, None)
+
+        response._content = entry.content
+
+        return response
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dirpath, digest)
+
+
 class RateLimitHandler:
     """Class to handle rate limit for HTTP clients.
 
+    Clients can use a pool of tokens, each one with its own rate limit.
+    The rate limit of every token is tracked from the headers of the
+    responses obtained with it. When the rate limit of the current
+    token is exhausted, the client switches to the token with the most
+    quota left instead of sleeping. Only when every token is exhausted,
+    the client sleeps until the first reset, or raises an exception.
+    Clients using a pool must implement `_set_token`, which sets the
+    token used on the next requests.
+
+    When a `RateLimitCoordinator` is given, the rate limit of each
+    token is shared with the other processes using that coordinator.
+    Before each request, the client waits for the slot granted by the
+    coordinator, which spreads the quota left among processes until
+    it is reset.
+
+    The rate limit can be updated and checked from several threads
+    sharing the client. Its state, the current token included, is
+    guarded by a lock, which is not held while sleeping. Responses
+    to requests made with a token that was switched in the meantime
+    only update the rate limit of that token.
+
     :param sleep_for_rate: sleep until rate limit is reset
     :param min_rate_to_sleep: minimun rate needed to sleep until it will be rese
     :param rate_limit_header: header to know the current rate limit
     :param rate_limit_reset_header: header to know the next rate limit reset
+    :param tokens: pool of tokens
+    :param coordinator: coordinator of the rate limit among processes
     """
     version = '0.1'
 
@@ -169,19 +391,27 @@ class RateLimitHandler:
 
     def setup_rate_limit_handler(self, sleep_for_rate=False, min_rate_to_sleep=MIN_RATE_LIMIT,
                                  rate_limit_header=RATE_LIMIT_HEADER,
-                                 rate_limit_reset_header=RATE_LIMIT_RESET_HEADER):
+                                 rate_limit_reset_header=RATE_LIMIT_RESET_HEADER,
+                                 tokens=None, coordinator=None):
         """Setup the rate limit handler.
 
         :param sleep_for_rate: sleep until rate limit is reset
         :param min_rate_to_sleep: minimun rate needed to make the fecthing process sleep
         :param rate_limit_header: header from where extract the rate limit data
         :param rate_limit_reset_header: header from where extract the rate limit reset data
+        :param tokens: pool of tokens; the first one is the current token
+        :param coordinator: `RateLimitCoordinator` shared with other processes
         """
         self.rate_limit = None
         self.rate_limit_reset_ts = None
         self.sleep_for_rate = sleep_for_rate
         self.rate_limit_header = rate_limit_header
         self.rate_limit_reset_header = rate_limit_reset_header
+        self.tokens = list(tokens) if tokens else []
+        self.current_token = self.tokens[0] if self.tokens else None
+        self.tokens_rate_limit = {token: (None, None) for token in self.tokens}
+        self.rate_limit_coordinator = coordinator
+        self._rate_limit_lock = threading.RLock()
 
         if min_rate_to_sleep > self.MAX_RATE_LIMIT:
             msg = "Minimum rate to sleep value exceeded (%d)."
@@ -195,30 +425,487 @@ class RateLimitHandler:
     def sleep_for_rate_limit(self):
         """The fetching process sleeps until the rate limit is restored or
            raises a RateLimitError exception if sleep_for_rate flag is disabled.
+
+           When a pool of tokens is used, the client switches to the token
+           with the most quota left, if any, instead.
         """
-        if self.rate_limit is not None and self.rate_limit <= self.min_rate_to_sleep:
-            seconds_to_reset = self.rate_limit_reset_ts - int(time.time()) + 1
-            cause = "Rate limit exhausted."
-            if self.sleep_for_rate:
-                logger.info("%s Waiting %i secs for rate limit reset.", cause, seconds_to_reset)
-                time.sleep(seconds_to_reset)
-            else:
-                raise RateLimitError(cause=cause, seconds_to_reset=seconds_to_reset)
+        seconds_to_reset = None
+        delay = 0
+
+        with self._rate_limit_lock:
+            if self.rate_limit is not None and self.rate_limit <= self.min_rate_to_sleep:
+                if len(self.tokens) > 1 and self.choose_token():
+                    return
+
+                seconds_to_reset = self.rate_limit_reset_ts - int(time.time()) + 1
+            elif self.rate_limit_coordinator:
+                delay, exhausted = self.rate_limit_coordinator.acquire(self._rate_limit_key(),
+                                                                       self.min_rate_to_sleep)
+                if exhausted:
+                    if len(self.tokens) > 1 and self.choose_token():
+                        return
+                    seconds_to_reset = int(delay) + 1
+
+        # Other threads can use the client while this one sleeps
+        if seconds_to_reset is not None:
+            self._wait_for_rate_limit_reset(seconds_to_reset)
+        elif delay > 0:
+            logger.debug("Waiting %.2f secs for a rate limit slot", delay)
+            time.sleep(delay)
+
+    def _wait_for_rate_limit_reset(self, seconds_to_reset):
+        """Sleep until the rate limit is reset or raise a RateLimitError"""
+
+        cause = "Rate limit exhausted."
+        if self.sleep_for_rate:
+            logger.info("%s Waiting %i secs for rate limit reset.", cause, seconds_to_reset)
+            time.sleep(seconds_to_reset)
+
+            metrics = getattr(self, 'metrics', None)
+            if metrics:
+                metrics.observe_rate_limit_sleep(seconds_to_reset)
+        else:
+            raise RateLimitError(cause=cause, seconds_to_reset=seconds_to_reset)
 
-    def update_rate_limit(self, response):
+    def update_rate_limit(self, response, token=None):
         """Update the rate limit and the time to reset the rate limit
            from the response headers.
 
         :param: response: the response object
+        :param: token: token of the pool used by the request; by
+            default, the current token
         """
-        if self.rate_limit_header in response.headers:
-            self.rate_limit = int(response.headers[self.rate_limit_header])
-            logger.debug("Rate limit: %s", self.rate_limit)
-        else:
-            self.rate_limit = None
+        with self._rate_limit_lock:
+            if self.rate_limit_header in response.headers:
+                rate_limit = int(response.headers[self.rate_limit_header])
+                logger.debug("Rate limit: %s", rate_limit)
+            else:
+                rate_limit = None
+
+            if self.rate_limit_reset_header in response.headers:
+                reset = response.headers[self.rate_limit_reset_header]
+                rate_limit_reset_ts = self.calculate_rate_limit_reset_ts(reset)
+                logger.debug("Rate limit reset: %s", rate_limit_reset_ts)
+            else:
+                rate_limit_reset_ts = None
+
+            if token is None or token == self.current_token:
+                token = self.current_token
+                self.rate_limit = rate_limit
+                self.rate_limit_reset_ts = rate_limit_reset_ts
+
+            if self.tokens:
+                self.tokens_rate_limit[token] = (rate_limit, rate_limit_reset_ts)
+
+            if self.rate_limit_coordinator and rate_limit is not None:
+                self.rate_limit_coordinator.update(self._rate_limit_key(token),
+                                                   rate_limit,
+                                                   rate_limit_reset_ts)
+
+    def calculate_rate_limit_reset_ts(self, reset):
+        """Calculate the time of the next rate limit reset.
+
+        By default, the value of the reset header is the epoch
+        timestamp of the reset. Clients which servers send other
+        values must override this method.
+
+        :param reset: value of the rate limit reset header
+
+        :returns: the epoch timestamp of the reset
+        """
+        return int(reset)
+
+    def choose_token(self):
+        """Switch to the token of the pool with the most quota left.
+
+        Tokens not used yet, or which rate limit was already reset,
+        are considered to have their whole quota. When every token is
+        exhausted, the token which rate limit is reset first is chosen.
+
+        :returns: whether the chosen token has quota left
+        """
+        with self._rate_limit_lock:
+            now = int(time.time())
+
+            def quota(token):
+                remaining, reset_ts = self.tokens_rate_limit[token]
+
+                if remaining is None or (reset_ts is not None and reset_ts < now):
+                    return float('inf')
+                return remaining
+
+            token = max(self.tokens, key=quota)
+            available = quota(token) > self.min_rate_to_sleep
+
+            if not available:
+                token = min(self.tokens, key=lambda t: self.tokens_rate_limit[t][1] or 0)
+
+            if token != self.current_token:
+                self.switch_token(token)
+
+            return available
+
+    def switch_token(self, token):
+        """Use another token of the pool.
+
+        :param token: token of the pool to use
+        """
+        with self._rate_limit_lock:
+            remaining, reset_ts = self.tokens_rate_limit[token]
+
+            if reset_ts is not None and reset_ts < int(time.time()):
+                remaining = None
 
-        if self.rate_limit_reset_header in response.headers:
-            self.rate_limit_reset_ts = int(response.headers[self.rate_limit_reset_header])
-            logger.debug("Rate limit reset: %s", self.rate_limit_reset_ts)
+            self.current_token = token
+            self.rate_limit = remaining
+            self.rate_limit_reset_ts = reset_ts
+            self._set_token(token)
+
+        logger.debug("Switched to token %s of the pool; rate limit: %s",
+                     self.tokens.index(token), remaining)
+
+    def _set_token(self, token):
+        """Set the token used on the next requests.
+
+        It is called with the lock of the rate limit held, so the
+        token is never set by two threads at the same time.
+        """
+        raise NotImplementedError
+
+    def _rate_limit_key(self, token=None):
+        """Identify the rate limit of a token, by default the current one.
+
+        Tokens are not stored by the coordinator, only a digest of
+        them and the base URL of the client.
+        """
+        token = token or self.current_token
+        data = '%s %s' % (getattr(self, 'base_url', ''), token or '')
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class RateLimitCoordinator:
+    """Share rate limits among processes.
+
+    Processes using the same tokens consume the same rate limits.
+    This class keeps on a SQLite database the quota left and the
+    time of the next reset of each rate limit, identified by a key.
+    The quota is updated with the one seen by any process on its last
+    response and it is decreased by each request granted since then,
+    so processes do not overrun the limit together.
+
+    Requests are granted following a generic cell rate algorithm:
+    the quota left, over `min_rate`, is spread along the time until
+    the next reset. Bursts of up to `burst` requests are granted at
+    once; after them, requests are paced, so processes do not exhaust
+    the quota and then sleep at the same time.
+
+    :param path: path to the database file
+    :param burst: number of requests granted without pacing
+
+    :raises OSError: raised when the directory of the database
+        cannot be created
+    """
+    BURST = 50
+    DB_TIMEOUT = 30
+
+    def __init__(self, path, burst=BURST):
+        self.path = path
+        self.burst = burst
+
+        dirname = os.path.dirname(path)
+
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self._db = sqlite3.connect(path, timeout=self.DB_TIMEOUT,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS rate_limits ("
+                         "key TEXT PRIMARY KEY, "
+                         "remaining INTEGER, "
+                         "reset_ts INTEGER, "
+                         "tat REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def acquire(self, key, min_rate=0):
+        """Ask for a slot to make a request.
+
+        :param key: key of the rate limit
+        :param min_rate: quota never granted
+
+        :returns: a tuple with the seconds to wait before making the
+            request and whether the quota is exhausted; in that case,
+            the seconds are the ones left until the reset and the
+            request was not granted
+        """
+        now = time.time()
+
+        with self._transaction():
+            row = self._db.execute("SELECT remaining, reset_ts, tat FROM rate_limits "
+                                   "WHERE key = ?", (key,)).fetchone()
+
+            if row:
+                remaining, reset_ts, tat = row
+            else:
+                remaining, reset_ts, tat = None, None, now
+
+            # Nothing is known about the quota until a response is seen
+            if remaining is None or reset_ts is None or reset_ts <= now:
+                return 0, False
+
+            budget = remaining - min_rate
+
+            if budget <= 0:
+                return reset_ts - now, True
+
+            interval = (reset_ts - now) / budget
+            tat = max(tat, now)
+            delay = max(0, tat - now - self.burst * interval)
+
+            self._db.execute("UPDATE rate_limits SET remaining = ?, tat = ? WHERE key = ?",
+                             (remaining - 1, tat + interval, key))
+
+        return delay, False
+
+    def update(self, key, remaining, reset_ts):
+        """Update a rate limit with the values of a response.
+
+        Requests granted to other processes, which responses were not
+        seen yet, are not forgotten: during the same rate limit period,
+        the quota is only decreased.
+
+        :param key: key of the rate limit
+        :param remaining: quota left
+        :param reset_ts: time of the next reset
+        """
+        with self._transaction():
+            row = self._db.execute("SELECT remaining, reset_ts, tat FROM rate_limits "
+                                   "WHERE key = ?", (key,)).fetchone()
+
+            if not row:
+                tat = time.time()
+            else:
+                tat = row[2]
+
+                if row[0] is not None and row[1] == reset_ts:
+                    remaining = min(row[0], remaining)
+
+            self._db.execute("INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)",
+                             (key, remaining, reset_ts, tat))
+
+    def close(self):
+        """Close the database"""
+
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run a block on an exclusive transaction"""
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            else:
+                self._db.execute("COMMIT")
+
+
+class HttpMetrics:
+    """Account the requests done by a HTTP client.
+
+    Requests are grouped by method and endpoint. The endpoint is
+    the path of the URL where the segments with numeric identifiers
+    are replaced by ':id', so requests to the same resource type are
+    accounted together. For each endpoint, the number of requests,
+    errors, retries, status codes and bytes received are counted,
+    and the latency of the requests is stored in a histogram with
+    the upper bounds given by `LATENCY_BUCKETS`, in seconds.
+
+    The time spent sleeping while waiting for the reset of the rate
+    limit is accounted too. Requests can be accounted from several
+    threads.
+    """
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    PROMETHEUS_PREFIX = 'perceval_http'
+
+    ID_SEGMENT = re.compile(r'^(\d+|[0-9a-f]{40})$')
+
+    def __init__(self):
+        self.endpoints = collections.OrderedDict()
+        self.rate_limit_sleeps = 0
+        self.rate_limit_sleep_time = 0.0
+        self._lock = threading.Lock()
+
+    def observe_request(self, method, url, latency, response=None,
+                        stream=False, error=False):
+        """Account a request.
+
+        :param method: method of the request
+        :param url: URL of the request
+        :param latency: seconds that took to get the response
+        :param response: response object, if any
+        :param stream: the body of the response was not downloaded
+        :param error: the request failed
+        """
+        key = (method, self.endpoint(url))
+
+        with self._lock:
+            self._observe_request(key, latency, response, stream, error)
+
+    def _observe_request(self, key, latency, response, stream, error):
+
+        stats = self.endpoints.get(key, None)
+        if not stats:
+            stats = {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'bytes': 0,
+                'status': {},
+                'latency_sum': 0.0,
+                'latency_buckets': [0] * (len(self.LATENCY_BUCKETS) + 1)
+            }
+            self.endpoints[key] = stats
+
+        stats['requests'] += 1
+        stats['latency_sum'] += latency
+
+        for i, bound in enumerate(self.LATENCY_BUCKETS):
+            if latency <= bound:
+                break
         else:
-            self.rate_limit_reset_ts = None
+            i = len(self.LATENCY_BUCKETS)
+        stats['latency_buckets'][i] += 1
+
+        if error:
+            stats['errors'] += 1
+
+        if response is None:
+            return
+
+        status = str(response.status_code)
+        stats['status'][status] = stats['status'].get(status, 0) + 1
+
+        retries = getattr(response.raw, 'retries', None)
+        if retries:
+            stats['retries'] += len(retries.history)
+
+        if not stream:
+            stats['bytes'] += len(response.content)
+
+    def observe_rate_limit_sleep(self, seconds):
+        """Account the time spent waiting for the rate limit reset"""
+
+        with self._lock:
+            self.rate_limit_sleeps += 1
+            self.rate_limit_sleep_time += seconds
+
+    def endpoint(self, url):
+        """Return the endpoint of a URL"""
+
+        path = urllib.parse.urlparse(url).path or '/'
+        segments = [':id' if self.ID_SEGMENT.match(seg) else seg
+                    for seg in path.split('/')]
+
+        return '/'.join(segments)
+
+    def summary(self):
+        """Return the metrics as a dict"""
+
+        endpoints = []
+
+        for (method, endpoint), stats in self.endpoints.items():
+            data = {
+                'method': method,
+                'endpoint': endpoint,
+                'latency_buckets': list(zip(self.LATENCY_BUCKETS + ('+Inf',),
+                                            stats['latency_buckets']))
+            }
+            data.update((k, v) for k, v in stats.items() if k != 'latency_buckets')
+            endpoints.append(data)
+
+        endpoints.sort(key=lambda e: e['latency_sum'], reverse=True)
+
+        summary = {
+            'requests': sum(s['requests'] for s in self.endpoints.values()),
+            'errors': sum(s['errors'] for s in self.endpoints.values()),
+            'retries': sum(s['retries'] for s in self.endpoints.values()),
+            'bytes': sum(s['bytes'] for s in self.endpoints.values()),
+            'latency_sum': sum(s['latency_sum'] for s in self.endpoints.values()),
+            'rate_limit_sleeps': self.rate_limit_sleeps,
+            'rate_limit_sleep_time': self.rate_limit_sleep_time,
+            'endpoints': endpoints
+        }
+
+        return summary
+
+    def to_json(self):
+        """Export the metrics as a JSON summary"""
+
+        return json.dumps(self.summary(), indent=4, sort_keys=True)
+
+    def to_prometheus(self):
+        """Export the metrics using Prometheus text format"""
+
+        prefix = self.PROMETHEUS_PREFIX
+        lines = []
+
+        def labels(method, endpoint, **extra):
+            pairs = [('method', method), ('endpoint', endpoint)]
+            pairs.extend(sorted(extra.items()))
+            values = ['%s="%s"' % (k, _escape_label(v)) for k, v in pairs]
+            return '{' + ','.join(values) + '}'
+
+        counters = [
+            ('requests', 'requests_total', "Number of HTTP requests"),
+            ('errors', 'errors_total', "Number of failed HTTP requests"),
+            ('retries', 'retries_total', "Number of retried HTTP requests"),
+            ('bytes', 'response_bytes_total', "Bytes received in HTTP responses")
+        ]
+
+        for key, name, help_msg in counters:
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_msg))
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            for (method, endpoint), stats in self.endpoints.items():
+                lines.append("%s_%s%s %s" % (prefix, name, labels(method, endpoint),
+                                             stats[key]))
+
+        name = prefix + '_request_duration_seconds'
+        lines.append("# HELP %s Latency of HTTP requests" % name)
+        lines.append("# TYPE %s histogram" % name)
+
+        for (method, endpoint), stats in self.endpoints.items():
+            count = 0
+            bounds = [str(b) for b in self.LATENCY_BUCKETS] + ['+Inf']
+
+            for bound, n in zip(bounds, stats['latency_buckets']):
+                count += n
+                lines.append("%s_bucket%s %s" % (name, labels(method, endpoint, le=bound),
+                                                 count))
+            lines.append("%s_sum%s %s" % (name, labels(method, endpoint),
+                                          repr(stats['latency_sum'])))
+            lines.append("%s_count%s %s" % (name, labels(method, endpoint), count))
+
+        name = prefix + '_rate_limit_sleep_seconds_total'
+        lines.append("# HELP %s Time spent waiting for rate limit resets" % name)
+        lines.append("# TYPE %s counter" % name)
+        lines.append("%s %s" % (name, repr(float(self.rate_limit_sleep_time))))
+
+        name = prefix + '_rate_limit_sleeps_total'
+        lines.append("# HELP %s Number of waits for rate limit resets" % name)
+        lines.append("# TYPE %s counter" % name)
+        lines.append("%s %s" % (name, self.rate_limit_sleeps))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    """Escape a value of a Prometheus label"""
+
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -20,6 +20,8 @@
 #     Santiago Dueñas <sduenas@bitergia.com>
 #
 
+import functools
+
 
 class BaseError(Exception):
     """Base class for Perceval exceptions.
@@ -31,11 +33,17 @@ class BaseError(Exception):
 
     def __init__(self, **kwargs):
         super().__init__()
+        self.kwargs = kwargs
         self.msg = self.message % kwargs
 
     def __str__(self):
         return self.msg
 
+    def __reduce__(self):
+        # Errors are rebuilt from their keyword arguments, so they
+        # can be raised across processes
+        return (functools.partial(self.__class__, **self.kwargs), ())
+
 
 class BackendError(BaseError):
     """Generic error for backends"""
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+
+from .backends.core.git import GitRepository
+from .errors import ParseError, RepositoryError
+
+
+logger = logging.getLogger(__name__)
+
+
+MirrorTask = collections.namedtuple('MirrorTask', ['task_id', 'uri', 'group'])
+MirrorResult = collections.namedtuple('MirrorResult',
+                                      ['task_id', 'uri', 'dirpath',
+                                       'action', 'error', 'elapsed'])
+
+SHARED_DIR = 'shared'
+
+
+def read_mirrors(filepath):
+    """Read a list of repositories to mirror from a file.
+
+    Each line of the file defines a repository: its URI, optionally
+    followed by the name of the group of related repositories (i.e,
+    the forks of a project) it belongs to. Empty lines and lines
+    starting with '#' are ignored.
+
+        https://github.com/grimoirelab/perceval.git perceval
+        https://github.com/myfork/perceval.git perceval
+        https://github.com/grimoirelab/sortinghat.git
+
+    Tasks are identified by their line number in the file.
+
+    :param filepath: path to the file with the list of repositories
+
+    :returns: a list of `MirrorTask` objects
+
+    :raises ParseError: raised when a line has too many fields
+    """
+    tasks = []
+
+    with open(filepath, 'r') as fd:
+        for nline, line in enumerate(fd, start=1):
+            line = line.strip()
+
+            if not line or line.startswith('#'):
+                continue
+
+            tokens = line.split()
+
+            if len(tokens) > 2:
+                cause = "invalid mirror on line %s; too many fields" % nline
+                raise ParseError(cause=cause)
+
+            group = tokens[1] if len(tokens) > 1 else None
+
+            task = MirrorTask(nline, tokens[0], group)
+            tasks.append(task)
+
+    return tasks
+
+
+def mirror_path(base_dir, uri):
+    """Get the path of the mirror of a repository.
+
+    The path is the same the Git backend uses by default when
+    `base_dir` is its repositories directory, so mirrors can be
+    read by the backend. Leading slashes of local paths are
+    removed, so mirrors are always stored under `base_dir`.
+    """
+    return os.path.join(base_dir, uri.lstrip('/')) + '-git'
+
+
+def shared_store_path(base_dir, group):
+    """Get the path of the shared object store of a group"""
+
+    return os.path.join(base_dir, SHARED_DIR, group + '.git')
+
+
+def mirror_repositories(tasks, base_dir, max_workers=None):
+    """Clone or update a list of repositories concurrently.
+
+    Repositories are cloned, or updated when they were cloned before,
+    on a pool of `max_workers` threads. Each thread runs its own
+    git process.
+
+    Repositories of the same group share their objects. The first
+    repository of each group is mirrored into a shared object store,
+    which is updated before the rest of repositories. Repositories
+    of the group are cloned borrowing the objects of that store
+    (git alternates), so only the objects they do not have in common
+    are downloaded and stored. Objects are never pruned from shared
+    stores, because other repositories may need them.
+
+    :param tasks: list of `MirrorTask` objects to run
+    :param base_dir: directory where the repositories are mirrored
+    :param max_workers: maximum number of threads running tasks
+
+    :returns: a list of `MirrorResult` objects in the same order of
+        the tasks
+    """
+    groups = collections.OrderedDict()
+
+    for task in tasks:
+        if task.group:
+            groups.setdefault(task.group, []).append(task)
+
+    references = {}
+    results = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        for group, members in groups.items():
+            dirpath = shared_store_path(base_dir, group)
+            future = executor.submit(_mirror_repository, members[0].uri,
+                                     dirpath, shared=True)
+            futures[future] = (group, dirpath)
+
+        for future in concurrent.futures.as_completed(futures):
+            group, dirpath = futures[future]
+            action, error, elapsed = future.result()
+
+            if error:
+                logger.warning("Shared store of group %s could not be %s; %s",
+                               group, action, error)
+            else:
+                logger.info("Shared store of group %s %s in %.2f secs",
+                            group, action, elapsed)
+                references[group] = dirpath
+
+        futures = {}
+
+        for task in tasks:
+            dirpath = mirror_path(base_dir, task.uri)
+            future = executor.submit(_mirror_repository, task.uri, dirpath,
+                                     reference=references.get(task.group, None))
+            futures[future] = (task, dirpath)
+
+        for future in concurrent.futures.as_completed(futures):
+            task, dirpath = futures[future]
+            action, error, elapsed = future.result()
+
+            result = MirrorResult(task.task_id, task.uri, dirpath,
+                                  action, error, elapsed)
+            results[task.task_id] = result
+
+            if not error:
+                logger.info("Repository %s %s in %.2f secs",
+                            task.uri, action, elapsed)
+            else:
+                logger.error("Repository %s could not be %s; %s",
+                             task.uri, action, error)
+
+    return [results[task.task_id] for task in tasks]
+
+
+def format_summary(results):
+    """Format the results of a mirroring process as a table.
+
+    :param results: list of `MirrorResult` objects
+
+    :returns: a string with a line for each repository and the totals
+    """
+    header = ('task', 'action', 'time (s)', 'repository / error')
+    lines = ["%-6s %-8s %10s  %s" % header]
+
+    for r in results:
+        info = r.uri if not r.error else r.error
+        row = (r.task_id, r.action, r.elapsed, info)
+        lines.append("%-6s %-8s %10.2f  %s" % row)
+
+    nfailed = len([r for r in results if r.error])
+    totals = (len(results), len(results) - nfailed, nfailed)
+    lines.append("%s repositories; %s mirrored; %s failed" % totals)
+    return '\n'.join(lines)
+
+
+def _mirror_repository(uri, dirpath, reference=None, shared=False):
+    """Clone or update a repository on a worker"""
+
+    start = time.time()
+    error = None
+
+    if not os.path.exists(dirpath):
+        action = 'cloned'
+    else:
+        action = 'updated'
+
+    try:
+        if action == 'cloned':
+            repo = GitRepository.clone(uri, dirpath, reference=reference)
+        else:
+            repo = GitRepository(uri, dirpath)
+            repo.update()
+
+        if shared:
+            cmd = ['git', 'config', 'gc.pruneExpire', 'never']
+            repo._exec(cmd, cwd=repo.dirpath, env=repo.gitenv)
+    except RepositoryError as e:
+        error = str(e)
+
+    return action, error, time.time() - start
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+
+import collections
+import cProfile
+import threading
+import time
+
+
+BASE_STAGE = 'backend'
+
+_profiler = None
+
+
+class Profiler:
+    """Measure the time spent on each stage of a backend run.
+
+    The run is split in stages such as 'http', 'parse', 'metadata',
+    'cache' or 'output'. Parts of Perceval that take part on these
+    stages mark them calling to `stage`. The wall and CPU time of a
+    stage do not include the time of the stages nested in it. The
+    time that is not spent on any of them is charged to 'backend'
+    stage, which accounts for the rest of the processing done by
+    the backend (i.e, parsing JSON or HTML data).
+
+    Besides times, the profiler counts the number of items and the
+    bytes read from and written to the data sources and outputs.
+    When `profile_path` is given, the run is also profiled using
+    `cProfile` and its stats are dumped to that file.
+
+    :param profile_path: path where cProfile stats will be written
+    """
+    def __init__(self, profile_path=None):
+        self.profile_path = profile_path
+        self.wall = collections.OrderedDict([(BASE_STAGE, 0.0)])
+        self.cpu = collections.OrderedDict([(BASE_STAGE, 0.0)])
+        self.items = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elapsed = 0.0
+        self.elapsed_cpu = 0.0
+
+        self._stack = [BASE_STAGE]
+        self._thread = None
+        self._mark = None
+        self._start = None
+        self._cprofile = None
+
+    def start(self):
+        """Start profiling and set this profiler as the active one"""
+
+        global _profiler
+
+        _profiler = self
+        self._thread = threading.get_ident()
+
+        if self.profile_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        self._start = self._mark = (time.perf_counter(), time.process_time())
+
+    def stop(self):
+        """Stop profiling and dump cProfile stats, if needed"""
+
+        global _profiler
+
+        self._switch()
+
+        self.elapsed = self._mark[0] - self._start[0]
+        self.elapsed_cpu = self._mark[1] - self._start[1]
+
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.profile_path)
+            self._cprofile = None
+
+        if _profiler is self:
+            _profiler = None
+
+    def stage(self, name):
+        """Context manager to charge the time of a block to a stage"""
+
+        return _Stage(self, name)
+
+    def track_items(self, items, name):
+        """Count the items while charging the time spent by their consumer to a stage.
+
+        :param items: iterator of items
+        :param name: stage where the time spent between items is charged
+
+        :returns: a generator of the same items
+        """
+        for item in items:
+            self.items += 1
+            self.enter(name)
+            try:
+                yield item
+            finally:
+                self.exit()
+
+    def enter(self, name):
+        self._switch()
+        self._stack.append(name)
+
+    def exit(self):
+        self._switch()
+        self._stack.pop()
+
+    def report(self):
+        """Return a report of the run as a string"""
+
+        rate = self.items / self.elapsed if self.elapsed else 0.0
+
+        lines = [
+            "Profiling report",
+            "items: %s (%.2f items/s)" % (self.items, rate),
+            "bytes in: %s; bytes out: %s" % (self.bytes_in, self.bytes_out),
+            "time: %.3f s wall; %.3f s cpu" % (self.elapsed, self.elapsed_cpu),
+            "%-10s %10s %10s %7s" % ('stage', 'wall (s)', 'cpu (s)', 'wall %')
+        ]
+
+        for name, wall in self.wall.items():
+            pct = 100.0 * wall / self.elapsed if self.elapsed else 0.0
+            row = (name, wall, self.cpu[name], pct)
+            lines.append("%-10s %10.3f %10.3f %7.1f" % row)
+
+        return '\n'.join(lines)
+
+    def _switch(self):
+        now = (time.perf_counter(), time.process_time())
+        name = self._stack[-1]
+
+        self.wall[name] = self.wall.get(name, 0.0) + now[0] - self._mark[0]
+        self.cpu[name] = self.cpu.get(name, 0.0) + now[1] - self._mark[1]
+        self._mark = now
+
+
+class _Stage:
+    """Mark a block of code as part of a stage"""
+
+    __slots__ = ['profiler', 'name']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.exit()
+
+
+class _NoStage:
+    """Do nothing when there is not an active profiler"""
+
+    __slots__ = []
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Charge the time of a block to a stage of the active profiler.
+
+    When there is not an active profiler, the block runs without
+    any accounting. Blocks run by other threads than the one which
+    started the profiler are not accounted either; their time is
+    charged to the stage the profiler thread is waiting on.
+
+    :param name: name of the stage
+    """
+    if _profiler and _profiler._thread == threading.get_ident():
+        return _profiler.stage(name)
+    else:
+        return _NO_STAGE
+
+
+def count_bytes_in(nbytes):
+    """Add the number of bytes read to the active profiler"""
+
+    if _profiler:
+        _profiler.bytes_in += nbytes
+
+
+def count_bytes_out(nbytes):
+    """Add the number of bytes written to the active profiler"""
+
+    if _profiler:
+        _profiler.bytes_out += nbytes
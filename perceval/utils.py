@@ -37,6 +37,7 @@ import dateutil.tz
 import requests
 
 from .errors import ParseError
+from .profiler import stage
 
 
 logger = logging.getLogger(__name__)
@@ -255,14 +256,15 @@ def xml_to_dict(raw_xml):
 
         return d
 
-    purged_xml = remove_invalid_xml_chars(raw_xml)
+    with stage('parse'):
+        purged_xml = remove_invalid_xml_chars(raw_xml)
 
-    try:
-        tree = xml.etree.ElementTree.fromstring(purged_xml)
-    except xml.etree.ElementTree.ParseError as e:
-        cause = "XML stream %s" % (str(e))
-        raise ParseError(cause=cause)
+        try:
+            tree = xml.etree.ElementTree.fromstring(purged_xml)
+        except xml.etree.ElementTree.ParseError as e:
+            cause = "XML stream %s" % (str(e))
+            raise ParseError(cause=cause)
 
-    d = node_to_dict(tree)
+        d = node_to_dict(tree)
 
     return d
@@ -85,6 +85,7 @@ setup(name="perceval",
           'grimoirelab-toolkit>=0.1.1'
       ],
       scripts=[
-          'bin/perceval'
+          'bin/perceval',
+          'bin/perceval-cache-migrate'
       ],
       zip_safe=False)
@@ -23,6 +23,7 @@
 
 import argparse
 import datetime
+import gzip
 import io
 import json
 import os
@@ -41,9 +42,15 @@ from perceval import __version__
 from perceval.backend import (Backend,
                               BackendCommandArgumentParser,
                               BackendCommand,
+                              OutputSink,
+                              find_backend_modules,
+                              import_backend,
+                              json_dumps_compact,
                               metadata,
                               uuid)
+from perceval.backends.core.git import Git, GitCommand
 from perceval.cache import Cache
+from perceval.client import HttpCache, HttpClient
 from perceval.utils import DEFAULT_DATETIME
 
 
@@ -266,6 +273,56 @@ class TestBackendCommandArgumentParser(unittest.TestCase):
         self.assertEqual(parsed_args.clean_cache, True)
         self.assertEqual(parsed_args.fetch_cache, True)
         self.assertEqual(parsed_args.no_cache, False)
+        self.assertEqual(parsed_args.cache_codec, 'zlib')
+
+        args = ['--cache-codec', 'none']
+
+        parsed_args = parser.parse(*args)
+        self.assertEqual(parsed_args.cache_codec, 'none')
+
+    def test_parse_output_args(self):
+        """Test if the output arguments are parsed"""
+
+        test_path = tempfile.mkdtemp(prefix='perceval_')
+        fout_path = os.path.join(test_path, 'items.json')
+
+        parser = BackendCommandArgumentParser()
+
+        try:
+            parsed_args = parser.parse()
+            self.assertEqual(parsed_args.outfile, sys.stdout)
+            self.assertEqual(parsed_args.output_format, 'json')
+            self.assertIsNone(parsed_args.output_compression)
+            self.assertIsNone(parsed_args.output_rotate_items)
+            self.assertIsNone(parsed_args.output_rotate_bytes)
+
+            # The output file is opened when no sink is needed
+            parsed_args = parser.parse('-o', fout_path)
+            self.assertIsInstance(parsed_args.outfile, io.TextIOWrapper)
+            self.assertEqual(parsed_args.outfile.name, fout_path)
+            parsed_args.outfile.close()
+
+            args = ['-o', fout_path, '--output-compression', 'gzip',
+                    '--output-rotate-items', '10', '--output-rotate-bytes', '100']
+
+            parsed_args = parser.parse(*args)
+            self.assertEqual(parsed_args.outfile, fout_path)
+            self.assertEqual(parsed_args.output_compression, 'gzip')
+            self.assertEqual(parsed_args.output_rotate_items, 10)
+            self.assertEqual(parsed_args.output_rotate_bytes, 100)
+        finally:
+            shutil.rmtree(test_path)
+
+    def test_output_sink_requires_file(self):
+        """Test if an output file is required to compress or rotate the output"""
+
+        parser = BackendCommandArgumentParser()
+
+        with self.assertRaises(AttributeError):
+            _ = parser.parse('--output-compression', 'gzip')
+
+        with self.assertRaises(AttributeError):
+            _ = parser.parse('-o', '-', '--output-rotate-items', '10')
 
     def test_incompatible_fetch_cache_and_no_cache(self):
         """Test if fetch-cache and no-cache arguments are incompatible"""
@@ -466,6 +523,166 @@ class TestBackendCommand(unittest.TestCase):
 
         self.assertIsInstance(cmd.backend.cache, Cache)
 
+    def test_run_ndjson(self):
+        """Test whether items are written as JSON lines"""
+
+        args = ['--no-cache', '--output-format', 'ndjson',
+                '--tag', 'test', '--output', self.fout_path,
+                'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        cmd.OUTPUT_BUFFER_SIZE = 512
+        cmd.run()
+        cmd.outfile.close()
+
+        with open(self.fout_path) as fout:
+            lines = fout.readlines()
+
+        self.assertEqual(len(lines), 5)
+
+        for x in range(5):
+            item = json.loads(lines[x])
+            expected_uuid = uuid('http://example.com/', str(x))
+
+            self.assertEqual(item['data']['item'], x)
+            self.assertEqual(item['origin'], 'http://example.com/')
+            self.assertEqual(item['uuid'], expected_uuid)
+            self.assertEqual(item['tag'], 'test')
+
+    def test_run_ndjson_text_stream(self):
+        """Test whether JSON lines are written to streams without binary buffer"""
+
+        args = ['--no-cache', '--output-format', 'ndjson',
+                'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        cmd.outfile = io.StringIO()
+        cmd.run()
+
+        lines = cmd.outfile.getvalue().split('\n')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[-1], '')
+
+        for x in range(5):
+            item = json.loads(lines[x])
+            self.assertEqual(item['data']['item'], x)
+
+    @unittest.mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_run_profile(self, mock_stderr):
+        """Test whether a profiling report is written when the run finishes"""
+
+        prof_path = os.path.join(self.test_path, 'run.prof')
+
+        args = ['--no-cache', '--output-format', 'ndjson',
+                '--profile-output', prof_path, '--output', self.fout_path,
+                'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        cmd.run()
+        cmd.outfile.close()
+
+        self.assertEqual(cmd.profiler.items, 5)
+        self.assertEqual(cmd.profiler.bytes_out, os.path.getsize(self.fout_path))
+        self.assertIn('metadata', cmd.profiler.wall)
+        self.assertIn('output', cmd.profiler.wall)
+        self.assertTrue(os.path.exists(prof_path))
+
+        report = mock_stderr.getvalue()
+        self.assertIn("items: 5", report)
+        self.assertIn("metadata", report)
+
+        with open(self.fout_path) as fout:
+            lines = fout.readlines()
+
+        self.assertEqual(len(lines), 5)
+
+    @unittest.mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_run_profile_json(self, mock_stderr):
+        """Test whether bytes written as indented JSON are counted"""
+
+        args = ['--no-cache', '--profile', '--tag', 'áéíóú',
+                '--output', self.fout_path, 'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        cmd.run()
+        cmd.outfile.close()
+
+        self.assertEqual(cmd.profiler.items, 5)
+        self.assertEqual(cmd.profiler.bytes_out, os.path.getsize(self.fout_path))
+
+    def test_run_http_metrics(self):
+        """Test whether the metrics of the HTTP client are written after the run"""
+
+        metrics_path = os.path.join(self.test_path, 'metrics.prom')
+
+        args = ['--no-cache', '--http-metrics', metrics_path,
+                '--http-metrics-format', 'prometheus',
+                '--output', self.fout_path, 'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        cmd.backend.client = HttpClient('http://example.com/')
+        cmd.backend.client.metrics.observe_request('GET', 'http://example.com/api/1', 0.5)
+        cmd.run()
+        cmd.outfile.close()
+
+        with open(metrics_path) as fd:
+            lines = fd.read().split('\n')
+
+        self.assertIn('perceval_http_requests_total{method="GET",endpoint="/api/:id"} 1', lines)
+
+    def test_http_cache(self):
+        """Test whether the HTTP cache is set on the client of the backend"""
+
+        cache_path = os.path.join(self.test_path, 'http')
+
+        args = ['--no-cache', '--http-cache', cache_path,
+                '--output', self.fout_path, 'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        self.assertEqual(cmd.parsed_args.http_cache, cache_path)
+
+        cmd.backend.client = HttpClient('http://example.com/')
+        cmd._initialize_http_cache()
+        cmd.outfile.close()
+
+        self.assertIsInstance(cmd.backend.client.http_cache, HttpCache)
+        self.assertEqual(cmd.backend.client.http_cache.dirpath, cache_path)
+        self.assertTrue(os.path.isdir(cache_path))
+
+    def test_run_output_sink(self):
+        """Test whether items are written to compressed and rotated files"""
+
+        args = ['--no-cache', '--output-compression', 'gzip',
+                '--output-rotate-items', '2', '--output', self.fout_path,
+                'http://example.com/']
+
+        cmd = MockedBackendCommand(*args)
+        self.assertIsNone(cmd.outfile)
+        self.assertIsInstance(cmd.sink, OutputSink)
+
+        cmd.run()
+
+        with open(self.fout_path + '.manifest') as fd:
+            manifest = json.load(fd)
+
+        self.assertEqual(manifest['completed'], True)
+        self.assertEqual(manifest['compression'], 'gzip')
+        self.assertEqual(len(manifest['files']), 3)
+
+        items = []
+        for f in manifest['files']:
+            filepath = os.path.join(self.test_path, f['path'])
+            with gzip.open(filepath, 'rb') as fd:
+                fout = fd.read().decode('utf-8')
+            with open(self.fout_path, 'w') as fd:
+                fd.write(fout)
+            items.extend([item for item in convert_cmd_output_to_json(self.fout_path)])
+
+        self.assertEqual(len(items), 5)
+
+        for x in range(5):
+            self.assertEqual(items[x]['data']['item'], x)
+
     def test_run_fetch_cache(self):
         """Test whether the command runs when fetch from cache is set"""
 
@@ -551,6 +768,128 @@ class TestMetadata(unittest.TestCase):
             before = item['timestamp']
 
 
+class TestOutputSink(unittest.TestCase):
+    """Unit tests for OutputSink"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.fout_path = os.path.join(self.test_path, 'items.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def read_manifest(self):
+        with open(self.fout_path + '.manifest') as fd:
+            return json.load(fd)
+
+    def test_single_file(self):
+        """Test whether items are written to a single file when no rotation is set"""
+
+        sink = OutputSink(self.fout_path + '.gz', compression='gzip')
+        sink.write(b'{"a":1}\n')
+        sink.write(b'{"b":2}\n')
+        sink.close()
+
+        with gzip.open(self.fout_path + '.gz', 'rb') as fd:
+            self.assertEqual(fd.read(), b'{"a":1}\n{"b":2}\n')
+
+        manifest = self.read_manifest()
+        self.assertEqual(manifest['completed'], True)
+        self.assertListEqual(manifest['files'],
+                             [{'path': 'items.json.gz', 'items': 2, 'bytes': 16}])
+
+    def test_rotate_bytes(self):
+        """Test whether new files are written when the size limit is reached"""
+
+        sink = OutputSink(self.fout_path, max_bytes=10)
+        sink.write(b'{"a":1}\n')
+        sink.write(b'{"b":2}\n')
+
+        # Completed files are available before closing the sink
+        manifest = self.read_manifest()
+        self.assertEqual(manifest['completed'], False)
+        self.assertListEqual(manifest['files'],
+                             [{'path': 'items.json.00000', 'items': 2, 'bytes': 16}])
+
+        sink.write(b'{"c":3}\n')
+        sink.close()
+
+        manifest = self.read_manifest()
+        self.assertEqual(manifest['completed'], True)
+        self.assertListEqual(manifest['files'],
+                             [{'path': 'items.json.00000', 'items': 2, 'bytes': 16},
+                              {'path': 'items.json.00001', 'items': 1, 'bytes': 8}])
+
+        with open(self.fout_path + '.00001', 'rb') as fd:
+            self.assertEqual(fd.read(), b'{"c":3}\n')
+
+    def test_rotate_items(self):
+        """Test whether new files are written when the items limit is reached"""
+
+        sink = OutputSink(self.fout_path, compression='gzip', max_items=1)
+        sink.write(b'{"a":1}\n')
+        sink.write(b'{"b":2}\n')
+        sink.close()
+
+        manifest = self.read_manifest()
+        self.assertEqual(len(manifest['files']), 2)
+        self.assertEqual(manifest['files'][0]['path'], 'items.json.00000.gz')
+        self.assertEqual(manifest['files'][1]['path'], 'items.json.00001.gz')
+
+        with gzip.open(self.fout_path + '.00001.gz', 'rb') as fd:
+            self.assertEqual(fd.read(), b'{"b":2}\n')
+
+    def test_no_items(self):
+        """Test whether no files are written when there are not items"""
+
+        sink = OutputSink(self.fout_path, max_items=1)
+        sink.close()
+
+        manifest = self.read_manifest()
+        self.assertEqual(manifest['completed'], True)
+        self.assertListEqual(manifest['files'], [])
+
+    def test_invalid_compression(self):
+        """Test whether an exception is raised when the compression is not available"""
+
+        with self.assertRaises(ValueError):
+            _ = OutputSink(self.fout_path, compression='rar')
+
+
+class TestJSONDumpsCompact(unittest.TestCase):
+    """Unit tests for json_dumps_compact function"""
+
+    def test_dumps(self):
+        """Check whether items are encoded as compact JSON objects"""
+
+        item = {'b': [1, 2], 'a': 'ñandú'}
+
+        data = json_dumps_compact(item)
+
+        self.assertIsInstance(data, bytes)
+        self.assertNotIn(b' ', data)
+        self.assertNotIn(b'\n', data)
+        self.assertDictEqual(json.loads(data.decode('utf-8')), item)
+
+    def test_dumps_surrogates(self):
+        """Check whether strings with surrogates are encoded"""
+
+        item = {'message': b'caf\xe9'.decode('utf-8', errors='surrogateescape')}
+
+        data = json_dumps_compact(item)
+        self.assertDictEqual(json.loads(data.decode('utf-8')), item)
+
+    @unittest.mock.patch('perceval.backend.ujson')
+    @unittest.mock.patch('perceval.backend.orjson')
+    def test_dumps_fallback(self, mock_orjson, mock_ujson):
+        """Check whether the standard encoder is used when others fail"""
+
+        mock_orjson.dumps.side_effect = TypeError('type not supported')
+
+        data = json_dumps_compact({'a': 1})
+        self.assertEqual(data, b'{"a":1}')
+
+
 class TestUUID(unittest.TestCase):
     """Unit tests for uuid function"""
 
@@ -585,5 +924,37 @@ class TestUUID(unittest.TestCase):
         self.assertRaises(ValueError, uuid, '1', '2', '3', '')
 
 
+class TestFindBackendModules(unittest.TestCase):
+    """Unit tests for find_backend_modules and import_backend functions"""
+
+    def test_find_backend_modules(self):
+        """Check whether it finds the modules of the backends"""
+
+        import perceval.backends
+
+        modules = find_backend_modules(perceval.backends)
+
+        self.assertEqual(modules['git'], 'perceval.backends.core.git')
+        self.assertEqual(modules['github'], 'perceval.backends.core.github')
+        self.assertEqual(modules['rss'], 'perceval.backends.core.rss')
+        self.assertNotIn('core', modules)
+
+    def test_import_backend(self):
+        """Check whether it returns the classes of a backend module"""
+
+        backend, command = import_backend('perceval.backends.core.git')
+
+        self.assertIs(backend, Git)
+        self.assertIs(command, GitCommand)
+
+    def test_import_no_backend(self):
+        """Check whether it returns None when the module has no backends"""
+
+        backend, command = import_backend('perceval.utils')
+
+        self.assertIsNone(backend)
+        self.assertIsNone(command)
+
+
 if __name__ == "__main__":
     unittest.main()
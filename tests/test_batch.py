@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from perceval.backend import (Backend,
+                              BackendCommand,
+                              BackendCommandArgumentParser,
+                              metadata)
+from perceval.batch import (BatchResult,
+                            BatchTask,
+                            format_summary,
+                            read_tasks,
+                            run_batch)
+from perceval.errors import ParseError
+
+
+class MockedBackend(Backend):
+    """Mocked backend for testing"""
+
+    version = '0.1.0'
+
+    def __init__(self, origin, nitems, tag=None):
+        super().__init__(origin, tag=tag)
+        self.nitems = nitems
+
+    @metadata
+    def fetch(self):
+        if self.nitems < 0:
+            raise ValueError("invalid number of items")
+
+        for x in range(self.nitems):
+            yield {'item': x}
+
+    @staticmethod
+    def metadata_id(item):
+        return str(item['item'])
+
+    @staticmethod
+    def metadata_updated_on(item):
+        return '2016-01-01'
+
+    @staticmethod
+    def metadata_category(item):
+        return 'mock_item'
+
+
+class MockedBackendCommand(BackendCommand):
+    """Mocked backend command class used for testing"""
+
+    BACKEND = MockedBackend
+
+    @staticmethod
+    def setup_cmd_parser():
+        parser = BackendCommandArgumentParser()
+        parser.parser.add_argument('origin')
+        parser.parser.add_argument('nitems', type=int)
+
+        return parser
+
+
+COMMANDS = {'mock': MockedBackendCommand}
+
+
+def read_items(filepath):
+    with open(filepath, 'r') as fd:
+        return [json.loads(line) for line in fd]
+
+
+class TestReadTasks(unittest.TestCase):
+    """Unit tests for read_tasks"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.tasks_path = os.path.join(self.test_path, 'tasks')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_read_tasks(self):
+        """Test whether tasks are read from a file"""
+
+        with open(self.tasks_path, 'w') as fd:
+            fd.write("# List of tasks\n")
+            fd.write("git http://example.com/repo.git --from-date 2017-01-01\n")
+            fd.write("\n")
+            fd.write("   github owner repo -t 'my token'\n")
+
+        tasks = read_tasks(self.tasks_path)
+
+        expected = [
+            BatchTask(2, 'git', ['http://example.com/repo.git', '--from-date', '2017-01-01']),
+            BatchTask(4, 'github', ['owner', 'repo', '-t', 'my token'])
+        ]
+        self.assertListEqual(tasks, expected)
+
+    def test_invalid_task(self):
+        """Test whether an exception is raised when a task cannot be split"""
+
+        with open(self.tasks_path, 'w') as fd:
+            fd.write("git http://example.com/repo.git\n")
+            fd.write("github owner 'repo\n")
+
+        with self.assertRaisesRegex(ParseError, "line 2"):
+            _ = read_tasks(self.tasks_path)
+
+
+class TestRunBatch(unittest.TestCase):
+    """Unit tests for run_batch"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_run_batch(self):
+        """Test whether tasks are run and their results returned in order"""
+
+        output_dir = os.path.join(self.test_path, 'output')
+        custom_output = os.path.join(self.test_path, 'custom.json')
+
+        tasks = [
+            BatchTask(1, 'mock', ['http://example.com/a', '3', '--output-format', 'ndjson']),
+            BatchTask(2, 'mock', ['http://example.com/b', '-1']),
+            BatchTask(3, 'unknown', ['http://example.com/c']),
+            BatchTask(4, 'mock', ['http://example.com/d', '2', '--output-format', 'ndjson',
+                                  '-o', custom_output]),
+            BatchTask(5, 'mock', ['http://example.com/e'])
+        ]
+
+        results = run_batch(tasks, COMMANDS, output_dir, max_workers=2)
+
+        self.assertEqual(len(results), 5)
+        self.assertListEqual([r.task_id for r in results], [1, 2, 3, 4, 5])
+        self.assertListEqual([r.exit_code for r in results], [0, 1, 1, 0, 2])
+
+        result = results[0]
+        self.assertEqual(result.output, os.path.join(output_dir, '00001-mock.json'))
+        self.assertIsNone(result.error)
+
+        items = read_items(result.output)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0]['origin'], 'http://example.com/a')
+
+        self.assertEqual(results[1].error, "invalid number of items")
+        self.assertEqual(results[2].error, "Unknown backend unknown")
+        self.assertEqual(results[4].error, "invalid arguments")
+
+        result = results[3]
+        self.assertEqual(result.output, custom_output)
+        self.assertEqual(len(read_items(custom_output)), 2)
+
+        with open(os.path.join(output_dir, 'summary.json'), 'r') as fd:
+            summary = json.load(fd)
+
+        self.assertEqual(summary['tasks'], 5)
+        self.assertEqual(summary['completed'], 2)
+        self.assertEqual(summary['failed'], 3)
+        self.assertEqual(len(summary['results']), 5)
+        self.assertEqual(summary['results'][1]['exit_code'], 1)
+
+    def test_run_batch_rotated_output(self):
+        """Test whether the manifest is reported when the output is rotated"""
+
+        output_dir = os.path.join(self.test_path, 'output')
+
+        tasks = [
+            BatchTask(1, 'mock', ['http://example.com/a', '5', '--output-format', 'ndjson',
+                                  '--output-compression', 'gzip',
+                                  '--output-rotate-items=2'])
+        ]
+
+        results = run_batch(tasks, COMMANDS, output_dir, max_workers=1)
+
+        result = results[0]
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output, os.path.join(output_dir, '00001-mock.json.manifest'))
+
+        with open(result.output, 'r') as fd:
+            manifest = json.load(fd)
+
+        self.assertEqual(manifest['completed'], True)
+        self.assertListEqual([f['path'] for f in manifest['files']],
+                             ['00001-mock.json.00000.gz',
+                              '00001-mock.json.00001.gz',
+                              '00001-mock.json.00002.gz'])
+
+
+class TestFormatSummary(unittest.TestCase):
+    """Unit tests for format_summary"""
+
+    def test_format_summary(self):
+        """Test whether the summary shows a line per task and the totals"""
+
+        results = [
+            BatchResult(1, 'git', '/tmp/00001-git.json', 0, None, 1.5),
+            BatchResult(2, 'github', '/tmp/00002-github.json', 1, 'rate limit', 0.25)
+        ]
+
+        summary = format_summary(results).split('\n')
+
+        self.assertEqual(len(summary), 4)
+        self.assertIn('/tmp/00001-git.json', summary[1])
+        self.assertIn('1.50', summary[1])
+        self.assertIn('rate limit', summary[2])
+        self.assertEqual(summary[3], "2 tasks; 1 completed; 1 failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,7 +21,10 @@
 #     Santiago Dueñas <sduenas@bitergia.com>
 #
 
+import json
 import os
+import pickle
+import shelve
 import shutil
 import sys
 import tempfile
@@ -30,8 +33,13 @@ import unittest.mock
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 from perceval.cache import (CACHE_DEFAULT_PATH,
+                            CODECS,
                             Cache,
+                            EntityCache,
+                            is_shelve_cache,
+                            migrate_shelve_cache,
                             setup_cache)
+from perceval.errors import CacheError
 
 
 CACHE_DIR = 'mockrepo'
@@ -79,6 +87,247 @@ class TestCache(unittest.TestCase):
         contents = [item for item in cache.retrieve()]
         self.assertListEqual(contents, expected)
 
+    def test_store_in_several_calls(self):
+        """Test whether items stored in several calls keep their order"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store('a', 'b')
+        cache.store()
+        cache.store({'c': 1}, ['d'])
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['a', 'b', {'c': 1}, ['d']])
+
+    def test_segments(self):
+        """Test whether new segments are created when the current one is full"""
+
+        expected = ['a' * 32, 'b' * 32, 'c' * 32, 'd' * 32]
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path, codec='none')
+        cache.SEGMENT_MAX_SIZE = 64
+
+        cache.store(*expected[0:3])
+        cache.store(expected[3])
+
+        segments = sorted([f for f in os.listdir(cache.items_path)
+                           if f.endswith(cache.SEGMENT_SUFFIX)])
+        self.assertListEqual(segments, ['perceval_cache.00000000.seg',
+                                        'perceval_cache.00000001.seg'])
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+    def test_retrieve_empty_cache(self):
+        """Test whether no items are returned when the cache is empty"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, [])
+
+    def test_ignore_non_indexed_data(self):
+        """Test whether data not written to the index is ignored"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store(1, 2, 3)
+
+        # Simulate a failure after writing data to the segment
+        with open(cache._segment_path(0), 'ab') as fd:
+            fd.write(b'garbage')
+
+        cache.store(4)
+
+        # Simulate a failure writing the index
+        with open(cache.index_file, 'ab') as fd:
+            fd.write(b'\x00\x01')
+
+        cache.store(5)
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, [1, 2, 3, 4, 5])
+
+    def test_retrieve_truncated_data(self):
+        """Test whether an exception is raised when the data of an item is lost"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store('a', 'b', 'c')
+
+        segment_path = cache._segment_path(0)
+        size = os.path.getsize(segment_path)
+        os.truncate(segment_path, size - 1)
+
+        with self.assertRaises(CacheError):
+            _ = [item for item in cache.retrieve()]
+
+    def test_deduplicate_items(self):
+        """Test whether the data of repeated items is stored once"""
+
+        user = {'login': 'jsmith', 'name': 'John Smith'}
+        expected = ['{USER}', user, '{USER}', user, 'a', '{USER}', user]
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path, codec='none')
+        cache.store(*expected[0:4])
+        cache.store(*expected[4:])
+
+        unique = ['{USER}', user, 'a']
+        size = sum([len(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+                    for item in unique])
+        self.assertEqual(os.path.getsize(cache._segment_path(0)), size)
+
+        # Digests are also loaded from the index by new objects
+        cache = Cache(cache_path, codec='none')
+        cache.store(user, 'b')
+
+        size += len(pickle.dumps('b', protocol=pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(os.path.getsize(cache._segment_path(0)), size)
+
+        expected.extend([user, 'b'])
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+        # Repeated items are different objects
+        self.assertIsNot(contents[1], contents[3])
+
+    def test_deduplicate_after_clean(self):
+        """Test whether removed data is not referenced by new items"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store('a', 'b')
+        cache.backup()
+        cache.store('c')
+
+        cache.clean(erase=True)
+        cache.store('b', 'c')
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['b', 'c'])
+
+        cache.store('a', 'b')
+        cache.backup()
+        cache.store('c', 'd')
+        cache.recover()
+        cache.store('d', 'a')
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['b', 'c', 'a', 'b', 'd', 'a'])
+
+    def test_retrieve_evicted_items(self):
+        """Test whether repeated items are read when they are not buffered"""
+
+        expected = ['a' * 100, 'b' * 100, 'c' * 100, 'a' * 100, 'b' * 100]
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path, codec='none')
+        cache.REPLAY_BUFFER_SIZE = 256
+        cache.store(*expected)
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+    def test_codecs(self):
+        """Test whether items are stored and retrieved using every codec"""
+
+        expected = ['a' * 1000, {'b': 'b' * 1000}, 3]
+
+        for codec in CODECS:
+            cache_path = os.path.join(self.test_path, codec)
+            cache = Cache(cache_path, codec=codec)
+            cache.store(*expected)
+
+            with open(cache.header_file, 'r') as fd:
+                header = json.load(fd)
+            self.assertEqual(header['codec'], codec)
+
+            contents = [item for item in cache.retrieve()]
+            self.assertListEqual(contents, expected)
+
+    def test_compressed_data(self):
+        """Test whether items are compressed"""
+
+        item = 'a' * 10000
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store(item)
+
+        self.assertEqual(cache.codec, 'zlib')
+        size = os.path.getsize(cache._segment_path(0))
+        self.assertLess(size, len(pickle.dumps(item)))
+
+    def test_codec_from_header(self):
+        """Test whether the codec written in the header is used"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path, codec='none')
+        cache.store('a', 'b')
+
+        # The new codec will not be used until the cache is empty
+        cache = Cache(cache_path, codec='zlib')
+        cache.store('c')
+
+        with open(cache.header_file, 'r') as fd:
+            header = json.load(fd)
+        self.assertEqual(header['codec'], 'none')
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['a', 'b', 'c'])
+
+        cache.clean()
+        cache.store('d')
+
+        with open(cache.header_file, 'r') as fd:
+            header = json.load(fd)
+        self.assertEqual(header['codec'], 'zlib')
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['d'])
+
+        # The backup keeps its own codec
+        cache.recover()
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, ['a', 'b', 'c'])
+
+    def test_invalid_codec(self):
+        """Test whether an exception is raised when a codec is not available"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+
+        with self.assertRaises(CacheError):
+            _ = Cache(cache_path, codec='mycodec')
+
+        cache = Cache(cache_path)
+        cache.store('a')
+
+        with open(cache.header_file, 'w') as fd:
+            json.dump({'version': 2, 'codec': 'mycodec'}, fd)
+
+        with self.assertRaises(CacheError):
+            _ = [item for item in cache.retrieve()]
+
+        with self.assertRaises(CacheError):
+            cache.store('b')
+
+    def test_invalid_version(self):
+        """Test whether an exception is raised when the format is not supported"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store('a')
+
+        with open(cache.header_file, 'w') as fd:
+            json.dump({'version': 1, 'codec': 'zlib'}, fd)
+
+        with self.assertRaises(CacheError):
+            _ = [item for item in cache.retrieve()]
+
     def test_backup(self):
         """Test backup method"""
 
@@ -89,10 +338,18 @@ class TestCache(unittest.TestCase):
         cache.store(*items)
         cache.backup()
 
-        expected = [f for f in os.listdir(cache.items_path)]
-        rfiles = [f for f in os.listdir(cache.recovery_path)]
+        expected = sorted([f for f in os.listdir(cache.items_path)])
+        rfiles = sorted([f for f in os.listdir(cache.recovery_path)
+                         if f != 'perceval_cache.snapshot'])
         self.assertEqual(rfiles, expected)
         self.assertNotEqual(len(rfiles), 0)
+        self.assertEqual(os.path.exists(cache.snapshot_file), True)
+
+        # Files are linked, not copied
+        for f in expected:
+            ifile = os.path.join(cache.items_path, f)
+            rfile = os.path.join(cache.recovery_path, f)
+            self.assertEqual(os.path.samefile(ifile, rfile), True)
 
     def test_clean(self):
         """Test clean method"""
@@ -103,7 +360,7 @@ class TestCache(unittest.TestCase):
         cache = Cache(cache_path)
         cache.store(*items)
 
-        expected = [f for f in os.listdir(cache.items_path)]
+        expected = sorted([f for f in os.listdir(cache.items_path)])
 
         cache.clean()
 
@@ -111,7 +368,8 @@ class TestCache(unittest.TestCase):
         contents = [item for item in cache.retrieve()]
         self.assertEqual(len(contents), 0)
 
-        rfiles = [f for f in os.listdir(cache.recovery_path)]
+        rfiles = sorted([f for f in os.listdir(cache.recovery_path)
+                         if f != 'perceval_cache.snapshot'])
         self.assertEqual(rfiles, expected)
         self.assertNotEqual(len(rfiles), 0)
 
@@ -143,6 +401,199 @@ class TestCache(unittest.TestCase):
         contents = [item for item in cache.retrieve()]
         self.assertListEqual(contents, expected)
 
+    def test_recover_snapshot(self):
+        """Test whether items stored after a backup are discarded on recovery"""
+
+        expected = [1, 2, 3, 4, 5]
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.SEGMENT_MAX_SIZE = 16
+        cache.store(*expected)
+        cache.backup()
+
+        # These items are appended to files shared with the backup
+        # and to new segments
+        cache.store(6, 7, 8)
+        cache.store(*range(100))
+
+        cache.recover()
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+        # Recover several times from the same backup
+        cache.store(9, 10)
+        cache.recover()
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+    def test_recover_empty_backup(self):
+        """Test whether the cache is empty when the backup has no data"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.backup()
+        cache.store(1, 2, 3)
+
+        cache.recover()
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, [])
+
+    @unittest.mock.patch('os.link')
+    def test_backup_without_links(self, mock_link):
+        """Test whether files are copied when hard links are not supported"""
+
+        mock_link.side_effect = OSError('links not supported')
+
+        expected = [1, 2, 3, 4, 5]
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+        cache.store(*expected)
+        cache.backup()
+        cache.store(6, 7)
+
+        for f in os.listdir(cache.items_path):
+            ifile = os.path.join(cache.items_path, f)
+            rfile = os.path.join(cache.recovery_path, f)
+            self.assertEqual(os.path.samefile(ifile, rfile), False)
+
+        cache.recover()
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, expected)
+
+
+class TestMigrateShelveCache(unittest.TestCase):
+    """Tests for shelve caches migration"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    @staticmethod
+    def create_shelve_cache(dirpath, items):
+        os.makedirs(dirpath, exist_ok=True)
+
+        with shelve.open(os.path.join(dirpath, Cache.CACHE_PREFIX)) as cache:
+            for key, item in enumerate(items):
+                cache[str(key)] = item
+
+    def test_migrate_on_init(self):
+        """Test whether shelve caches are migrated when the cache is opened"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        items = ['a', {'b': 1}] + list(range(20))
+
+        self.create_shelve_cache(os.path.join(cache_path, 'items'), items)
+        self.create_shelve_cache(os.path.join(cache_path, 'recovery'), [1, 2, 3])
+
+        cache = Cache(cache_path)
+
+        self.assertFalse(is_shelve_cache(cache.cache_files))
+        self.assertFalse(is_shelve_cache(os.path.join(cache.recovery_path,
+                                                      cache.CACHE_PREFIX)))
+        self.assertFalse(os.path.exists(os.path.join(cache_path, 'migration')))
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, items)
+
+        cache.recover()
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, [1, 2, 3])
+
+    def test_migrate_shelve_cache(self):
+        """Test whether items are appended in order when a cache is migrated"""
+
+        cache_path = os.path.join(self.test_path, CACHE_DIR)
+        cache = Cache(cache_path)
+
+        # Data from an incomplete migration should be removed
+        cache.store('x', 'y')
+        self.create_shelve_cache(cache.items_path, list(range(2500)))
+
+        nitems = migrate_shelve_cache(cache)
+        self.assertEqual(nitems, 2500)
+
+        contents = [item for item in cache.retrieve()]
+        self.assertListEqual(contents, list(range(2500)))
+
+
+class TestEntityCache(unittest.TestCase):
+    """Tests for EntityCache class"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.db_path = os.path.join(self.test_path, 'entities', 'entities.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_memory(self):
+        """Test whether entities are kept in memory when no path is given"""
+
+        cache = EntityCache(max_size=2)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A')
+
+        # 'b' is the least recently used entity
+        cache.set('c', 'C')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('c'), 'C')
+
+        cache.set('a', 'AA')
+        self.assertEqual(cache.get('a'), 'AA')
+
+    def test_persistent(self):
+        """Test whether entities are shared through the database"""
+
+        cache = EntityCache(self.db_path, max_size=1)
+        cache.set('a', 'A')
+        cache.set('b', 'B')
+
+        # 'a' was removed from memory but it is in the database
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('b'), 'B')
+
+        other = EntityCache(self.db_path)
+        self.assertEqual(other.get('a'), 'A')
+        self.assertEqual(other.get('b'), 'B')
+
+        cache.close()
+        other.close()
+
+    @unittest.mock.patch('perceval.cache.time.time')
+    def test_ttl(self, mock_time):
+        """Test whether expired entities are not returned and purged"""
+
+        mock_time.return_value = 1000
+        cache = EntityCache(self.db_path, ttl=60)
+        cache.set('a', 'A')
+
+        mock_time.return_value = 1050
+        cache.set('b', 'B')
+        self.assertEqual(cache.get('a'), 'A')
+
+        mock_time.return_value = 1060
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'B')
+        self.assertIsNone(EntityCache(self.db_path, ttl=60).get('a'))
+
+        self.assertEqual(cache.purge(), 1)
+        self.assertEqual(EntityCache(self.db_path, ttl=3600).get('b'), 'B')
+        self.assertIsNone(EntityCache(self.db_path, ttl=3600).get('a'))
+
+    def test_invalid_path(self):
+        """Test whether an exception is raised when the database cannot be opened"""
+
+        with self.assertRaisesRegex(CacheError, "cannot be opened"):
+            _ = EntityCache(self.test_path)
+
 
 class TestSetupCache(unittest.TestCase):
     """Tests for setup_cache function"""
@@ -179,6 +630,15 @@ class TestSetupCache(unittest.TestCase):
         self.assertEqual(cache.cache_path, expected_path)
         self.assertEqual(os.path.exists(cache.cache_path), True)
 
+    def test_codec(self):
+        """Test if the cache is created with the given codec"""
+
+        cache = setup_cache(CACHE_DIR, cache_path=self.test_path,
+                            codec='none')
+
+        self.assertIsInstance(cache, Cache)
+        self.assertEqual(cache.codec, 'none')
+
     def test_clean_cache(self):
         """Test if an existing cache is cleaned when the parameter is set"""
 
@@ -21,8 +21,12 @@
 #     Valerio Cosentino <valcos@bitergia.com>
 #
 
+import json
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import time
 import unittest
 
@@ -35,7 +39,11 @@ import requests
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 pkg_resources.declare_namespace('perceval.backends')
 
-from perceval.client import HttpClient, RateLimitHandler
+from perceval.client import (HttpCache,
+                             HttpClient,
+                             HttpMetrics,
+                             RateLimitCoordinator,
+                             RateLimitHandler)
 from perceval.errors import RateLimitError
 
 
@@ -53,14 +61,21 @@ class MockedClient(HttpClient, RateLimitHandler):
                  headers=HttpClient.DEFAULT_HEADERS, sleep_for_rate=False,
                  min_rate_to_sleep=RateLimitHandler.MIN_RATE_LIMIT,
                  rate_limit_header=RateLimitHandler.RATE_LIMIT_HEADER,
-                 rate_limit_reset_header=RateLimitHandler.RATE_LIMIT_RESET_HEADER):
+                 rate_limit_reset_header=RateLimitHandler.RATE_LIMIT_RESET_HEADER,
+                 tokens=None, coordinator=None):
 
         super().__init__(base_url, default_sleep_time=default_sleep_time, max_retries=max_retries,
                          status_forcelist=status_force_list, headers=headers)
         super().setup_rate_limit_handler(sleep_for_rate=sleep_for_rate,
                                          min_rate_to_sleep=min_rate_to_sleep,
                                          rate_limit_header=rate_limit_header,
-                                         rate_limit_reset_header=rate_limit_reset_header)
+                                         rate_limit_reset_header=rate_limit_reset_header,
+                                         tokens=tokens,
+                                         coordinator=coordinator)
+        self.token = self.current_token
+
+    def _set_token(self, token):
+        self.token = token
 
 
 class TestHttpClient(unittest.TestCase):
@@ -246,6 +261,199 @@ class TestHttpClient(unittest.TestCase):
                 _ = client.fetch(url)
 
 
+class TestHttpCache(unittest.TestCase):
+    """HTTP cache tests"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    @httpretty.activate
+    def test_revalidate(self):
+        """Test whether not modified responses are served from the cache"""
+
+        def request_callback(request, uri, headers):
+            if request.headers.get('If-None-Match') == '"v1"':
+                headers['X-RateLimit-Remaining'] = '19'
+                return (304, headers, '')
+
+            headers['ETag'] = '"v1"'
+            headers['Link'] = '<' + CLIENT_SUPERMAN_URL + '>; rel="next"'
+            headers['X-RateLimit-Remaining'] = '20'
+            return (200, headers, 'success')
+
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_SPIDERMAN_URL,
+                               responses=[httpretty.Response(body=request_callback)])
+
+        client = MockedClient(CLIENT_API_URL)
+        client.http_cache = HttpCache(self.test_path)
+
+        response = client.fetch(CLIENT_SPIDERMAN_URL, payload={'page': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'success')
+        self.assertNotIn('If-None-Match', httpretty.last_request().headers)
+
+        response = client.fetch(CLIENT_SPIDERMAN_URL, payload={'page': 1})
+        self.assertEqual(httpretty.last_request().headers['If-None-Match'], '"v1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, 'success')
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '19')
+        self.assertEqual(response.links['next']['url'], CLIENT_SUPERMAN_URL)
+        self.assertDictEqual(client.metrics.summary()['endpoints'][0]['status'],
+                             {'200': 1, '304': 1})
+
+        # Other parameters are a different resource
+        _ = client.fetch(CLIENT_SPIDERMAN_URL, payload={'page': 2})
+        self.assertNotIn('If-None-Match', httpretty.last_request().headers)
+
+    @httpretty.activate
+    def test_last_modified(self):
+        """Test whether responses are revalidated by their modification date"""
+
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_SPIDERMAN_URL,
+                               responses=[
+                                   httpretty.Response(body='success', status=200,
+                                                      forcing_headers={'Last-Modified': last_modified}),
+                                   httpretty.Response(body='updated', status=200)
+                               ])
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_BATMAN_URL,
+                               body='no validators',
+                               status=200)
+
+        client = MockedClient(CLIENT_API_URL)
+        client.http_cache = HttpCache(self.test_path)
+
+        _ = client.fetch(CLIENT_SPIDERMAN_URL)
+        response = client.fetch(CLIENT_SPIDERMAN_URL)
+        self.assertEqual(httpretty.last_request().headers['If-Modified-Since'], last_modified)
+        self.assertEqual(response.text, 'updated')
+
+        # Responses without validators are not stored
+        _ = client.fetch(CLIENT_BATMAN_URL)
+        self.assertIsNone(client.http_cache.get(HttpCache.key(CLIENT_BATMAN_URL)))
+        self.assertIsNotNone(client.http_cache.get(HttpCache.key(CLIENT_SPIDERMAN_URL)))
+
+
+class TestHttpMetrics(unittest.TestCase):
+    """HTTP metrics tests"""
+
+    def test_endpoint(self):
+        """Test whether numeric identifiers are removed from the endpoints"""
+
+        metrics = HttpMetrics()
+
+        endpoint = metrics.endpoint(CLIENT_SPIDERMAN_URL)
+        self.assertEqual(endpoint, '/v1/public/characters/:id')
+
+        endpoint = metrics.endpoint('https://api.github.com/repos/owner/repo/issues/12/comments?page=2')
+        self.assertEqual(endpoint, '/repos/owner/repo/issues/:id/comments')
+
+        endpoint = metrics.endpoint('https://example.com')
+        self.assertEqual(endpoint, '/')
+
+    @httpretty.activate
+    def test_fetch_metrics(self):
+        """Test whether requests are accounted by the client"""
+
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_SPIDERMAN_URL,
+                               body="success",
+                               status=200)
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_SUPERMAN_URL,
+                               body="",
+                               status=403)
+
+        client = MockedClient(CLIENT_API_URL)
+        client.fetch(CLIENT_SPIDERMAN_URL)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            _ = client.fetch(CLIENT_SUPERMAN_URL)
+
+        summary = client.metrics.summary()
+
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['retries'], 0)
+        self.assertEqual(summary['bytes'], 7)
+        self.assertEqual(len(summary['endpoints']), 1)
+
+        endpoint = summary['endpoints'][0]
+        self.assertEqual(endpoint['method'], 'GET')
+        self.assertEqual(endpoint['endpoint'], '/v1/public/characters/:id')
+        self.assertEqual(endpoint['requests'], 2)
+        self.assertDictEqual(endpoint['status'], {'200': 1, '403': 1})
+        self.assertEqual(sum(n for _, n in endpoint['latency_buckets']), 2)
+
+        data = json.loads(client.metrics.to_json())
+        self.assertEqual(data['requests'], 2)
+
+    @httpretty.activate
+    def test_fetch_retries_metrics(self):
+        """Test whether retries are accounted by the client"""
+
+        httpretty.register_uri(httpretty.GET,
+                               CLIENT_SPIDERMAN_URL,
+                               responses=[
+                                   httpretty.Response(body="", status=408),
+                                   httpretty.Response(body="success", status=200)
+                               ])
+
+        client = MockedClient(CLIENT_API_URL, default_sleep_time=0, max_retries=2)
+        client.fetch(CLIENT_SPIDERMAN_URL)
+
+        summary = client.metrics.summary()
+
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['errors'], 0)
+        self.assertEqual(summary['retries'], 1)
+
+    def test_rate_limit_sleeps(self):
+        """Test whether the time waiting for rate limit resets is accounted"""
+
+        metrics = HttpMetrics()
+        metrics.observe_rate_limit_sleep(10)
+        metrics.observe_rate_limit_sleep(5)
+
+        summary = metrics.summary()
+        self.assertEqual(summary['rate_limit_sleeps'], 2)
+        self.assertEqual(summary['rate_limit_sleep_time'], 15)
+
+    def test_to_prometheus(self):
+        """Test whether metrics are exported using Prometheus text format"""
+
+        metrics = HttpMetrics()
+        metrics.observe_request('GET', CLIENT_SPIDERMAN_URL, 0.2)
+        metrics.observe_request('GET', CLIENT_SUPERMAN_URL, 3.0, error=True)
+        metrics.observe_rate_limit_sleep(10)
+
+        lines = metrics.to_prometheus().split('\n')
+
+        labels = '{method="GET",endpoint="/v1/public/characters/:id"}'
+
+        self.assertIn('# TYPE perceval_http_requests_total counter', lines)
+        self.assertIn('perceval_http_requests_total' + labels + ' 2', lines)
+        self.assertIn('perceval_http_errors_total' + labels + ' 1', lines)
+        self.assertIn('# TYPE perceval_http_request_duration_seconds histogram', lines)
+        self.assertIn('perceval_http_request_duration_seconds_bucket'
+                      '{method="GET",endpoint="/v1/public/characters/:id",le="0.1"} 0', lines)
+        self.assertIn('perceval_http_request_duration_seconds_bucket'
+                      '{method="GET",endpoint="/v1/public/characters/:id",le="0.25"} 1', lines)
+        self.assertIn('perceval_http_request_duration_seconds_bucket'
+                      '{method="GET",endpoint="/v1/public/characters/:id",le="+Inf"} 2', lines)
+        self.assertIn('perceval_http_request_duration_seconds_count' + labels + ' 2', lines)
+        self.assertIn('perceval_http_rate_limit_sleep_seconds_total 10.0', lines)
+        self.assertIn('perceval_http_rate_limit_sleeps_total 1', lines)
+        self.assertEqual(lines[-1], '')
+
+
 class TestRateLimitHandler(unittest.TestCase):
     """RateLimit handler tests"""
 
@@ -339,6 +547,7 @@ class TestRateLimitHandler(unittest.TestCase):
         after = int(time.time())
 
         self.assertTrue(reset_time + 1 == after)
+        self.assertEqual(client.metrics.rate_limit_sleeps, 1)
 
     @httpretty.activate
     def test_rate_limit_error(self):
@@ -366,6 +575,253 @@ class TestRateLimitHandler(unittest.TestCase):
         with self.assertRaises(RateLimitError):
             client.sleep_for_rate_limit()
 
+    def test_token_pool(self):
+        """Test whether the client switches to the token with the most quota"""
+
+        def rate_limit_response(remaining, reset_ts):
+            response = requests.Response()
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+            response.headers['X-RateLimit-Reset'] = str(reset_ts)
+            return response
+
+        now = int(time.time())
+
+        client = MockedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                              tokens=['aaa', 'bbb', 'ccc'])
+        self.assertEqual(client.token, 'aaa')
+
+        client.update_rate_limit(rate_limit_response(5, now + 100))
+        client.sleep_for_rate_limit()
+
+        # Tokens not used yet are preferred
+        self.assertEqual(client.token, 'bbb')
+        self.assertIsNone(client.rate_limit)
+
+        client.update_rate_limit(rate_limit_response(8, now + 50))
+        client.switch_token('ccc')
+        client.update_rate_limit(rate_limit_response(300, now + 200))
+        client.update_rate_limit(rate_limit_response(2, now + 200))
+
+        # Every token is exhausted; the one which is reset first is chosen
+        with self.assertRaises(RateLimitError) as e:
+            client.sleep_for_rate_limit()
+        self.assertEqual(client.token, 'bbb')
+        self.assertLessEqual(e.exception.seconds_to_reset, 51)
+
+        # Tokens which rate limit was reset have their whole quota
+        client.tokens_rate_limit['ccc'] = (2, now - 2)
+        client.sleep_for_rate_limit()
+        self.assertEqual(client.token, 'ccc')
+        self.assertIsNone(client.rate_limit)
+
+    def test_token_pool_sleep(self):
+        """Test whether the client sleeps when every token is exhausted"""
+
+        now = int(time.time())
+
+        client = MockedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                              sleep_for_rate=True, tokens=['aaa', 'bbb'])
+        client.tokens_rate_limit['aaa'] = (1, now + 100)
+        client.tokens_rate_limit['bbb'] = (1, now)
+        client.rate_limit, client.rate_limit_reset_ts = client.tokens_rate_limit['aaa']
+
+        before = time.time()
+        client.sleep_for_rate_limit()
+
+        self.assertEqual(client.token, 'bbb')
+        self.assertLess(time.time() - before, 5)
+        self.assertEqual(client.metrics.rate_limit_sleeps, 1)
+
+    def test_shared_rate_limit(self):
+        """Test whether clients share their rate limit using a coordinator"""
+
+        test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.addCleanup(shutil.rmtree, test_path)
+
+        response = requests.Response()
+        response.headers['X-RateLimit-Remaining'] = '13'
+        response.headers['X-RateLimit-Reset'] = str(int(time.time()) + 100)
+
+        coordinator = RateLimitCoordinator(os.path.join(test_path, 'rate_limit.db'))
+        self.addCleanup(coordinator.close)
+
+        client_a = MockedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                                tokens=['aaa'], coordinator=coordinator)
+        client_b = MockedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                                tokens=['aaa'], coordinator=coordinator)
+
+        # The quota seen by a client is consumed by the other one
+        client_a.update_rate_limit(response)
+        self.assertIsNone(client_b.rate_limit)
+
+        client_b.sleep_for_rate_limit()
+        client_a.sleep_for_rate_limit()
+        client_b.sleep_for_rate_limit()
+
+        with self.assertRaises(RateLimitError) as e:
+            client_b.sleep_for_rate_limit()
+        self.assertLessEqual(e.exception.seconds_to_reset, 101)
+
+        # Clients with other tokens have their own rate limit
+        client_c = MockedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                                tokens=['bbb'], coordinator=coordinator)
+        client_c.sleep_for_rate_limit()
+
+    def test_rate_limit_threads(self):
+        """Test whether the rate limit is updated and checked from several threads"""
+
+        class ProbedClient(MockedClient):
+            """Client which finds out when its rate limit is handled concurrently"""
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.active = 0
+                self.overlaps = 0
+
+            def calculate_rate_limit_reset_ts(self, reset):
+                self.active += 1
+                if self.active > 1:
+                    self.overlaps += 1
+                time.sleep(0.001)
+                self.active -= 1
+                return super().calculate_rate_limit_reset_ts(reset)
+
+        def rate_limit_response(remaining, reset_ts):
+            response = requests.Response()
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+            response.headers['X-RateLimit-Reset'] = str(reset_ts)
+            return response
+
+        def run(remaining):
+            for _ in range(20):
+                try:
+                    client.sleep_for_rate_limit()
+                except RateLimitError:
+                    pass
+                client.update_rate_limit(rate_limit_response(remaining, now + 100))
+
+        now = int(time.time())
+
+        client = ProbedClient(CLIENT_API_URL, min_rate_to_sleep=10,
+                              tokens=['aaa', 'bbb', 'ccc'])
+
+        threads = [threading.Thread(target=run, args=(remaining,))
+                   for remaining in (5, 100, 5, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(client.overlaps, 0)
+        self.assertEqual(client.tokens_rate_limit[client.current_token],
+                         (client.rate_limit, client.rate_limit_reset_ts))
+        self.assertEqual(client.token, client.current_token)
+
+
+class TestRateLimitCoordinator(unittest.TestCase):
+    """Rate limit coordinator tests"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.db_path = os.path.join(self.test_path, 'db', 'rate_limit.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_unknown_rate_limit(self):
+        """Test whether requests are granted when the rate limit is unknown"""
+
+        coordinator = RateLimitCoordinator(self.db_path)
+        self.assertTrue(os.path.exists(self.db_path))
+
+        self.assertEqual(coordinator.acquire('key'), (0, False))
+
+        # Expired rate limits are unknown, too
+        coordinator.update('key', 0, int(time.time()) - 1)
+        self.assertEqual(coordinator.acquire('key'), (0, False))
+
+        coordinator.close()
+
+    def test_acquire(self):
+        """Test whether requests are paced after a burst"""
+
+        reset_ts = time.time() + 100
+
+        coordinator = RateLimitCoordinator(self.db_path, burst=0)
+        coordinator.update('key', 12, reset_ts)
+
+        delays = [coordinator.acquire('key', min_rate=2)[0] for _ in range(3)]
+
+        # The quota left is spread until the reset
+        self.assertEqual(delays[0], 0)
+        self.assertAlmostEqual(delays[1], 100 / 10, delta=0.5)
+        self.assertAlmostEqual(delays[2], 100 / 10 + 100 / 9, delta=0.5)
+
+        coordinator.close()
+
+        # Requests of a burst are not delayed
+        coordinator = RateLimitCoordinator(self.db_path, burst=5)
+        coordinator.update('other', 12, reset_ts)
+
+        delays = [coordinator.acquire('other', min_rate=2)[0] for _ in range(4)]
+        self.assertEqual(delays, [0, 0, 0, 0])
+
+        coordinator.close()
+
+    def test_acquire_exhausted(self):
+        """Test whether requests are not granted when the quota is exhausted"""
+
+        reset_ts = time.time() + 100
+
+        coordinator = RateLimitCoordinator(self.db_path)
+        coordinator.update('key', 11, reset_ts)
+
+        self.assertEqual(coordinator.acquire('key', min_rate=10)[1], False)
+
+        delay, exhausted = coordinator.acquire('key', min_rate=10)
+        self.assertTrue(exhausted)
+        self.assertAlmostEqual(delay, 100, delta=0.5)
+
+        # Other keys are not affected
+        self.assertEqual(coordinator.acquire('other', min_rate=10), (0, False))
+
+        coordinator.close()
+
+    def test_update(self):
+        """Test whether requests granted are not forgotten on updates"""
+
+        reset_ts = int(time.time()) + 100
+
+        coordinator = RateLimitCoordinator(self.db_path)
+        coordinator.update('key', 12, reset_ts)
+        coordinator.acquire('key', min_rate=10)
+        coordinator.acquire('key', min_rate=10)
+
+        # A late response of the same period does not add quota
+        coordinator.update('key', 12, reset_ts)
+        self.assertTrue(coordinator.acquire('key', min_rate=10)[1])
+
+        # A new period resets the quota
+        coordinator.update('key', 12, reset_ts + 3600)
+        self.assertFalse(coordinator.acquire('key', min_rate=10)[1])
+
+        coordinator.close()
+
+    def test_shared_database(self):
+        """Test whether coordinators share the same database"""
+
+        reset_ts = time.time() + 100
+
+        coordinator_a = RateLimitCoordinator(self.db_path)
+        coordinator_b = RateLimitCoordinator(self.db_path)
+
+        coordinator_a.update('key', 11, reset_ts)
+        self.assertFalse(coordinator_b.acquire('key', min_rate=10)[1])
+        self.assertTrue(coordinator_a.acquire('key', min_rate=10)[1])
+
+        coordinator_a.close()
+        coordinator_b.close()
+
 
 if __name__ == "__main__":
     unittest.main(warnings='ignore')
@@ -22,6 +22,7 @@
 #
 
 import os
+import pickle
 import sys
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -66,6 +67,16 @@ class TestBaseError(unittest.TestCase):
         kwargs = {'code': 1, 'error': 'Fatal error'}
         self.assertRaises(KeyError, MockErrorArgs, **kwargs)
 
+    def test_pickle(self):
+        """Check if errors are rebuilt with their arguments when they are unpickled"""
+
+        e = MockErrorArgs(code=1, msg='Fatal error')
+        e = pickle.loads(pickle.dumps(e))
+
+        self.assertIsInstance(e, MockErrorArgs)
+        self.assertEqual("Mock error with args. Error: 1 Fatal error",
+                         str(e))
+
 
 class TestBackendError(unittest.TestCase):
 
@@ -111,6 +122,9 @@ class TestRateLimitError(unittest.TestCase):
                                   seconds_to_reset=10)
         self.assertEqual(e.seconds_to_reset, 10)
 
+        e = pickle.loads(pickle.dumps(e))
+        self.assertEqual(e.seconds_to_reset, 10)
+
 
 class TestParseError(unittest.TestCase):
 
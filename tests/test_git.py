@@ -21,7 +21,9 @@
 #     Santiago Dueñas <sduenas@bitergia.com>
 #
 
+import concurrent.futures
 import datetime
+import io
 import os
 import shutil
 import subprocess
@@ -39,12 +41,14 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."
 pkg_resources.declare_namespace('perceval.backends')
 
 from perceval.backend import BackendCommandArgumentParser, uuid
-from perceval.errors import RepositoryError
+from perceval.errors import ParseError, RepositoryError
 from perceval.utils import DEFAULT_DATETIME
 from perceval.backends.core.git import (EmptyRepositoryError,
                                         Git,
                                         GitCommand,
+                                        GitNulParser,
                                         GitParser,
+                                        GitRef,
                                         GitRepository)
 
 
@@ -222,6 +226,77 @@ class TestGitBackend(TestCaseGit):
 
         shutil.rmtree(new_path)
 
+    def test_fetch_fast_log(self):
+        """Test whether the fast log mode fetches the same commits"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        git = Git(self.git_path, new_path)
+        commits = [commit['data'] for commit in git.fetch()]
+        fast_commits = [commit['data'] for commit in git.fetch(fast_log=True)]
+
+        self.assertEqual(len(fast_commits), 9)
+        self.assertListEqual(fast_commits, commits)
+
+        shutil.rmtree(new_path)
+
+    @unittest.mock.patch.object(GitRepository, 'MIN_LOG_RANGE_SIZE', 2)
+    def test_fetch_log_workers(self):
+        """Test whether the log is read in parallel keeping the order of the commits"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        git = Git(self.git_path, new_path)
+        commits = [commit['data'] for commit in git.fetch()]
+        parallel_commits = [commit['data'] for commit in git.fetch(log_workers=2)]
+
+        self.assertEqual(len(parallel_commits), 9)
+        self.assertListEqual(parallel_commits, commits)
+
+        parallel_commits = [commit['data'] for commit in git.fetch(fast_log=True, log_workers=2)]
+        self.assertListEqual(parallel_commits, commits)
+
+        shutil.rmtree(new_path)
+
+    def test_fetch_details(self):
+        """Test whether partial clones are made when not all the details are fetched"""
+
+        # Filters are only allowed by remote (non-local) repositories
+        subprocess.check_call(['git', '-C', self.git_path, 'config', 'uploadpack.allowFilter', 'true'])
+        uri = 'file://' + self.git_path
+
+        expected = {
+            'full': None,
+            'raw': 'blob:none',
+            'metadata': 'tree:0'
+        }
+
+        for details, clone_filter in expected.items():
+            new_path = os.path.join(self.tmp_path, 'newgit')
+
+            git = Git(uri, new_path)
+            commits = [commit['data'] for commit in git.fetch(details=details)]
+            fast_commits = [commit['data'] for commit in git.fetch(details=details, fast_log=True)]
+
+            self.assertEqual(len(commits), 9)
+            self.assertListEqual(fast_commits, commits)
+
+            files = [f for commit in commits for f in commit['files']]
+
+            if details == 'metadata':
+                self.assertListEqual(files, [])
+            else:
+                self.assertEqual(len(files), 12)
+                self.assertTrue(all(f['action'] for f in files))
+                self.assertEqual('added' in files[0], details == 'full')
+
+            cmd = ['git', '-C', new_path, 'config', '--default', '',
+                   '--get', 'remote.origin.partialclonefilter']
+            partial_clone_filter = subprocess.check_output(cmd).decode('utf-8').strip()
+            self.assertEqual(partial_clone_filter, clone_filter or '')
+
+            shutil.rmtree(new_path)
+
     def test_fetch_branch(self):
         """Test whether commits are fetched from a Git repository for a given branch"""
 
@@ -469,6 +544,108 @@ class TestGitBackend(TestCaseGit):
         shutil.rmtree(editable_path)
         shutil.rmtree(new_path)
 
+    def test_fetch_incremental(self):
+        """Test whether only the commits not fetched before are fetched in incremental mode"""
+
+        origin_path = os.path.join(self.tmp_repo_path, 'gittest')
+        editable_path = os.path.join(self.tmp_path, 'editgit')
+        new_path = os.path.join(self.tmp_path, 'newgit')
+        new_file = os.path.join(editable_path, 'newfile')
+
+        shutil.copytree(origin_path, editable_path)
+
+        git = Git(editable_path, new_path)
+
+        # First time, all the commits are fetched
+        commits = [commit for commit in git.fetch(incremental=True)]
+        self.assertEqual(len(commits), 9)
+
+        refs = discover_refs(new_path)
+        self.assertEqual(refs['refs/perceval/watermark/refs/heads/master'],
+                         '456a68ee1407a77f3e804a30dff245bb6c6b872f')
+
+        # Watermark refs do not decorate commits, even when every
+        # ref decorates them, like on git < 2.38
+        cmd = ['git', 'config', 'log.initialDecorationSet', 'all']
+        subprocess.check_call(cmd, cwd=new_path, env={'LANG': 'C'})
+
+        commits = [commit for commit in git.fetch()]
+        self.assertEqual(len(commits), 9)
+        self.assertListEqual(commits[-1]['data']['refs'], ['HEAD -> refs/heads/master'])
+
+        commits = [commit for commit in git.fetch(fast_log=True)]
+        self.assertListEqual(commits[-1]['data']['refs'], ['HEAD -> refs/heads/master'])
+
+        # The configuration of the repository is not modified
+        cmd = ['git', 'config', '--get', 'log.excludeDecoration']
+        result = subprocess.run(cmd, cwd=new_path, env={'LANG': 'C'})
+        self.assertEqual(result.returncode, 1)
+
+        cmd = ['git', 'config', '--unset', 'log.initialDecorationSet']
+        subprocess.check_call(cmd, cwd=new_path, env={'LANG': 'C'})
+
+        # Nothing new
+        commits = [commit for commit in git.fetch(incremental=True)]
+        self.assertEqual(len(commits), 0)
+
+        # Create a new commit on a new branch
+        cmd = ['git', 'checkout', '-b', 'mybranch']
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                cwd=editable_path, env={'LANG': 'C'})
+
+        with open(new_file, 'w') as f:
+            f.write("Testing incremental mode")
+
+        cmd = ['git', 'add', new_file]
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                cwd=editable_path, env={'LANG': 'C'})
+
+        cmd = ['git', '-c', 'user.name="mock"',
+               '-c', 'user.email="mock@example.com"',
+               'commit', '-m', 'Testing incremental mode']
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                cwd=editable_path, env={'LANG': 'C'})
+
+        # The watermark is not updated when the fetch is not completed
+        commits = git.fetch(incremental=True, fast_log=True)
+        _ = next(commits)
+        commits.close()
+
+        commits = [commit for commit in git.fetch(incremental=True, log_workers=2)]
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(commits[0]['data']['message'], 'Testing incremental mode')
+
+        commits = [commit for commit in git.fetch(incremental=True)]
+        self.assertEqual(len(commits), 0)
+
+        # Other modes are not affected by the watermark
+        commits = [commit for commit in git.fetch()]
+        self.assertEqual(len(commits), 10)
+
+        # Cleanup
+        shutil.rmtree(editable_path)
+        shutil.rmtree(new_path)
+
+    def test_fetch_walk_commits(self):
+        """Test whether walked commits are the same than the ones fetched from the log"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        git = Git(self.git_path, new_path)
+
+        for details in ['raw', 'metadata']:
+            expected = [commit for commit in git.fetch(details=details)]
+            commits = [commit for commit in git.fetch(details=details, walk_commits=True)]
+
+            self.assertEqual(len(commits), 9)
+            assert_same_commits(self,
+                                [commit['data'] for commit in commits],
+                                [commit['data'] for commit in expected])
+            self.assertSetEqual({commit['uuid'] for commit in commits},
+                                {commit['uuid'] for commit in expected})
+
+        shutil.rmtree(new_path)
+
     def test_fetch_latest_items_from_empty_repository(self):
         """Test whether it fetches no items from an empty repository"""
 
@@ -534,6 +711,75 @@ class TestGitBackend(TestCaseGit):
 
         self.assertListEqual(result, expected)
 
+    @unittest.mock.patch.object(Git, 'MIN_LOG_CHUNK_SIZE', 1)
+    def test_git_parser_workers(self):
+        """Test if the static method parses a git log file by chunks in parallel"""
+
+        files = ['git_log.txt', 'git_log_merge.txt', 'git_log_trailers.txt',
+                 'git_bad_encoding.txt', 'git_bad_cr.txt', 'git_log_empty.txt']
+
+        for filename in files:
+            filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    "data/git/", filename)
+
+            expected = [commit for commit in Git.parse_git_log_from_file(filepath)]
+            commits = [commit for commit in Git.parse_git_log_from_file(filepath, workers=2)]
+
+            self.assertListEqual(commits, expected)
+
+    @unittest.mock.patch.object(Git, 'MIN_LOG_CHUNK_SIZE', 1)
+    @unittest.mock.patch.object(Git, 'MAX_LOG_CHUNK_SIZE', 1024)
+    @unittest.mock.patch.object(Git, 'PENDING_LOG_CHUNKS_PER_WORKER', 1)
+    def test_git_parser_workers_bounded(self):
+        """Test if the size and the number of chunks parsed at the same time are bounded"""
+
+        filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "data/git/git_log.txt")
+        expected = [commit for commit in Git.parse_git_log_from_file(filepath)]
+
+        submit = concurrent.futures.ProcessPoolExecutor.submit
+
+        with unittest.mock.patch.object(concurrent.futures.ProcessPoolExecutor, 'submit',
+                                        autospec=True, side_effect=submit) as mock_submit:
+            commits = Git.parse_git_log_from_file(filepath, workers=1)
+            first = next(commits)
+
+            # Only the chunk of the first commit was submitted
+            self.assertEqual(mock_submit.call_count, 1)
+
+            commits = [first] + [commit for commit in commits]
+
+        self.assertListEqual(commits, expected)
+
+        chunks = [call[0][3:5] for call in mock_submit.call_args_list]
+        self.assertGreater(len(chunks), 2)
+
+        with open(filepath, 'rb') as f:
+            data = f.read()
+
+        for start, end in chunks:
+            self.assertTrue(data[start:end].startswith(b'commit '))
+            # Chunks end on the first commit after the maximum size
+            self.assertNotIn(b'\ncommit ', data[start + 1024:end])
+
+    @unittest.mock.patch.object(Git, 'MIN_LOG_CHUNK_SIZE', 1)
+    def test_git_parser_workers_error(self):
+        """Test if it raises an exception when a chunk is invalid"""
+
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/git/git_log.txt"), 'r') as f:
+            gitlog = f.read()
+
+        filepath = os.path.join(self.tmp_path, 'git_log_invalid.txt')
+
+        with open(filepath, 'w') as f:
+            f.write(gitlog)
+            f.write("commit 456a68ee1407a77f3e804a30dff245bb6c6b872f\nInvalid header\n")
+
+        with self.assertRaises(ParseError):
+            _ = [commit for commit in Git.parse_git_log_from_file(filepath, workers=2)]
+
+        os.remove(filepath)
+
     def test_git_encoding_error(self):
         """Test if encoding errors are escaped when a git log is parsed"""
 
@@ -611,6 +857,26 @@ class TestGitCommand(TestCaseGit):
         self.assertEqual(cmd.parsed_args.gitpath,
                          os.path.join(self.tmp_path, 'testpath/http://example.com/' + '-git'))
 
+        # Local paths are stored under the repositories directory, too
+        args = ['/tmp/repos/gittest']
+
+        cmd = GitCommand(*args)
+        self.assertEqual(cmd.parsed_args.gitpath,
+                         os.path.join(self.tmp_path, 'testpath/tmp/repos/gittest' + '-git'))
+
+        # Repositories stored next to local paths by older versions are used
+        legacy_path = os.path.join(self.tmp_path, 'legacy')
+        os.makedirs(legacy_path + '-git')
+
+        cmd = GitCommand(legacy_path)
+        self.assertEqual(cmd.parsed_args.gitpath, legacy_path + '-git')
+
+        shutil.rmtree(legacy_path + '-git')
+
+        cmd = GitCommand(legacy_path)
+        self.assertEqual(cmd.parsed_args.gitpath,
+                         os.path.join(self.tmp_path, 'testpath', legacy_path.lstrip('/')) + '-git')
+
         args = ['http://example.com/',
                 '--git-log', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/git/git_log.txt')]
 
@@ -651,6 +917,22 @@ class TestGitCommand(TestCaseGit):
         self.assertEqual(parsed_args.git_path, '/tmp/gitpath')
         self.assertEqual(parsed_args.uri, 'http://example.com/')
         self.assertEqual(parsed_args.branches, ['master', 'testing'])
+        self.assertFalse(parsed_args.incremental)
+
+        args = ['http://example.com/',
+                '--incremental']
+
+        parsed_args = parser.parse(*args)
+        self.assertTrue(parsed_args.incremental)
+        self.assertFalse(parsed_args.walk_commits)
+
+        args = ['http://example.com/',
+                '--details', 'raw',
+                '--walk-commits']
+
+        parsed_args = parser.parse(*args)
+        self.assertEqual(parsed_args.details, 'raw')
+        self.assertTrue(parsed_args.walk_commits)
 
 
 class TestGitParser(TestCaseGit):
@@ -956,6 +1238,189 @@ class TestGitParser(TestCaseGit):
         self.assertIsNotNone(m)
 
 
+NUL_LOG = '\0'.join([
+    # Commit with a renamed file
+    '87783129c3f00d2c81a3a8e585eb86a47e39891a',
+    'bc57a9209f096a130dcc5ba7089a8663f758a703',
+    'HEAD -> refs/heads/master, tag: refs/tags/v0.1',
+    'John Smith <jsmith@example.com>',
+    'Tue Aug 14 14:32:15 2012 -0300',
+    'John Smith <jsmith@example.com>',
+    'Tue Aug 14 14:32:15 2012 -0300',
+    'bc57a92',
+    'Renamed file\n\nSigned-off-by: John Smith <jsmith@example.com>\n'
+    'Signed-off-by: Jane Rae <jrae@example.com>\n',
+    '\n:100644 100644 e69de29 e69de29 R100',
+    'aaa/something',
+    'bbb/something',
+    ':100644 100644 e69de29 58a6c75 M',
+    'bbb/bthing',
+    '0\t0\t',
+    'aaa/something',
+    'bbb/something',
+    '-\t-\tbbb/bthing',
+    # Merge commit
+    '456a68ee1407a77f3e804a30dff245bb6c6b872f',
+    '87783129c3f00d2c81a3a8e585eb86a47e39891a 51a3b654f252210572297f47597b31527c475fb8',
+    '',
+    'John Smith <jsmith@example.com>',
+    'Tue Feb 11 22:10:39 2014 -0800',
+    'John Smith <jsmith@example.com>',
+    'Tue Feb 11 22:10:39 2014 -0800',
+    '8778312 51a3b65',
+    'Merge branch \'lzp\'\n\nConflicts:\n\taaa/otherthing\n',
+    '',
+    '1\t1\taaa/otherthing',
+    '::100644 100644 100644 e69de29 58a6c75 58a6c75 MM',
+    'aaa/otherthing',
+    # Commit without message nor files
+    'ce8e0b86a1e9877f42fe9453ede418519115f367',
+    '87783129c3f00d2c81a3a8e585eb86a47e39891a',
+    '',
+    'John Smith <jsmith@example.com>',
+    'Tue Feb 11 22:07:49 2014 -0800',
+    'John Smith <jsmith@example.com>',
+    'Tue Feb 11 22:07:49 2014 -0800',
+    '8778312',
+    ''
+])
+
+
+class TestGitNulParser(TestCaseGit):
+    """Git NUL-delimited log parser tests"""
+
+    def test_parser(self):
+        """Test if it parsers a NUL-delimited git log stream"""
+
+        parser = GitNulParser(NUL_LOG.split('\0'))
+        commits = [commit for commit in parser.parse()]
+
+        self.assertEqual(len(commits), 3)
+
+        expected = {
+            'commit': '87783129c3f00d2c81a3a8e585eb86a47e39891a',
+            'parents': ['bc57a9209f096a130dcc5ba7089a8663f758a703'],
+            'refs': ['HEAD -> refs/heads/master', 'tag: refs/tags/v0.1'],
+            'Author': 'John Smith <jsmith@example.com>',
+            'AuthorDate': 'Tue Aug 14 14:32:15 2012 -0300',
+            'Commit': 'John Smith <jsmith@example.com>',
+            'CommitDate': 'Tue Aug 14 14:32:15 2012 -0300',
+            'message': 'Renamed file\n\nSigned-off-by: John Smith <jsmith@example.com>\n'
+                       'Signed-off-by: Jane Rae <jrae@example.com>',
+            'Signed-off-by': ['John Smith <jsmith@example.com>',
+                              'Jane Rae <jrae@example.com>'],
+            'files': [
+                {
+                    'file': 'aaa/something',
+                    'newfile': 'bbb/something',
+                    'modes': ['100644', '100644'],
+                    'indexes': ['e69de29', 'e69de29'],
+                    'action': 'R100',
+                    'added': '0',
+                    'removed': '0'
+                },
+                {
+                    'file': 'bbb/bthing',
+                    'modes': ['100644', '100644'],
+                    'indexes': ['e69de29', '58a6c75'],
+                    'action': 'M',
+                    'added': '-',
+                    'removed': '-'
+                }
+            ]
+        }
+        self.assertDictEqual(commits[0], expected)
+
+        expected = {
+            'commit': '456a68ee1407a77f3e804a30dff245bb6c6b872f',
+            'parents': ['87783129c3f00d2c81a3a8e585eb86a47e39891a',
+                        '51a3b654f252210572297f47597b31527c475fb8'],
+            'refs': [],
+            'Merge': '8778312 51a3b65',
+            'Author': 'John Smith <jsmith@example.com>',
+            'AuthorDate': 'Tue Feb 11 22:10:39 2014 -0800',
+            'Commit': 'John Smith <jsmith@example.com>',
+            'CommitDate': 'Tue Feb 11 22:10:39 2014 -0800',
+            'message': "Merge branch 'lzp'\n\nConflicts:\n        aaa/otherthing",
+            'files': [
+                {
+                    'file': 'aaa/otherthing',
+                    'modes': ['100644', '100644', '100644'],
+                    'indexes': ['e69de29', '58a6c75', '58a6c75'],
+                    'action': 'MM',
+                    'added': '1',
+                    'removed': '1'
+                }
+            ]
+        }
+        self.assertDictEqual(commits[1], expected)
+        self.assertListEqual(list(commits[1].keys())[:4],
+                             ['commit', 'parents', 'refs', 'Merge'])
+
+        commit = commits[2]
+        self.assertEqual(commit['commit'], 'ce8e0b86a1e9877f42fe9453ede418519115f367')
+        self.assertNotIn('message', commit)
+        self.assertListEqual(commit['files'], [])
+
+    def test_parser_crlf_messages(self):
+        """Test if messages are formatted like the default pretty formats do"""
+
+        data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/git')
+
+        with open(os.path.join(data_path, 'git_log_crlf_nul.txt'), 'r', newline='') as fd:
+            parser = GitNulParser(fd.read().split('\0'))
+            commits = [commit for commit in parser.parse()]
+
+        self.assertEqual(len(commits), 2)
+
+        expected = 'Commit with CRLF line endings\n\n' \
+                   'Body line       with a tab\n' \
+                   '  indented line\n\n' \
+                   'Signed-off-by: John Smith <jsmith@example.com>\n' \
+                   'Signed-off-by: Jane Rae <jrae@example.com>'
+        self.assertEqual(commits[0]['message'], expected)
+        self.assertListEqual(commits[0]['Signed-off-by'],
+                             ['John Smith <jsmith@example.com>',
+                              'Jane Rae <jrae@example.com>'])
+        self.assertEqual(commits[1]['message'], 'Trailing spaces on the title\n\nLast line')
+
+        # Both parsers generate the same items
+        with open(os.path.join(data_path, 'git_log_crlf.txt'), 'r') as fd:
+            parser = GitParser(fd)
+            expected = [commit for commit in parser.parse()]
+
+        self.assertListEqual(commits, expected)
+
+    def test_parser_empty_log(self):
+        """Test if it parsers an empty NUL-delimited git log stream"""
+
+        parser = GitNulParser([])
+        commits = [commit for commit in parser.parse()]
+        self.assertListEqual(commits, [])
+
+        parser = GitNulParser([''])
+        commits = [commit for commit in parser.parse()]
+        self.assertListEqual(commits, [])
+
+    def test_parser_incomplete_log(self):
+        """Test if it raises an exception when a commit is incomplete"""
+
+        fields = NUL_LOG.split('\0')[:5]
+        parser = GitNulParser(fields)
+
+        with self.assertRaisesRegex(ParseError, "unexpected end of log on commit 1"):
+            _ = [commit for commit in parser.parse()]
+
+    def test_parser_invalid_commit(self):
+        """Test if it raises an exception when a commit hash is not found"""
+
+        fields = ['abcdef'] + NUL_LOG.split('\0')[1:]
+        parser = GitNulParser(fields)
+
+        with self.assertRaisesRegex(ParseError, "commit expected on commit 1"):
+            _ = [commit for commit in parser.parse()]
+
+
 class TestEmptyRepositoryError(TestCaseGit):
     """EmptyRepositoryError tests"""
 
@@ -977,6 +1442,61 @@ def count_commits(gitpath):
     return len(commits)
 
 
+def git_exec(gitpath, *args, date=None):
+    """Run a git command on a repository with a fixed identity"""
+
+    env = {
+        'LANG': 'C',
+        'GIT_AUTHOR_NAME': 'John Smith',
+        'GIT_AUTHOR_EMAIL': 'jsmith@example.com',
+        'GIT_COMMITTER_NAME': 'John Smith',
+        'GIT_COMMITTER_EMAIL': 'jsmith@example.com'
+    }
+
+    if date:
+        env['GIT_AUTHOR_DATE'] = date
+        env['GIT_COMMITTER_DATE'] = date
+
+    subprocess.check_call(['git', '-C', gitpath] + list(args), env=env)
+
+
+def create_renames_repository(gitpath):
+    """Create a repository with a file renamed unchanged and another one modified"""
+
+    subprocess.check_call(['git', 'init', '-q', gitpath])
+
+    for name in ['aaa', 'bbb']:
+        with open(os.path.join(gitpath, name), 'w') as fd:
+            fd.write(''.join('%s line %s\n' % (name, x) for x in range(100)))
+
+    git_exec(gitpath, 'add', '.')
+    git_exec(gitpath, 'commit', '-q', '-m', 'Add files')
+    git_exec(gitpath, 'mv', 'aaa', 'aaa.renamed')
+    git_exec(gitpath, 'mv', 'bbb', 'bbb.renamed')
+
+    with open(os.path.join(gitpath, 'bbb.renamed'), 'a') as fd:
+        fd.write('new line\n')
+
+    git_exec(gitpath, 'commit', '-q', '-a', '-m', 'Rename files')
+
+    # Filters are only allowed by remote (non-local) repositories
+    git_exec(gitpath, 'config', 'uploadpack.allowFilter', 'true')
+
+
+def assert_same_commits(test, commits, expected):
+    """Check walked commits are the ones of the log, in a topological order"""
+
+    test.assertEqual(len(commits), len(expected))
+    test.assertDictEqual({commit['commit']: commit for commit in commits},
+                         {commit['commit']: commit for commit in expected})
+
+    seen = set()
+
+    for commit in commits:
+        test.assertTrue(all(parent in seen for parent in commit['parents']))
+        seen.add(commit['commit'])
+
+
 def discover_refs(gitpath):
     """Get the references of local repository"""
 
@@ -1093,6 +1613,68 @@ class TestGitRepository(TestCaseGit):
 
         shutil.rmtree(new_path)
 
+    def test_clone_filter(self):
+        """Test if a partial clone is made when a filter is given"""
+
+        # Filters are only allowed by remote (non-local) repositories
+        subprocess.check_call(['git', '-C', self.git_path, 'config', 'uploadpack.allowFilter', 'true'])
+        uri = 'file://' + self.git_path
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(uri, new_path, clone_filter='tree:0')
+        self.assertIsInstance(repo, GitRepository)
+
+        cmd = ['git', '-C', new_path, 'config', '--get', 'remote.origin.partialclonefilter']
+        partial_clone_filter = subprocess.check_output(cmd).decode('utf-8').strip()
+        self.assertEqual(partial_clone_filter, 'tree:0')
+
+        gitlog = [line for line in repo.log(details='metadata')]
+        self.assertEqual(len(gitlog), 75)
+        self.assertFalse(any(line.startswith(':') for line in gitlog))
+
+        shutil.rmtree(new_path)
+
+    def test_log_details_raw_partial_clone(self):
+        """Test if blobs are not fetched on demand when the log has raw details"""
+
+        origin_path = os.path.join(self.tmp_path, 'renames')
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        create_renames_repository(origin_path)
+
+        repo = GitRepository.clone('file://' + origin_path, new_path, clone_filter='blob:none')
+        nobjects = repo.count_objects()
+
+        # Fetching missing objects on demand would fail
+        shutil.rmtree(origin_path)
+
+        commits = [commit for commit in Git.parse_git_log_from_iter(repo.log(details='raw'))]
+        gitlog = repo.log(details='raw', nul_format=True)
+        fast_commits = [commit for commit in Git.parse_git_log_from_iter(gitlog, nul_format=True)]
+
+        self.assertEqual(len(commits), 2)
+        self.assertListEqual(fast_commits, commits)
+        self.assertEqual(repo.count_objects(), nobjects)
+
+        # Only renames of unchanged files are detected
+        actions = [(f['action'], f['file']) for f in commits[1]['files']]
+        self.assertListEqual(actions, [('R100', 'aaa'), ('D', 'bbb'), ('A', 'bbb.renamed')])
+
+        shutil.rmtree(new_path)
+
+    def test_log_details_error(self):
+        """Test if it raises an exception when the level of detail is unknown"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        with self.assertRaisesRegex(RepositoryError, "unknown level of detail mydetails"):
+            _ = [line for line in repo.log(details='mydetails')]
+
+        shutil.rmtree(new_path)
+
     def test_clone_error(self):
         """Test if it raises an exception when an error occurs cloning a repository"""
 
@@ -1190,6 +1772,21 @@ class TestGitRepository(TestCaseGit):
 
         shutil.rmtree(new_path)
 
+    def test_is_empty_reference(self):
+        """Test if a repository which borrows its objects is not empty"""
+
+        ref_path = os.path.join(self.tmp_path, 'refgit')
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        GitRepository.clone(self.git_path, ref_path)
+        repo = GitRepository.clone('file://' + self.git_path, new_path, reference=ref_path)
+
+        self.assertEqual(repo.count_objects(), 0)
+        self.assertEqual(repo.is_empty(), False)
+
+        shutil.rmtree(new_path)
+        shutil.rmtree(ref_path)
+
     def test_update(self):
         """Test if the repository is updated to 'origin' status"""
 
@@ -1314,6 +1911,86 @@ class TestGitRepository(TestCaseGit):
         shutil.rmtree(editable_path)
         shutil.rmtree(new_path)
 
+    def test_read_commits_from_pack(self):
+        """Test if the commits of a pack are read in the same order that verify-pack shows"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        cmd = ['git', 'repack', '-a', '-d', '-f']
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                cwd=new_path, env={'LANG': 'C'})
+
+        pack_dir = os.path.join(new_path, 'objects', 'pack')
+        pack_file = [f for f in os.listdir(pack_dir) if f.endswith('.pack')][0]
+        pack_name = pack_file[len('pack-'):-len('.pack')]
+
+        cmd = ['git', 'verify-pack', '-v', os.path.join(pack_dir, pack_file)]
+        outs = subprocess.check_output(cmd, cwd=new_path, env={'LANG': 'C'})
+        expected = [line.split(' ')[0] for line in outs.decode('utf-8').split('\n')
+                    if ' commit ' in line]
+        expected.reverse()
+
+        commits = repo._read_commits_from_pack(pack_name)
+        self.assertEqual(len(commits), 9)
+        self.assertListEqual(commits, expected)
+
+        shutil.rmtree(new_path)
+
+    def test_read_commits_from_pack_deltas(self):
+        """Test if the types of deltified objects are found on packs"""
+
+        new_path = os.path.join(self.tmp_path, 'deltas')
+        env = {
+            'LANG': 'C',
+            'GIT_AUTHOR_NAME': 'John Smith',
+            'GIT_AUTHOR_EMAIL': 'jsmith@example.com',
+            'GIT_COMMITTER_NAME': 'John Smith',
+            'GIT_COMMITTER_EMAIL': 'jsmith@example.com'
+        }
+
+        # Grow a file on each commit, so its versions are deltified
+        subprocess.check_call(['git', 'init', '-q', new_path])
+        lines = []
+
+        for x in range(30):
+            lines.append('line %s of a file growing on each commit\n' % x)
+
+            with open(os.path.join(new_path, 'file'), 'w') as fd:
+                fd.write(''.join(lines))
+
+            subprocess.check_call(['git', '-C', new_path, 'add', 'file'], env=env)
+            subprocess.check_call(['git', '-C', new_path, 'commit', '-q', '-m', 'Commit %s' % x], env=env)
+
+        gitdir = os.path.join(new_path, '.git')
+        pack_dir = os.path.join(gitdir, 'objects', 'pack')
+        repo = GitRepository('file://' + new_path, gitdir)
+
+        # Deltas refer to their bases by offset or by hash
+        for use_offsets in ['true', 'false']:
+            cmd = ['git', '-c', 'repack.useDeltaBaseOffset=' + use_offsets,
+                   'repack', '-a', '-d', '-f', '-q']
+            subprocess.check_call(cmd, cwd=gitdir, env=env)
+
+            pack_file = [f for f in os.listdir(pack_dir) if f.endswith('.pack')][0]
+            pack_name = pack_file[len('pack-'):-len('.pack')]
+
+            cmd = ['git', 'verify-pack', '-v', os.path.join(pack_dir, pack_file)]
+            outs = subprocess.check_output(cmd, cwd=gitdir, env=env).decode('utf-8')
+
+            deltas = [line for line in outs.split('\n') if len(line.split()) == 7]
+            self.assertNotEqual(deltas, [])
+
+            expected = [line.split(' ')[0] for line in outs.split('\n')
+                        if ' commit ' in line]
+            expected.reverse()
+
+            commits = repo._read_commits_from_pack(pack_name)
+            self.assertEqual(len(commits), 30)
+            self.assertListEqual(commits, expected)
+
+        shutil.rmtree(new_path)
+
     def test_sync_from_empty_repos(self):
         """Test sync process on empty repositories"""
 
@@ -1326,6 +2003,92 @@ class TestGitRepository(TestCaseGit):
 
         shutil.rmtree(new_path)
 
+    def test_watermark(self):
+        """Test if the watermark is stored and used to exclude commits from the log"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        self.assertListEqual(repo.watermark(), [])
+
+        heads = repo.heads(['master'])
+        self.assertListEqual(heads, [GitRef('456a68ee1407a77f3e804a30dff245bb6c6b872f',
+                                            'refs/heads/master')])
+
+        heads = [GitRef('589bb080f059834829a2a5955bebfd7c2baa110a', 'refs/heads/master'),
+                 GitRef('51a3b654f252210572297f47597b31527c475fb8', 'refs/heads/lzp')]
+        repo.update_watermark(heads)
+        self.assertListEqual(sorted(repo.watermark()), sorted(heads))
+
+        commits = repo.rev_list(exclude_watermark=True)
+        self.assertListEqual(commits, ['ce8e0b86a1e9877f42fe9453ede418519115f367',
+                                       '456a68ee1407a77f3e804a30dff245bb6c6b872f'])
+
+        gitlog = [line for line in repo.log(exclude_watermark=True) if line.startswith('commit ')]
+        self.assertEqual(len(gitlog), 2)
+
+        # The watermark is replaced
+        repo.update_watermark(repo.heads())
+        self.assertListEqual(sorted(repo.watermark()), sorted(repo.heads()))
+
+        commits = repo.rev_list(exclude_watermark=True)
+        self.assertListEqual(commits, [])
+
+        # Heads with the same name are not affected
+        refs = discover_refs(new_path)
+        self.assertEqual(refs['refs/heads/master'], '456a68ee1407a77f3e804a30dff245bb6c6b872f')
+
+        shutil.rmtree(new_path)
+
+    def test_update_references(self):
+        """Test if references are created, updated and deleted in a batch"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        refs = [
+            GitRef('589bb080f059834829a2a5955bebfd7c2baa110a', 'refs/heads/master'),
+            GitRef('456a68ee1407a77f3e804a30dff245bb6c6b872f', 'refs/heads/mybranch'),
+            GitRef('456a68ee1407a77f3e804a30dff245bb6c6b872f', 'refs/remotes/origin/master'),
+            GitRef('456a68ee1407a77f3e804a30dff245bb6c6b872f', 'refs/tags/v0.1^{}')
+        ]
+
+        with unittest.mock.patch.object(repo, '_update_ref') as mock_update_ref:
+            repo._update_references(refs)
+            mock_update_ref.assert_not_called()
+
+        expected = {
+            'refs/heads/master': '589bb080f059834829a2a5955bebfd7c2baa110a',
+            'refs/heads/mybranch': '456a68ee1407a77f3e804a30dff245bb6c6b872f'
+        }
+        self.assertDictEqual(discover_refs(new_path), expected)
+
+        shutil.rmtree(new_path)
+
+    def test_update_references_error(self):
+        """Test if references are updated one by one when the batch fails"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        refs = [
+            GitRef('589bb080f059834829a2a5955bebfd7c2baa110a', 'refs/heads/master'),
+            GitRef('0000000000000000000000000000000000000001', 'refs/heads/mybranch')
+        ]
+
+        with self.assertLogs(level='WARNING') as cm:
+            repo._update_references(refs)
+
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn('refs/heads/mybranch ref could not be updated', cm.output[0])
+
+        expected = {
+            'refs/heads/master': '589bb080f059834829a2a5955bebfd7c2baa110a'
+        }
+        self.assertDictEqual(discover_refs(new_path), expected)
+
+        shutil.rmtree(new_path)
+
     def test_log(self):
         """Test log command"""
 
@@ -1339,6 +2102,355 @@ class TestGitRepository(TestCaseGit):
 
         shutil.rmtree(new_path)
 
+    def test_log_nul_format(self):
+        """Test log command using the NUL-delimited format"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+        gitlog = repo.log(nul_format=True)
+        gitlog = [field for field in gitlog]
+        self.assertEqual(gitlog[0], 'bc57a9209f096a130dcc5ba7089a8663f758a703')
+        self.assertNotIn('\0', ''.join(gitlog))
+
+        commits = [commit for commit in GitNulParser(gitlog).parse()]
+        self.assertEqual(len(commits), 9)
+
+        shutil.rmtree(new_path)
+
+    def test_log_nul_format_renames(self):
+        """Test if both log formats give the same items for renamed files"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+        commits = [commit for commit in GitParser(repo.log()).parse()]
+        fast_commits = [commit for commit in GitNulParser(repo.log(nul_format=True)).parse()]
+        self.assertListEqual(fast_commits, commits)
+
+        shutil.rmtree(new_path)
+
+        # Files renamed out of any directory
+        origin_path = os.path.join(self.tmp_path, 'renames')
+        create_renames_repository(origin_path)
+
+        repo = GitRepository.clone(origin_path, new_path)
+        commits = [commit for commit in GitParser(repo.log()).parse()]
+        fast_commits = [commit for commit in GitNulParser(repo.log(nul_format=True)).parse()]
+        self.assertListEqual(fast_commits, commits)
+
+        files = [(f['file'], f.get('added')) for f in fast_commits[1]['files']]
+        expected = [('aaa', None), ('aaa => aaa.renamed', '0'),
+                    ('bbb', None), ('bbb => bbb.renamed', '1')]
+        self.assertListEqual(files, expected)
+
+        shutil.rmtree(new_path)
+        shutil.rmtree(origin_path)
+
+    def test_read_records(self):
+        """Test whether records split between blocks are read and decoded"""
+
+        data = 'ñandú\nbar\n\nlast'.encode('utf-8')
+
+        with unittest.mock.patch.object(GitRepository, 'READ_BUFFER_SIZE', 3):
+            lines = [line for line in GitRepository._read_records(io.BytesIO(data))]
+            self.assertListEqual(lines, ['ñandú\n', 'bar\n', '\n', 'last'])
+
+            data = b'\xf1and\xfa\0bar\0\0last\0'
+            records = [r for r in GitRepository._read_records(io.BytesIO(data),
+                                                              delimiter=b'\0')]
+            self.assertListEqual(records, ['\udcf1and\udcfa', 'bar', '', 'last'])
+
+    def test_log_error_message(self):
+        """Test whether the last line of stderr is the cause of a failure"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        with self.assertRaisesRegex(RepositoryError, "return code: 128"):
+            _ = [line for line in repo._exec_nb(['git', 'log', 'nobranch'],
+                                                cwd=repo.dirpath, env=repo.gitenv)]
+
+        with unittest.mock.patch.object(GitRepository, 'STDERR_TAIL_SIZE', 16):
+            with self.assertRaisesRegex(RepositoryError, "git command - .* \\(return code: 1\\)$"):
+                cmd = ['sh', '-c', 'echo "first line" >&2; echo "last line" >&2; exit 1']
+                _ = [line for line in repo._exec_nb(cmd)]
+            self.assertEqual(repo.failed_message, 'last line')
+
+        shutil.rmtree(new_path)
+
+    def test_rev_list(self):
+        """Test rev-list command"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+        commits = repo.rev_list()
+
+        expected = ['bc57a9209f096a130dcc5ba7089a8663f758a703',
+                    '87783129c3f00d2c81a3a8e585eb86a47e39891a',
+                    '7debcf8a2f57f86663809c58b5c07a398be7674c',
+                    'c0d66f92a95e31c77be08dc9d0f11a16715d1885',
+                    'c6ba8f7a1058db3e6b4bc6f1090e932b107605fb',
+                    '589bb080f059834829a2a5955bebfd7c2baa110a',
+                    'ce8e0b86a1e9877f42fe9453ede418519115f367',
+                    '51a3b654f252210572297f47597b31527c475fb8',
+                    '456a68ee1407a77f3e804a30dff245bb6c6b872f']
+        self.assertListEqual(commits, expected)
+
+        commits = repo.rev_list(branches=['lzp'])
+        self.assertListEqual(commits, expected[:6] + [expected[7]])
+
+        commits = repo.rev_list(branches=[])
+        self.assertListEqual(commits, [])
+
+        shutil.rmtree(new_path)
+
+    @unittest.mock.patch.object(GitRepository, 'MIN_LOG_RANGE_SIZE', 1)
+    def test_parallel_log(self):
+        """Test if the parsed log is the same when it is read in parallel"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        expected = [commit for commit in Git.parse_git_log_from_iter(repo.log())]
+        commits = [commit for commit in repo.parallel_log(workers=3)]
+
+        self.assertEqual(len(commits), 9)
+        self.assertListEqual(commits, expected)
+
+        commits = [commit for commit in repo.parallel_log(branches=[], workers=3)]
+        self.assertListEqual(commits, [])
+
+        shutil.rmtree(new_path)
+
+    @unittest.mock.patch.object(GitRepository, 'MIN_LOG_RANGE_SIZE', 1)
+    @unittest.mock.patch.object(GitRepository, 'MAX_LOG_RANGE_SIZE', 2)
+    @unittest.mock.patch.object(GitRepository, 'PENDING_LOG_RANGES_PER_WORKER', 1)
+    def test_parallel_log_bounded(self):
+        """Test if the size and the number of ranges processed at the same time are bounded"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+        expected = [commit for commit in Git.parse_git_log_from_iter(repo.log())]
+
+        submit = concurrent.futures.ProcessPoolExecutor.submit
+
+        with unittest.mock.patch.object(concurrent.futures.ProcessPoolExecutor, 'submit',
+                                        autospec=True, side_effect=submit) as mock_submit:
+            commits = repo.parallel_log(workers=1)
+            first = next(commits)
+
+            # Only the range of the first commit was submitted
+            self.assertEqual(mock_submit.call_count, 1)
+
+            commits = [first] + [commit for commit in commits]
+
+        self.assertListEqual(commits, expected)
+
+        ranges = [call[0][4] for call in mock_submit.call_args_list]
+        self.assertListEqual([len(r) for r in ranges], [2, 2, 2, 2, 1])
+
+        shutil.rmtree(new_path)
+
+    def test_walk(self):
+        """Test if the walked commits are the same than the parsed log"""
+
+        for origin_path in [self.git_path, self.git_detached_path]:
+            new_path = os.path.join(self.tmp_path, 'newgit')
+
+            repo = GitRepository.clone(origin_path, new_path)
+
+            for details in ['raw', 'metadata']:
+                expected = [commit for commit in Git.parse_git_log_from_iter(repo.log(details=details))]
+                commits = [commit for commit in repo.walk(details=details)]
+
+                assert_same_commits(self, commits, expected)
+
+            shutil.rmtree(new_path)
+
+    def test_walk_order(self):
+        """Test if parents are walked before their children"""
+
+        new_path = os.path.join(self.tmp_path, 'ordergit')
+
+        # Commits of both branches are interleaved in time
+        subprocess.check_call(['git', 'init', '-q', new_path])
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '-m', 'A', date='2020-01-01T00:00:00')
+        git_exec(new_path, 'branch', 'other')
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '-m', 'B', date='2020-01-05T00:00:00')
+        git_exec(new_path, 'checkout', '-q', 'other')
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '-m', 'C', date='2020-01-02T00:00:00')
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '-m', 'D', date='2020-01-06T00:00:00')
+        git_exec(new_path, 'checkout', '-q', 'master')
+        git_exec(new_path, 'merge', '-q', '--no-ff', '-m', 'M', 'other', date='2020-01-07T00:00:00')
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '-m', 'E', date='2020-01-03T00:00:00')
+
+        repo = GitRepository('file://' + new_path, os.path.join(new_path, '.git'))
+
+        expected = [commit for commit in Git.parse_git_log_from_iter(repo.log(details='metadata'))]
+        commits = [commit for commit in repo.walk(details='metadata')]
+
+        assert_same_commits(self, commits, expected)
+        self.assertEqual(commits[0]['message'], 'A')
+        self.assertListEqual([commit['message'] for commit in commits[-2:]], ['M', 'E'])
+
+        shutil.rmtree(new_path)
+
+    def test_walk_partial_clone(self):
+        """Test if commits are walked on partial clones without reading blobs"""
+
+        origin_path = os.path.join(self.tmp_path, 'renames')
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        create_renames_repository(origin_path)
+
+        # Commits which only delete or modify files
+        git_exec(origin_path, 'rm', '-q', 'aaa.renamed')
+        git_exec(origin_path, 'commit', '-q', '-m', 'Remove file')
+
+        with open(os.path.join(origin_path, 'bbb.renamed'), 'a') as fd:
+            fd.write('another line\n')
+
+        git_exec(origin_path, 'commit', '-q', '-a', '-m', 'Update file')
+
+        # A deleted file is renamed once and copied to the other files
+        for name in ['ccc', 'ddd', 'eee']:
+            shutil.copy(os.path.join(origin_path, 'bbb.renamed'), os.path.join(origin_path, name))
+
+        git_exec(origin_path, 'rm', '-q', 'bbb.renamed')
+        git_exec(origin_path, 'add', '.')
+        git_exec(origin_path, 'commit', '-q', '-m', 'Copy file')
+
+        repo = GitRepository.clone('file://' + origin_path, new_path, clone_filter='blob:none')
+        nobjects = repo.count_objects()
+
+        expected = [commit for commit in Git.parse_git_log_from_iter(repo.log(details='raw'))]
+
+        # Fetching missing objects on demand would fail
+        shutil.rmtree(origin_path)
+
+        commits = [commit for commit in repo.walk(details='raw')]
+
+        assert_same_commits(self, commits, expected)
+        self.assertEqual(repo.count_objects(), nobjects)
+
+        actions = [[(f['action'], f['file']) for f in commit['files']] for commit in commits[1:]]
+        expected = [
+            [('R100', 'aaa'), ('D', 'bbb'), ('A', 'bbb.renamed')],
+            [('D', 'aaa.renamed')],
+            [('M', 'bbb.renamed')],
+            [('R100', 'bbb.renamed')]
+        ]
+        self.assertListEqual(actions, expected)
+
+        newfiles = [f['newfile'] for f in commits[4]['files']]
+        self.assertListEqual(newfiles, ['eee'])
+
+        shutil.rmtree(new_path)
+
+    def test_walk_abbrev(self):
+        """Test if hashes are abbreviated to the length the log uses"""
+
+        new_path = os.path.join(self.tmp_path, 'abbrevgit')
+        subprocess.check_call(['git', 'init', '-q', new_path])
+
+        # Git uses longer hashes with more than 2^14 packed objects
+        stream = ['blob\ndata %s\n%s\n' % (len(str(i)) + 1, i) for i in range(2 ** 14)]
+        stream.extend(['commit refs/heads/master\n',
+                       'committer John Smith <jsmith@example.com> 1500000000 +0000\n',
+                       'data 9\nOne file\n',
+                       'M 100644 inline aaa\ndata 4\naaa\n'])
+        subprocess.run(['git', 'fast-import', '--quiet'], cwd=new_path, check=True,
+                       input=''.join(stream).encode('utf-8'))
+
+        repo = GitRepository('file://' + new_path, os.path.join(new_path, '.git'))
+
+        for abbrev, size in [(None, 8), ('12', 12), ('no', 40)]:
+            if abbrev:
+                git_exec(new_path, 'config', 'core.abbrev', abbrev)
+
+            expected = [commit for commit in Git.parse_git_log_from_iter(repo.log(details='raw'))]
+            commits = [commit for commit in repo.walk(details='raw')]
+
+            assert_same_commits(self, commits, expected)
+            self.assertEqual(len(commits[0]['files'][0]['indexes'][1]), size)
+
+        shutil.rmtree(new_path)
+
+    def test_walk_messages(self):
+        """Test if messages are formatted like the pretty formats of the log do"""
+
+        new_path = os.path.join(self.tmp_path, 'crlfgit')
+        message = 'Title with CRLF  \r\n\r\nBody\twith a tab \r\n\r\n' \
+                  'Signed-off-by: John Smith <jsmith@example.com>  \r\n'
+
+        subprocess.check_call(['git', 'init', '-q', new_path])
+        git_exec(new_path, 'commit', '-q', '--allow-empty', '--cleanup=verbatim', '-m', message)
+
+        repo = GitRepository('file://' + new_path, os.path.join(new_path, '.git'))
+
+        expected = [commit for commit in Git.parse_git_log_from_iter(repo.log(details='raw'))]
+        commits = [commit for commit in repo.walk(details='raw')]
+
+        self.assertListEqual(commits, expected)
+        self.assertEqual(commits[0]['message'],
+                         'Title with CRLF\n\nBody    with a tab\n\n'
+                         'Signed-off-by: John Smith <jsmith@example.com>')
+        self.assertListEqual(commits[0]['Signed-off-by'], ['John Smith <jsmith@example.com>'])
+
+        shutil.rmtree(new_path)
+
+    def test_walk_selection(self):
+        """Test if commits are walked from the given branches, date and watermark"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        commits = [commit['commit'] for commit in repo.walk(branches=['lzp'])]
+        self.assertEqual(len(commits), 7)
+        self.assertEqual(commits[-1], '51a3b654f252210572297f47597b31527c475fb8')
+
+        commits = [commit for commit in repo.walk(branches=[])]
+        self.assertListEqual(commits, [])
+
+        from_date = datetime.datetime(2014, 2, 11, 22, 7, 49,
+                                      tzinfo=dateutil.tz.tzoffset(None, -28800))
+        commits = [commit['commit'] for commit in repo.walk(from_date=from_date)]
+        self.assertListEqual(commits, ['ce8e0b86a1e9877f42fe9453ede418519115f367',
+                                       '51a3b654f252210572297f47597b31527c475fb8',
+                                       '456a68ee1407a77f3e804a30dff245bb6c6b872f'])
+
+        repo.update_watermark(repo.heads(['lzp']))
+        commits = [commit['commit'] for commit in repo.walk(exclude_watermark=True)]
+        self.assertListEqual(commits, ['ce8e0b86a1e9877f42fe9453ede418519115f367',
+                                       '456a68ee1407a77f3e804a30dff245bb6c6b872f'])
+
+        shutil.rmtree(new_path)
+
+    def test_walk_errors(self):
+        """Test if it raises exceptions walking empty repositories or with full details"""
+
+        new_path = os.path.join(self.tmp_path, 'newgit')
+
+        repo = GitRepository.clone(self.git_path, new_path)
+
+        with self.assertRaisesRegex(RepositoryError, "level of detail full not supported"):
+            _ = [commit for commit in repo.walk(details='full')]
+
+        shutil.rmtree(new_path)
+
+        repo = GitRepository.clone(self.git_empty_path, new_path)
+
+        with self.assertRaises(EmptyRepositoryError):
+            _ = [commit for commit in repo.walk()]
+
+        shutil.rmtree(new_path)
+
     def test_log_from_date(self):
         """Test if commits are returned from the given date"""
 
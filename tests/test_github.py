@@ -27,6 +27,7 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import unittest
 
@@ -40,7 +41,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."
 pkg_resources.declare_namespace('perceval.backends')
 
 from perceval.backend import BackendCommandArgumentParser
-from perceval.cache import Cache
+from perceval.cache import Cache, EntityCache
 from perceval.client import RateLimitHandler
 from perceval.errors import CacheError, RateLimitError
 from perceval.utils import DEFAULT_DATETIME
@@ -645,8 +646,8 @@ class TestGitHubBackend(unittest.TestCase):
                                })
 
         # Check that 404 exception getting user orgs is managed
-        users_orgs = GitHubClient._users_orgs
-        GitHubClient._users_orgs = {}  # clean cache to get orgs using the API
+        users_cache = GitHubClient._users_cache
+        GitHubClient._users_cache = EntityCache()  # clean cache to get orgs using the API
         httpretty.register_uri(httpretty.GET,
                                GITHUB_ORGS_URL,
                                body=orgs, status=404,
@@ -658,7 +659,7 @@ class TestGitHubBackend(unittest.TestCase):
         issues = [issues for issues in github.fetch()]
 
         # Check that a no 404 exception getting user orgs is raised
-        GitHubClient._users_orgs = {}
+        GitHubClient._users_cache = EntityCache()
         httpretty.register_uri(httpretty.GET,
                                GITHUB_ORGS_URL,
                                body=orgs, status=402,
@@ -670,7 +671,7 @@ class TestGitHubBackend(unittest.TestCase):
         with self.assertRaises(requests.exceptions.HTTPError):
             _ = [issues for issues in github.fetch()]
 
-        GitHubClient._users_orgs = users_orgs  # restore the cache
+        GitHubClient._users_cache = users_cache  # restore the cache
 
 
 class TestGitHubBackendCache(unittest.TestCase):
@@ -682,9 +683,8 @@ class TestGitHubBackendCache(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(self.tmp_path)
 
-    @httpretty.activate
-    def test_fetch_from_cache(self):
-        """ Test whether a list of issues is returned from cache """
+    def __register_issues_uris(self):
+        """Register the URIs of the issues used by the cache tests"""
 
         issue_1 = read_file('data/github/github_issue_1')
         issue_2 = read_file('data/github/github_issue_2')
@@ -775,6 +775,12 @@ class TestGitHubBackendCache(unittest.TestCase):
                                    'X-RateLimit-Reset': '15'
                                })
 
+    @httpretty.activate
+    def test_fetch_from_cache(self):
+        """ Test whether a list of issues is returned from cache """
+
+        self.__register_issues_uris()
+
         # First, we fetch the bugs from the server, storing them
         # in a cache
         cache = Cache(self.tmp_path)
@@ -796,6 +802,30 @@ class TestGitHubBackendCache(unittest.TestCase):
         self.assertDictEqual(issues[0], cache_issues[0])
         self.assertDictEqual(issues[1], cache_issues[1])
 
+    @httpretty.activate
+    def test_fetch_from_cache_workers(self):
+        """Test whether issues enriched by several workers are cached in order"""
+
+        self.__register_issues_uris()
+
+        cache = Cache(self.tmp_path)
+        github = GitHub("zhquan_example", "repo", "aaa", cache=cache)
+
+        issues = [issues for issues in github.fetch(workers=4)]
+        cache_issues = [cache_issues for cache_issues in github.fetch_from_cache()]
+
+        expected = [issues for issues in GitHub("zhquan_example", "repo", "aaa").fetch()]
+
+        self.assertEqual(len(issues), 2)
+        self.assertEqual(len(cache_issues), 2)
+
+        for issue, cache_issue, expected_issue in zip(issues, cache_issues, expected):
+            del issue['timestamp']
+            del cache_issue['timestamp']
+            del expected_issue['timestamp']
+            self.assertDictEqual(issue, expected_issue)
+            self.assertDictEqual(cache_issue, expected_issue)
+
     @httpretty.activate
     def test_fetch_from_empty_cache(self):
         """Test if there are not any issues returned when the cache is empty"""
@@ -1185,6 +1215,157 @@ class TestGitHubClient(unittest.TestCase):
         response = client.user("zhquan_example")
         self.assertEqual(response, login)
 
+    @httpretty.activate
+    def test_token_pool(self):
+        """Test whether the client uses the token with the most quota left"""
+
+        rate_limit = read_file('data/github/rate_limit')
+        login = read_file('data/github/github_login')
+
+        quotas = {'token aaa': '20', 'token bbb': '400', 'token ccc': '100'}
+
+        def request_callback(request, uri, headers):
+            remaining = quotas[request.headers['Authorization']]
+            headers['X-RateLimit-Remaining'] = remaining
+            headers['X-RateLimit-Reset'] = str(int(time.time()) + 3600)
+            body = rate_limit if uri.endswith('rate_limit') else login
+            return (200, headers, body)
+
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_RATE_LIMIT,
+                               responses=[httpretty.Response(body=request_callback)])
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_USER_URL,
+                               responses=[httpretty.Response(body=request_callback)])
+
+        client = GitHubClient("zhquan_example", "repo", ['aaa', 'bbb', 'ccc'], None,
+                              min_rate_to_sleep=50)
+        self.assertEqual(client.token, 'bbb')
+        self.assertEqual(client.rate_limit, 400)
+        self.assertEqual(client.tokens_rate_limit['aaa'][0], 20)
+        self.assertEqual(client.tokens_rate_limit['ccc'][0], 100)
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), 3)
+
+        # When the rate limit is exhausted, the next best token is used
+        quotas['token bbb'] = '10'
+        client._users_cache = EntityCache()
+        client.user('zhquan_example')
+        self.assertEqual(client.rate_limit, 10)
+
+        client._users_cache = EntityCache()
+        client.user('zhquan_example')
+        self.assertEqual(client.token, 'ccc')
+        self.assertEqual(httpretty.last_request().headers['Authorization'], 'token ccc')
+        self.assertEqual(client.rate_limit, 100)
+
+    @httpretty.activate
+    def test_token_pool_threads(self):
+        """Test whether requests made from several threads are accounted to their token"""
+
+        rate_limit = read_file('data/github/rate_limit')
+        login = read_file('data/github/github_login')
+
+        now = int(time.time())
+        quotas = {'token aaa': 20, 'token bbb': 20, 'token ccc': 20}
+        resets = {'token aaa': now + 1000, 'token bbb': now + 2000, 'token ccc': now + 3000}
+        lock = threading.Lock()
+
+        def request_callback(request, uri, headers):
+            token = request.headers['Authorization']
+            with lock:
+                quotas[token] -= 1
+                remaining = quotas[token]
+            time.sleep(0.005)
+            headers['X-RateLimit-Remaining'] = str(remaining)
+            headers['X-RateLimit-Reset'] = str(resets[token])
+            body = rate_limit if uri.endswith('rate_limit') else login
+            return (200, headers, body)
+
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_RATE_LIMIT,
+                               responses=[httpretty.Response(body=request_callback)])
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_USER_URL,
+                               responses=[httpretty.Response(body=request_callback)])
+
+        client = GitHubClient("zhquan_example", "repo", ['aaa', 'bbb', 'ccc'], None,
+                              min_rate_to_sleep=10)
+
+        def run():
+            for _ in range(6):
+                client.fetch(GITHUB_USER_URL)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every token was used and its rate limit comes from its responses
+        for token in client.tokens:
+            remaining, reset_ts = client.tokens_rate_limit[token]
+            self.assertLess(quotas['token ' + token], 19)
+            self.assertEqual(reset_ts, resets['token ' + token])
+
+        self.assertEqual(client.session.headers['Authorization'], 'token ' + client.token)
+        self.assertEqual(client.token, client.current_token)
+
+    @httpretty.activate
+    def test_users_cache(self):
+        """Test whether users and organizations are read from a persistent cache"""
+
+        login = read_file('data/github/github_login')
+        orgs = read_file('data/github/github_orgs')
+        rate_limit = read_file('data/github/rate_limit')
+
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_RATE_LIMIT,
+                               body=rate_limit,
+                               status=200,
+                               forcing_headers={
+                                   'X-RateLimit-Remaining': '20',
+                                   'X-RateLimit-Reset': '15'
+                               })
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_USER_URL,
+                               body=login, status=200,
+                               forcing_headers={
+                                   'X-RateLimit-Remaining': '20',
+                                   'X-RateLimit-Reset': '15'
+                               })
+        httpretty.register_uri(httpretty.GET,
+                               GITHUB_ORGS_URL,
+                               body=orgs, status=200,
+                               forcing_headers={
+                                   'X-RateLimit-Remaining': '20',
+                                   'X-RateLimit-Reset': '15'
+                               })
+
+        tmp_path = tempfile.mkdtemp(prefix='perceval_')
+        cache_path = os.path.join(tmp_path, 'users.db')
+
+        client = GitHubClient("zhquan_example", "repo", "aaa", None,
+                              users_cache=EntityCache(cache_path))
+        self.assertEqual(client.user("zhquan_example"), login)
+        self.assertEqual(client.user_orgs("zhquan_example"), orgs)
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), 3)
+
+        # A new client reads the data from the file
+        client = GitHubClient("zhquan_example", "repo", "aaa", None,
+                              users_cache=EntityCache(cache_path))
+        self.assertEqual(client.user("zhquan_example"), login)
+        self.assertEqual(client.user_orgs("zhquan_example"), orgs)
+        self.assertEqual(len(httpretty.HTTPretty.latest_requests), 4)
+        self.assertEqual(httpretty.last_request().path, '/rate_limit')
+
+        # Expired entries are fetched again
+        client = GitHubClient("zhquan_example", "repo", "aaa", None,
+                              users_cache=EntityCache(cache_path, ttl=0))
+        self.assertEqual(client.user("zhquan_example"), login)
+        self.assertEqual(httpretty.last_request().path, '/users/zhquan_example')
+
+        shutil.rmtree(tmp_path)
+
     @httpretty.activate
     def test_get_user_orgs(self):
         """ Test get_user_orgs API call """
@@ -1382,8 +1563,13 @@ class TestGitHubCommand(unittest.TestCase):
                 '--default-sleep-time', '10',
                 '--tag', 'test', '--no-cache',
                 '--api-token', 'abcdefgh',
+                '-t', 'ijklmnop',
                 '--from-date', '1970-01-01',
                 '--enterprise-url', 'https://example.com',
+                '--workers', '4',
+                '--users-cache', '/tmp/users.db',
+                '--users-cache-ttl', '60',
+                '--shared-rate-limit', '/tmp/rate_limit.db',
                 'zhquan_example', 'repo']
 
         parsed_args = parser.parse(*args)
@@ -1393,10 +1579,14 @@ class TestGitHubCommand(unittest.TestCase):
         self.assertEqual(parsed_args.sleep_for_rate, True)
         self.assertEqual(parsed_args.max_retries, 5)
         self.assertEqual(parsed_args.default_sleep_time, 10)
+        self.assertEqual(parsed_args.workers, 4)
+        self.assertEqual(parsed_args.users_cache_path, '/tmp/users.db')
+        self.assertEqual(parsed_args.users_cache_ttl, 60)
+        self.assertEqual(parsed_args.shared_rate_limit, '/tmp/rate_limit.db')
         self.assertEqual(parsed_args.tag, 'test')
         self.assertEqual(parsed_args.from_date, DEFAULT_DATETIME)
         self.assertEqual(parsed_args.no_cache, True)
-        self.assertEqual(parsed_args.api_token, 'abcdefgh')
+        self.assertListEqual(parsed_args.api_token, ['abcdefgh', 'ijklmnop'])
 
 
 if __name__ == "__main__":
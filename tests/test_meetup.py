@@ -30,6 +30,7 @@ import sys
 import tempfile
 import time
 import unittest
+import unittest.mock
 
 import requests
 
@@ -40,6 +41,7 @@ pkg_resources.declare_namespace('perceval.backends')
 
 from perceval.backend import BackendCommandArgumentParser
 from perceval.cache import Cache
+from perceval.client import RATE_LIMIT_DB_DEFAULT_PATH, RateLimitCoordinator
 from perceval.errors import CacheError, RateLimitError
 from perceval.utils import DEFAULT_DATETIME
 from perceval.backends.core.meetup import (Meetup,
@@ -627,7 +629,8 @@ class TestMeetupCommand(unittest.TestCase):
                 '--to-date', '2016-01-01',
                 '--sleep-for-rate',
                 '--min-rate-to-sleep', '10',
-                '--sleep-time', '10']
+                '--sleep-time', '10',
+                '--shared-rate-limit']
 
         expected_ts = datetime.datetime(2016, 1, 1, 0, 0, 0,
                                         tzinfo=dateutil.tz.tzutc())
@@ -643,6 +646,7 @@ class TestMeetupCommand(unittest.TestCase):
         self.assertEqual(parsed_args.sleep_for_rate, True)
         self.assertEqual(parsed_args.min_rate_to_sleep, 10)
         self.assertEqual(parsed_args.sleep_time, 10)
+        self.assertEqual(parsed_args.shared_rate_limit, RATE_LIMIT_DB_DEFAULT_PATH)
 
 
 class TestMeetupClient(unittest.TestCase):
@@ -779,7 +783,7 @@ class TestMeetupClient(unittest.TestCase):
         wait_to_reset = 1
 
         http_requests = setup_http_server(rate_limit=0,
-                                          reset_rate_limit=int(time.time()) + wait_to_reset)
+                                          reset_rate_limit=wait_to_reset)
 
         client = MeetupClient('aaaa', max_items=2,
                               min_rate_to_sleep=2,
@@ -851,6 +855,45 @@ class TestMeetupClient(unittest.TestCase):
         self.assertRegex(req.path, '/sqlpass-es/events')
         self.assertDictEqual(req.querystring, expected)
 
+    @httpretty.activate
+    @unittest.mock.patch('time.time')
+    def test_shared_rate_limit(self, mock_time):
+        """Test if two clients share the rate limit of the same key"""
+
+        mock_time.return_value = 1500000000
+
+        # Meetup sends the seconds left until the reset
+        http_requests = setup_http_server(rate_limit=2,
+                                          reset_rate_limit=100)
+
+        tmp_path = tempfile.mkdtemp(prefix='perceval_')
+        self.addCleanup(shutil.rmtree, tmp_path)
+
+        coordinator = RateLimitCoordinator(os.path.join(tmp_path, 'rate_limit.db'))
+        self.addCleanup(coordinator.close)
+
+        client_a = MeetupClient('aaaa', max_items=2, min_rate_to_sleep=1,
+                                rate_limit_coordinator=coordinator)
+        client_b = MeetupClient('aaaa', max_items=2, min_rate_to_sleep=1,
+                                rate_limit_coordinator=coordinator)
+
+        events_a = client_a.events('sqlpass-es')
+        _ = next(events_a)
+
+        self.assertEqual(client_a.rate_limit, 2)
+        self.assertEqual(client_a.rate_limit_reset_ts, 1500000100)
+
+        # The only request left over the minimum rate is taken by the
+        # second client, so the first one cannot go on
+        events_b = [event for event in client_b.events('sqlpass-es')]
+        self.assertEqual(len(events_b), 1)
+
+        with self.assertRaises(RateLimitError) as e:
+            _ = next(events_a)
+
+        self.assertEqual(e.exception.seconds_to_reset, 101)
+        self.assertEqual(len(http_requests), 2)
+
     @httpretty.activate
     def test_too_many_requests(self):
         """Test if a Retry error is raised"""
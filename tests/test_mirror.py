@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from perceval.backends.core.git import Git
+from perceval.errors import ParseError
+from perceval.mirror import (MirrorResult,
+                             MirrorTask,
+                             format_summary,
+                             mirror_path,
+                             mirror_repositories,
+                             read_mirrors,
+                             shared_store_path)
+
+
+def count_commits(gitpath):
+    """Count the number of commits of a repository"""
+
+    cmd = ['git', 'rev-list', '--all']
+    outs = subprocess.check_output(cmd, cwd=gitpath, env={'LANG': 'C'})
+    return len(outs.decode('utf-8').split())
+
+
+class TestReadMirrors(unittest.TestCase):
+    """Unit tests for read_mirrors"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.mirrors_path = os.path.join(self.test_path, 'mirrors')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_read_mirrors(self):
+        """Test whether repositories to mirror are read from a file"""
+
+        with open(self.mirrors_path, 'w') as fd:
+            fd.write("# List of repositories\n")
+            fd.write("http://example.com/repo.git myproject\n")
+            fd.write("\n")
+            fd.write("   http://example.com/fork.git   myproject\n")
+            fd.write("http://example.com/other.git\n")
+
+        tasks = read_mirrors(self.mirrors_path)
+
+        expected = [
+            MirrorTask(2, 'http://example.com/repo.git', 'myproject'),
+            MirrorTask(4, 'http://example.com/fork.git', 'myproject'),
+            MirrorTask(5, 'http://example.com/other.git', None)
+        ]
+        self.assertListEqual(tasks, expected)
+
+    def test_invalid_mirror(self):
+        """Test whether an exception is raised when a line has too many fields"""
+
+        with open(self.mirrors_path, 'w') as fd:
+            fd.write("http://example.com/repo.git\n")
+            fd.write("http://example.com/repo.git myproject other\n")
+
+        with self.assertRaisesRegex(ParseError, "line 2"):
+            _ = read_mirrors(self.mirrors_path)
+
+
+class TestMirrorRepositories(unittest.TestCase):
+    """Unit tests for mirror_repositories"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+        self.base_dir = os.path.join(self.test_path, 'mirrors')
+
+        data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/git')
+        tar_path = os.path.join(data_path, 'gittest.tar.gz')
+        subprocess.check_call(['tar', '-xzf', tar_path, '-C', self.test_path])
+
+        # Fork with a new commit
+        self.origin_path = os.path.join(self.test_path, 'gittest')
+        self.fork_path = os.path.join(self.test_path, 'gitfork')
+        shutil.copytree(self.origin_path, self.fork_path)
+
+        cmd = ['git', '-c', 'user.name="mock"',
+               '-c', 'user.email="mock@example.com"',
+               'commit', '--allow-empty', '-m', 'Testing mirror']
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                cwd=self.fork_path, env={'LANG': 'C'})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_mirror_repositories(self):
+        """Test whether repositories are mirrored sharing the objects of their group"""
+
+        origin_uri = 'file://' + self.origin_path
+        fork_uri = 'file://' + self.fork_path
+        other_uri = 'file://' + os.path.join(self.test_path, 'notfound')
+
+        tasks = [
+            MirrorTask(1, origin_uri, 'gittest'),
+            MirrorTask(2, fork_uri, 'gittest'),
+            MirrorTask(3, other_uri, None)
+        ]
+
+        results = mirror_repositories(tasks, self.base_dir, max_workers=2)
+
+        self.assertEqual(len(results), 3)
+        self.assertListEqual([r.task_id for r in results], [1, 2, 3])
+        self.assertListEqual([r.action for r in results], ['cloned', 'cloned', 'cloned'])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual(results[1].dirpath, mirror_path(self.base_dir, fork_uri))
+
+        # The fork borrows the objects of the shared store
+        shared_path = shared_store_path(self.base_dir, 'gittest')
+        self.assertEqual(count_commits(shared_path), 9)
+        self.assertEqual(count_commits(results[1].dirpath), 10)
+
+        alternates = os.path.join(results[1].dirpath, 'objects', 'info', 'alternates')
+
+        with open(alternates, 'r') as fd:
+            self.assertEqual(fd.read().strip(), os.path.join(shared_path, 'objects'))
+
+        cmd = ['git', 'config', '--get', 'gc.pruneExpire']
+        outs = subprocess.check_output(cmd, cwd=shared_path, env={'LANG': 'C'})
+        self.assertEqual(outs.decode('utf-8').strip(), 'never')
+
+        # Mirrors are updated on the next run
+        results = mirror_repositories(tasks[:2], self.base_dir)
+        self.assertListEqual([r.action for r in results], ['updated', 'updated'])
+        self.assertListEqual([r.error for r in results], [None, None])
+
+    def test_fetch_from_mirror(self):
+        """Test whether the Git backend reads the commits of a mirror of a group"""
+
+        origin_uri = 'file://' + self.origin_path
+        fork_uri = 'file://' + self.fork_path
+
+        tasks = [
+            MirrorTask(1, origin_uri, 'gittest'),
+            MirrorTask(2, fork_uri, 'gittest')
+        ]
+
+        results = mirror_repositories(tasks, self.base_dir, max_workers=2)
+        self.assertListEqual([r.error for r in results], [None, None])
+
+        # Every object of this mirror is borrowed from the shared store
+        git = Git(origin_uri, results[0].dirpath)
+        commits = [commit for commit in git.fetch()]
+        self.assertEqual(len(commits), 9)
+
+        git = Git(fork_uri, results[1].dirpath)
+        commits = [commit for commit in git.fetch()]
+        self.assertEqual(len(commits), 10)
+        self.assertEqual(commits[-1]['data']['message'], 'Testing mirror')
+
+    def test_mirror_path(self):
+        """Test whether mirrors of local paths are stored under the base directory"""
+
+        self.assertEqual(mirror_path('/mirrors', 'https://example.com/repo.git'),
+                         '/mirrors/https://example.com/repo.git-git')
+        self.assertEqual(mirror_path('/mirrors', '/tmp/repos/repo.git'),
+                         '/mirrors/tmp/repos/repo.git-git')
+
+
+class TestFormatSummary(unittest.TestCase):
+    """Unit tests for format_summary"""
+
+    def test_format_summary(self):
+        """Test whether the results are formatted as a table"""
+
+        results = [
+            MirrorResult(1, 'http://example.com/a', '/tmp/a-git', 'cloned', None, 1.5),
+            MirrorResult(2, 'http://example.com/b', '/tmp/b-git', 'updated', 'fetch failed', 0.25)
+        ]
+
+        summary = format_summary(results).split('\n')
+
+        self.assertEqual(len(summary), 4)
+        self.assertEqual(summary[1], "1      cloned         1.50  http://example.com/a")
+        self.assertEqual(summary[2], "2      updated        0.25  fetch failed")
+        self.assertEqual(summary[3], "2 repositories; 1 mirrored; 1 failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
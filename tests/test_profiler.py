@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Santiago Dueñas <sduenas@bitergia.com>
+#
+
+
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from perceval.profiler import (Profiler,
+                               count_bytes_in,
+                               count_bytes_out,
+                               stage)
+
+
+class TestProfiler(unittest.TestCase):
+    """Unit tests for Profiler class"""
+
+    def test_stages(self):
+        """Test whether the time of nested stages is not charged to their parents"""
+
+        profiler = Profiler()
+        profiler.start()
+
+        with stage('http'):
+            time.sleep(0.05)
+
+            with stage('parse'):
+                time.sleep(0.1)
+
+        count_bytes_in(10)
+        count_bytes_out(20)
+
+        profiler.stop()
+
+        self.assertListEqual(list(profiler.wall.keys()),
+                             ['backend', 'http', 'parse'])
+        self.assertGreaterEqual(profiler.wall['parse'], 0.1)
+        self.assertGreaterEqual(profiler.wall['http'], 0.05)
+        self.assertLess(profiler.wall['http'], 0.1)
+        self.assertAlmostEqual(sum(profiler.wall.values()), profiler.elapsed)
+        self.assertEqual(profiler.bytes_in, 10)
+        self.assertEqual(profiler.bytes_out, 20)
+
+    def test_inactive(self):
+        """Test whether nothing is measured when the profiler is not active"""
+
+        profiler = Profiler()
+        profiler.start()
+        profiler.stop()
+
+        with stage('http'):
+            pass
+
+        count_bytes_in(10)
+
+        self.assertNotIn('http', profiler.wall)
+        self.assertEqual(profiler.bytes_in, 0)
+
+    def test_stages_other_threads(self):
+        """Test whether stages marked by other threads are not accounted"""
+
+        def run_stage():
+            with stage('parse'):
+                time.sleep(0.05)
+
+        profiler = Profiler()
+        profiler.start()
+
+        with stage('http'):
+            thread = threading.Thread(target=run_stage)
+            thread.start()
+            thread.join()
+
+        profiler.stop()
+
+        self.assertListEqual(list(profiler.wall.keys()), ['backend', 'http'])
+        self.assertGreaterEqual(profiler.wall['http'], 0.05)
+
+    def test_track_items(self):
+        """Test whether the time spent by the consumer of items is charged to a stage"""
+
+        def fetch():
+            for x in range(3):
+                time.sleep(0.02)
+                yield x
+
+        profiler = Profiler()
+        profiler.start()
+
+        for _ in profiler.track_items(fetch(), 'output'):
+            time.sleep(0.05)
+
+        profiler.stop()
+
+        self.assertEqual(profiler.items, 3)
+        self.assertGreaterEqual(profiler.wall['output'], 0.15)
+        self.assertGreaterEqual(profiler.wall['backend'], 0.06)
+        self.assertLess(profiler.wall['backend'], 0.15)
+
+    def test_report(self):
+        """Test whether the report includes the totals and the stages"""
+
+        profiler = Profiler()
+        profiler.start()
+
+        with stage('cache'):
+            pass
+
+        profiler.stop()
+
+        report = profiler.report().split('\n')
+
+        self.assertEqual(report[0], "Profiling report")
+        self.assertTrue(report[1].startswith("items: 0"))
+        self.assertEqual(report[2], "bytes in: 0; bytes out: 0")
+        self.assertTrue(report[5].startswith("backend"))
+        self.assertTrue(report[6].startswith("cache"))
+
+
+class TestProfilerDump(unittest.TestCase):
+    """Unit tests for cProfile stats dumped by Profiler"""
+
+    def setUp(self):
+        self.test_path = tempfile.mkdtemp(prefix='perceval_')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_path)
+
+    def test_dump_stats(self):
+        """Test whether cProfile stats are written to a file"""
+
+        prof_path = os.path.join(self.test_path, 'run.prof')
+
+        profiler = Profiler(profile_path=prof_path)
+        profiler.start()
+        sorted(range(1000), reverse=True)
+        profiler.stop()
+
+        stats = pstats.Stats(prof_path)
+        self.assertGreater(stats.total_calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()